@@ -52,6 +52,10 @@ def build():
     excludes = ['test', '.*', '*.pyc', '*.pyo']
     local('rm -f dist/%s' % _TAR_FILE)
     with lcd(os.path.join(_current_path(), 'www')):
+        # 合并、压缩JS和CSS，生成带hash的文件名
+        local('python3 assets.py')
+        # 预先压缩静态文件，运行时直接发送 .gz
+        local('python3 compress.py static')
         cmd = ['tar', '--dereference', '-czvf', '../dist/%s' % _TAR_FILE]
         cmd.extend(['--exclude=\'%s\'' % ex for ex in excludes])
         cmd.extend(includes)
@@ -71,8 +75,8 @@ def deploy():
         sudo('chown www-data:www-data www')
         sudo('chown -R www-data:www-data %s' % newdir)
     with settings(warn_only=True):
-        sudo('supervisorctl stop awesome')
-        sudo('supervisorctl start awesome')
+        # server.py 收到 HUP 后从新目录启动 worker，预热好了再让旧 worker 处理完手上的请求退出，不停服
+        sudo('supervisorctl signal HUP awesome')
         sudo('/etc/init.d/nginx reload')
 
 RE_FILES = re.compile('\r?\n')
@@ -119,8 +123,7 @@ def rollback():
         sudo('ln -s %s www' % old)
         sudo('chown www-data:www-data www')
         with settings(warn_only=True):
-            sudo('supervisorctl stop awesome')
-            sudo('supervisorctl start awesome')
+            sudo('supervisorctl signal HUP awesome')
             sudo('/etc/init.d/nginx reload')
         print ('ROLLBACKED OK.')
 
@@ -9,9 +9,11 @@ from aiohttp import web
 from jinja2 import Environment, FileSystemLoader
 
 from config import configs
-import orm
+import orm, idgen, writebehind, qtrace, search, counters, serialize, conditional, compress, assets, pagecache, ratelimit, timing, metrics, cluster, render, jobs, live
+from models import Blog, Comment
 
-from coroweb import add_routes, add_static
+from coroweb import add_routes, add_static, request_data
+from streaming import JsonStream, write_json_stream
 
 from handlers import cookie2user, COOKIE_NAME
 
@@ -45,128 +47,271 @@ def init_jinja2(app, **kw):
         for name, f in filters.items():
             env.filters[name] = f
             # 给webapp设置模板
+    # 模板里可以直接调用的函数，例如 assets('awesome.js')
+    globals = kw.get('globals', None)
+    if globals is not None:
+        env.globals.update(globals)
     app['__templating__'] = env
 
 
-# 记录URL日志的logger
-@asyncio.coroutine
-def logger_factory(app, handler):
-    @asyncio.coroutine
-    def logger(request):
-        logging.info('Requst : %s, %s' % (request.method, request.path))
-        return (yield from handler(request))
+# 中间件都是新式的 @web.middleware: middleware(request, handler)，每个请求少一层工厂调用和生成器包装
+# 顺序见 init() 里的 MIDDLEWARES
+# 打开 configs.timing 时按阶段记录耗时(app['__timing__'])，见 timing.py
+# 各阶段的耗时同时记到当前请求的 RequestTimer 上，用来生成 Server-Timing 响应头
 
-    return logger
+def _observe(request, stage, start):
+    elapsed = time.perf_counter() - start
+    timing.add(stage, elapsed)
+    recorder = request.app['__timing__']
+    if recorder is not None:
+        recorder.observe(stage, elapsed)
 
-# 这个解析request参数的，不知为何没有使用到。
-@asyncio.coroutine
-def data_factory(app, handler):
-    @asyncio.coroutine
-    def parse_data(request):
-        if request.method == 'POST':
-            if request.content_type.startswith('application/json'):
-                request.__data__ = yield from request.json()
-                logging.info('request json : %s' % str(request.__data__))
-            elif request.content_type.startswith('application/x-www-form-urlencoded'):
-                request.__data__ = yield from request.post()
-                logging.info('request form : %s' % str(request.__data__))
-        return (yield from handler(request))
 
-    return parse_data
+def _report_timing(request, resp, timer, elapsed):
+    opts = request.app['__request_timing__']
+    user = getattr(request, '__user__', None)
+    # 流式响应已经把响应头发出去了，加不了
+    if resp is not None and not resp.prepared and (opts.server_timing or (user is not None and user.admin)):
+        resp.headers['Server-Timing'] = timer.server_timing(elapsed)
+    # 推送连接(SSE)一直开着，不算慢请求
+    if resp is not None and resp.content_type == 'text/event-stream':
+        return
+    if opts.slow_request and elapsed >= opts.slow_request:
+        logging.warning('slow request: %s' % json.dumps(dict(
+            method=request.method, path=request.path_qs, status=resp.status if resp is not None else 500,
+            user=user.id if user is not None else None, ms=round(elapsed * 1e3, 2), timings=timer.as_dict())))
+
+
+# 记录URL日志的logger，同时记录整个请求的耗时
+@web.middleware
+async def logger_middleware(request, handler):
+    logging.info('Requst : %s, %s' % (request.method, request.path))
+    start = time.perf_counter()
+    timer, token = timing.start_request()
+    resp = None
+    try:
+        resp = await handler(request)
+        return resp
+    except web.HTTPException as e:
+        # 重定向、404 等以异常的形式返回，也是响应
+        resp = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        recorder = request.app['__timing__']
+        if recorder is not None:
+            recorder.observe('total', elapsed)
+        m = request.app['__metrics__']
+        if m is not None:
+            m.observe_request(request.method, metrics.route_label(request), resp.status if resp is not None else 500, elapsed)
+        _report_timing(request, resp, timer, elapsed)
+        timing.end_request(token)
+
+
+# 按路由限流，放在 auth 之前，被限流的请求不会查数据库
+@web.middleware
+async def ratelimit_middleware(request, handler):
+    limiter = request.app['__ratelimiter__']
+    if limiter is not None:
+        wait = limiter.check(request, request.cookies.get(COOKIE_NAME))
+        if wait:
+            logging.warning('rate limited: %s %s' % (request.method, request.path))
+            body = serialize.dumps(dict(error='ratelimit', data=ratelimit.retry_after(wait), message='请求太频繁，请稍后再试'))
+            resp = web.Response(status=429, body=body, headers={'Retry-After': ratelimit.retry_after(wait)})
+            resp.content_type = 'application/json;charset=utf-8'
+            return resp
+    return await handler(request)
+
+
+# gzip压缩响应，按 app['__compress__'] 的设置跳过太小的和不值得压缩的类型
+@web.middleware
+async def compress_middleware(request, handler):
+    r = await handler(request)
+    opts = request.app['__compress__']
+    # 流式响应、已经编码过的(预压缩的静态文件)、没有响应体的都不处理
+    if not opts.enabled or type(r) is not web.Response or r.status in (204, 304) or 'Content-Encoding' in r.headers:
+        return r
+    body = r.body
+    if not isinstance(body, bytes) or not compress.is_compressible(r.content_type):
+        return r
+    # 不管这次压不压缩，缓存都要按 Accept-Encoding 区分
+    compress.add_vary(r)
+    if len(body) < opts.min_size or not compress.accepts_gzip(request):
+        return r
+    r.body = compress.gzip_bytes(body, opts.level)
+    r.headers['Content-Encoding'] = 'gzip'
+    # 压缩后的字节不同，强ETag改成弱ETag
+    etag = r.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        r.headers['ETag'] = 'W/' + etag
+    return r
+
+
+# 匿名访客的整页缓存，命中时直接返回缓存的字节，不经过后面的 auth 和处理函数
+@web.middleware
+async def pagecache_middleware(request, handler):
+    cache = pagecache.get_cache()
+    # 带着登录cookie的请求页面上有用户信息，不能用缓存
+    if cache is None or request.method != 'GET' or COOKIE_NAME in request.cookies:
+        return await handler(request)
+    found = cache.lookup(request.path, request.query)
+    if found is None:
+        return await handler(request)
+    tag, key = found
+    page = cache.get(key)
+    if page is None:
+        generation = cache.generation(tag)
+        r = await handler(request)
+        if type(r) is web.Response and r.status == 200 and isinstance(r.body, bytes) and not r.cookies \
+                and 'Content-Encoding' not in r.headers:
+            headers = {k: r.headers[k] for k in pagecache.CACHED_HEADERS if k in r.headers}
+            cache.put(key, tag, generation, r.body, headers)
+        return r
+    headers = dict(page.headers)
+    if page.gz is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    if conditional.is_fresh(request, headers.get('ETag')):
+        headers.pop('Content-Type', None)
+        return web.HTTPNotModified(headers=headers)
+    if page.gz is not None and compress.accepts_gzip(request):
+        headers['Content-Encoding'] = 'gzip'
+        if 'ETag' in headers and not headers['ETag'].startswith('W/'):
+            headers['ETag'] = 'W/' + headers['ETag']
+        return web.Response(body=page.gz, headers=headers)
+    return web.Response(body=page.body, headers=headers)
+
+
+# 这个解析request参数的，不知为何没有使用到。
+# 解析结果缓存在 request.__data__ 上，后面的 RequestHandler 不会再解析一次
+@web.middleware
+async def data_middleware(request, handler):
+    if request.method == 'POST':
+        data = await request_data(request)
+        logging.info('request data : %s' % str(data))
+    return await handler(request)
 
 
 # 是为了验证当前的这个请求用户是否在登录状态下，或是否是伪造的sha1
-@asyncio.coroutine
-def auth_factory(app, handler):
-    @asyncio.coroutine
-    def auth(request):
-        logging.info('check user: %s %s' % (request.method, request.path))
-        request.__user__ = None
-        # 获取到cookie字符串
-        cookie_str = request.cookies.get(COOKIE_NAME)
-        if cookie_str:
-            # 通过反向解析字符串和与数据库对比获取出user
-            user = yield from cookie2user(cookie_str)
-            if user:
-                logging.info('set current user: %s' % user.email)
-                # user存在则绑定到request上，说明当前用户是合法的
-                request.__user__ = user
-        if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
-            return web.HTTPFound('/signin')
-            # 执行下一步
-        return (yield from handler(request))
-
-    return auth
+@web.middleware
+async def auth_middleware(request, handler):
+    logging.info('check user: %s %s' % (request.method, request.path))
+    request.__user__ = None
+    # 获取到cookie字符串
+    cookie_str = request.cookies.get(COOKIE_NAME)
+    if cookie_str:
+        start = time.perf_counter()
+        # 通过反向解析字符串和与数据库对比获取出user
+        user = await cookie2user(cookie_str)
+        _observe(request, 'auth', start)
+        if user:
+            logging.info('set current user: %s' % user.email)
+            # user存在则绑定到request上，说明当前用户是合法的
+            request.__user__ = user
+    if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
+        return web.HTTPFound('/signin')
+    # 执行下一步
+    return await handler(request)
+
+
+# 给GET响应加上 ETag / Last-Modified，客户端缓存仍然有效时返回 304
+# 处理函数可以用 conditional.check() 在渲染之前就判断出来并直接返回 304
+@web.middleware
+async def conditional_middleware(request, handler):
+    request.__etag__ = None
+    request.__last_modified__ = None
+    r = await handler(request)
+    return conditional.apply(request, r)
 
 
 # 响应处理
 # 总结下来一个请求在服务端收到后的方法调用顺序是:
-# loop.run_forver()->handle_request->logger_factory->auth_factory->response_factory->RequestHandler().__call__->get或post->具体的handler
-# ->把结果返回给response_factory(构造出正确web.Response对象，以正确的方式返回给客户端)
+# loop.run_forver()->handle_request->logger_middleware->...->auth_middleware->response_middleware->RequestHandler().__call__->get或post->具体的handler
+# ->把结果返回给response_middleware(构造出正确web.Response对象，以正确的方式返回给客户端)
 # 那么结果处理的情况就是:
 # 由handler构造出要返回的具体对象
 # 然后在这个返回的对象上加上'__method__'和'__route__'属性，以标识别这个对象并使接下来的程序容易处理
-# RequestHandler目的就是从URL函数中分析其需要接收的参数，从request中获取必要的参数，调用URL函数,然后把结果返回给response_factory
-# response_factory在拿到经过处理后的对象，经过一系列对象类型和格式的判断，构造出正确web.Response对象，以正确的方式返回给客户端
+# RequestHandler目的就是从URL函数中分析其需要接收的参数，从request中获取必要的参数，调用URL函数,然后把结果返回给response_middleware
+# response_middleware在拿到经过处理后的对象，经过一系列对象类型和格式的判断，构造出正确web.Response对象，以正确的方式返回给客户端
 # 在这个过程中，我们只用关心我们的handler的处理就好了，其他的都走统一的通道，如果需要差异化处理，就在通道中选择适合的地方添加处理代码
-@asyncio.coroutine
-def response_factory(app, handler):
-    @asyncio.coroutine
-    def response(request):
-        logging.info('Response handler...')
-        # 调用相应的handler处理request
-        r = yield from handler(request)
-        logging.info('r = %s' % str(r))
-        # 如果响应结果为web.StreamResponse类，则直接把它作为响应返回
-        if isinstance(r, web.StreamResponse):
-            return r
-            # 如果响应结果为字节流，则把字节流塞到response的body里，设置响应类型为流类型，返回
-        if isinstance(r, bytes):
-            resp = web.Response(body=r)
-            resp.content_type = 'application/octet-stream'
-            return resp
-            # 如果响应结果为字符串
-        if isinstance(r, str):
-            # 先判断是不是需要重定向，是的话直接用重定向的地址重定向
-            if r.startswith('redirect:'):
-                return web.HTTPFound(r[9:])
-                # 不是重定向的话，把字符串当做是html代码来处理
-            resp = web.Response(body=r.encode('utf-8'))
-            resp.content_type = 'text/html;charset=utf-8'
-            return resp
-            # 如果响应结果为字典
-        if isinstance(r, dict):
-            # 先查看一下有没有'__template__'为key的值
-            template = r.get('__template__')
-            # 如果没有，说明要返回json字符串，则把字典转换为json返回，对应的response类型设为json类型
-            if template is None:
-                resp = web.Response(
-                    body=json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'))
-                resp.content_type = 'application/json;charset=utf-8'
-                return resp
-            else:
-                r['__user__'] = request.__user__
-                # 如果有'__template__'为key的值，则说明要套用jinja2的模板，'__template__'Key对应的为模板网页所在位置
-                resp = web.Response(body=app['__templating__'].get_template(template).render(**r).encode('utf-8'))
-                resp.content_type = 'text/html;charset=utf-8'
-                # 以html的形式返回
-                return resp
-                # 如果响应结果为int
-        if isinstance(r, int) and r >= 100 and r < 600:
-            return web.Response(t)
-            # 如果响应结果为tuple且数量为2
-        if isinstance(r, tuple) and len(r) == 2:
-            t, m = r
-            # 如果tuple的第一个元素是int类型且在100到600之间，这里应该是认定为t为http状态码，m为错误描述
-            # 或者是服务端自己定义的错误码+描述
-            if isinstance(t, int) and t >= 100 and t < 600:
-                return web.Response(status=t, text=str(m))
-            # default: 默认直接以字符串输出
-            resp = web.Response(body=str(r).encode('utf-8'))
-            resp.content_type = 'text/plain;charset=utf-8'
+@web.middleware
+async def response_middleware(request, handler):
+    logging.info('Response handler...')
+    # 调用相应的handler处理request
+    start = time.perf_counter()
+    r = await handler(request)
+    _observe(request, 'handler', start)
+    logging.info('r = %s' % str(r))
+    # 如果响应结果为web.StreamResponse类，则直接把它作为响应返回
+    if isinstance(r, web.StreamResponse):
+        return r
+    # 如果响应结果为 EventStream，则保持连接，推送这个主题上发布的事件
+    if isinstance(r, live.EventStream):
+        return await live.write_event_stream(request, r)
+    # 如果响应结果为 JsonStream 或异步迭代器，则边迭代边以分块的 JSON 数组输出
+    if hasattr(r, '__aiter__'):
+        r = JsonStream(r)
+    if isinstance(r, JsonStream):
+        start = time.perf_counter()
+        resp = await write_json_stream(request, r)
+        _observe(request, 'serialize', start)
+        return resp
+    # 如果响应结果为字节流，则把字节流塞到response的body里，设置响应类型为流类型，返回
+    if isinstance(r, bytes):
+        resp = web.Response(body=r)
+        resp.content_type = 'application/octet-stream'
+        return resp
+    # 如果响应结果为字符串
+    if isinstance(r, str):
+        # 先判断是不是需要重定向，是的话直接用重定向的地址重定向
+        if r.startswith('redirect:'):
+            return web.HTTPFound(r[9:])
+        # 不是重定向的话，把字符串当做是html代码来处理
+        resp = web.Response(body=r.encode('utf-8'))
+        resp.content_type = 'text/html;charset=utf-8'
+        return resp
+    # 如果响应结果为字典
+    if isinstance(r, dict):
+        # 先查看一下有没有'__template__'为key的值
+        template = r.get('__template__')
+        # 如果没有，说明要返回json字符串，则把字典转换为json返回，对应的response类型设为json类型
+        if template is None:
+            start = time.perf_counter()
+            resp = web.Response(body=serialize.dumps(r))
+            _observe(request, 'serialize', start)
+            resp.content_type = 'application/json;charset=utf-8'
             return resp
+        # 页面没有变化时不用再渲染
+        if conditional.check_page(request, r):
+            return web.HTTPNotModified()
+        r['__user__'] = request.__user__
+        # 如果有'__template__'为key的值，则说明要套用jinja2的模板，'__template__'Key对应的为模板网页所在位置
+        start = time.perf_counter()
+        resp = web.Response(body=request.app['__templating__'].get_template(template).render(**r).encode('utf-8'))
+        _observe(request, 'render', start)
+        resp.content_type = 'text/html;charset=utf-8'
+        # 以html的形式返回
+        return resp
+    # 如果响应结果为int
+    if isinstance(r, int) and r >= 100 and r < 600:
+        return web.Response(status=r)
+    # 如果响应结果为tuple且数量为2
+    if isinstance(r, tuple) and len(r) == 2:
+        t, m = r
+        # 如果tuple的第一个元素是int类型且在100到600之间，这里应该是认定为t为http状态码，m为错误描述
+        # 或者是服务端自己定义的错误码+描述
+        if isinstance(t, int) and t >= 100 and t < 600:
+            return web.Response(status=t, text=str(m))
+    # default: 默认直接以字符串输出
+    resp = web.Response(body=str(r).encode('utf-8'))
+    resp.content_type = 'text/plain;charset=utf-8'
+    return resp
+
 
-    return response
+# 请求经过中间件的顺序
+MIDDLEWARES = [
+    logger_middleware, ratelimit_middleware, compress_middleware, pagecache_middleware, auth_middleware,
+    conditional_middleware, response_middleware
+]
 
 
 def datetime_filter(t):
@@ -183,32 +328,139 @@ def datetime_filter(t):
     return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
 
 
+def worker_path(path, worker):
+    '''
+    多进程运行时每个 worker 各用一个文件，0号 worker 和单进程运行时用原来的文件名。
+    '''
+    return path if not worker else '%s.%d' % (path, worker)
+
+
+async def close_trace(app):
+    recorder = app['__trace__']
+    if recorder is not None:
+        # 之后的查询(比如写完评论缓冲)不再录制，不会写到已经关闭的文件里
+        orm.set_recorder(None)
+        recorder.close()
+        app['__trace__'] = None
+
+
 @asyncio.coroutine
-def init(loop):
+def init_app(loop, worker=0, workers=1, generation=0):
+    '''
+    创建 app，不监听端口。server.py 在每个 worker 进程里调用，worker 为进程编号，每个进程有自己的连接池。
+    generation 是热重载的代数(0 或 1)，热重载期间新旧两组 worker 同时在运行，各用一段不同的 worker_id。
+    '''
     # 创建数据库连接池，db参数传配置文件里的配置db
     yield from orm.create_pool(loop=loop, **configs.db)
+    # 录制查询轨迹
+    recorder = None
+    if configs.trace.path:
+        recorder = qtrace.TraceRecorder(worker_path(configs.trace.path, worker), configs.trace.sample, configs.trace.args)
+        orm.set_recorder(recorder)
+    # 配置了分片的话，为每个分片创建连接池
+    if configs.shards:
+        yield from orm.create_shard_pools(loop, configs.shards, configs.shard_replicas, **configs.db)
+    # 评论写缓冲，启动时会先把日志里上次没写库的评论补写进去
+    wb = configs.write_behind
+    if wb.comments:
+        # 每写库一批评论，按博客汇总更新一次评论计数
+        queue = writebehind.WriteBehindQueue(Comment, worker_path(wb.journal, worker), wb.max_batch, wb.flush_interval, wb.fsync,
+                                             on_flush=counters.comments_flushed)
+        yield from queue.start(loop)
+        writebehind.register(queue)
+    # 加载搜索索引，索引文件缺失或过期时从数据库重建
+    if configs.search.index:
+        yield from search.init(loop, configs.search.index, Blog)
+    # 定期修正博客评论计数，多进程时只在0号 worker 上做
+    if configs.counters.reconcile_interval and worker == 0:
+        counters.schedule(loop, configs.counters.reconcile_interval)
+    # 初始化整数ID生成器，多进程部署时每个进程的worker_id必须不同: 从配置的 worker_id 开始按代数和进程编号递增
+    idgen.init(configs.ids.worker_id + generation * workers + worker, worker_bits=configs.ids.worker_bits, sequence_bits=configs.ids.sequence_bits)
+    # 长文章的markdown转换放到进程池里
+    rc = configs.render
+    if rc.processes:
+        render.init(rc.processes, rc.inline_limit, rc.max_inflight, rc.max_waiting, rc.timeout)
+    # 后台任务队列，每个进程都执行任务
+    jc = configs.jobs
+    if jc.enabled:
+        jobs.init(jobs.resolve_path(jc.path, jc.data_dir), concurrency=jc.concurrency, poll_interval=jc.poll_interval, timeout=jc.timeout,
+                  max_attempts=jc.max_attempts, retry_delay=jc.retry_delay).start(loop)
+    # 多进程时和其他 worker 互相通知缓存失效
+    if workers > 1:
+        cluster.init(loop, configs.server.cluster_dir)
     # middleware是一种拦截器，一个URL在被某个函数处理前，可以经过一系列的middleware的处理。
     # middleware的用处就在于把通用的功能从每个URL处理函数(handler)中拿出来，集中放到一个地方。
-    # middlewares中的每个factory接受两个参数，app 和 handler(即middlewares中的下一个handler)？？？
-    # 譬如这里logger_factory的handler参数其实就是response_factory()middleware？？？
-    # middlewares的最后一个元素的Handler会通过routes查找到相应的，其实就是routes注册的对应handler？？？
-    app = web.Application(loop=loop, middlewares=[
-        logger_factory, auth_factory, response_factory
-    ])
+    # 每个middleware接受 request 和 handler 两个参数，handler 是排在它后面的middleware，
+    # 最后一个middleware的handler就是routes里注册的RequestHandler
+    app = web.Application(loop=loop, middlewares=MIDDLEWARES)
+    # 退出时写完缓冲里的查询轨迹
+    app['__trace__'] = recorder
+    app.on_cleanup.append(close_trace)
+    # 按阶段统计耗时，定期写进日志；Server-Timing 响应头和慢请求日志的设置
+    app['__request_timing__'] = configs.timing
+    app['__timing__'] = None
+    if configs.timing.enabled:
+        app['__timing__'] = timing.StageRecorder()
+        timing.schedule_report(loop, app['__timing__'], configs.timing.report_interval)
+    # /metrics 的请求计数、延迟直方图和事件循环延迟
+    app['__metrics__'] = None
+    if configs.metrics.enabled:
+        app['__metrics__'] = metrics.Metrics()
+        app['__metrics__'].start(loop, configs.metrics.lag_interval)
+    # 请求体大小上限，超过的请求直接返回413；同时缓冲的请求体总量上限，超过的返回503
+    app['__max_body_size__'] = configs.request.max_body_size
+    app['__max_buffered_body__'] = configs.request.max_buffered_body
+    # 评论实时推送，退出时先断开所有推送连接
+    lc = configs.live
+    if lc.enabled:
+        live.init(loop, max_subscribers=lc.max_subscribers, queue_size=lc.queue_size, history=lc.history,
+                  heartbeat=lc.heartbeat, retry=lc.retry)
+        app.on_shutdown.append(live.on_shutdown)
+    # 登录、注册、评论接口的限流
+    rl = configs.ratelimit
+    app['__ratelimiter__'] = ratelimit.RateLimiter(rl.routes, rl.max_keys, rl.trust_proxy) if rl.enabled else None
+    # 响应压缩的设置
+    app['__compress__'] = configs.compress
+    # 匿名访客的整页缓存
+    if configs.pagecache.enabled:
+        pagecache.init(configs.pagecache.max_entries, configs.pagecache.ttl)
+    # 读取静态资源构建生成的 manifest.json
+    assets.init()
     # 初始化jinja2模板
-    init_jinja2(app, filters=dict(datetime=datetime_filter))
+    init_jinja2(app, filters=dict(datetime=datetime_filter), globals=dict(assets=assets.assets))
     # 添加请求的handlers，即各请求相对应的处理函数,参数'handlers'为模块名。
     add_routes(app, 'handlers')
     # 添加静态文件所在地址
     add_static(app)
-    # 启动
-    srv = yield from loop.create_server(app.make_handler(), '127.0.0.1', 9000)
-    logging.info('server started at http://127.0.0.1:9000...')
+    return app
+
+
+@asyncio.coroutine
+def warm_up(app):
+    '''
+    新 worker 接流量之前: 编译好所有模板，确认每个数据库都连得上，启动markdown进程池。
+    '''
+    env = app['__templating__']
+    for name in env.list_templates(extensions=['html']):
+        env.get_template(name)
+    for name, pool in orm.named_pools():
+        yield from orm.select('select 1', (), pool=pool)
+    yield from render.warm_up()
+
+
+@asyncio.coroutine
+def init(loop):
+    app = yield from init_app(loop)
+    # 启动；多进程运行见 server.py
+    host, port = configs.server.host, configs.server.port
+    srv = yield from loop.create_server(app.make_handler(), host, port)
+    logging.info('server started at http://%s:%s...' % (host, port))
     return srv
 
 
 # 入口，固定写法
-# 获取eventloop然后加入运行事件
-loop = asyncio.get_event_loop()
-loop.run_until_complete(init(loop))
-loop.run_forever()
+# 获取eventloop然后加入运行事件；被 bench_middleware.py 等导入时不启动服务
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(init(loop))
+    loop.run_forever()
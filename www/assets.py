@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+静态资源构建: 压缩 awesome.js / awesome.css，把页面用到的CSS、JS各合并成一个文件，
+文件名带上内容的hash，写到 static/dist/ 下，并生成 static/dist/manifest.json.
+
+带hash的文件内容永远不会变，可以用 Cache-Control: immutable 长期缓存。
+模板里用 assets() 取得URL，构建过就是合并后的文件，没构建(开发时)就是原来的各个文件:
+
+    {% for url in assets('awesome.css') %}<link rel="stylesheet" href="{{ url }}">{% endfor %}
+
+构建(fabfile build() 会执行):
+    python3 assets.py
+'''
+
+import os, re, sys, json, hashlib, logging
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+URL_PREFIX = '/static/'
+
+# 合并后的文件名 -> 按顺序合并的源文件(相对 static 目录)
+BUNDLES = {
+    'awesome.css': ['css/uikit.min.css', 'css/uikit.gradient.min.css', 'css/awesome.css'],
+    # 登录页不能用 awesome.css，那里面隐藏了 #vm
+    'signin.css': ['css/uikit.min.css', 'css/uikit.gradient.min.css'],
+    'awesome.js': ['js/jquery.min.js', 'js/sha1.min.js', 'js/uikit.min.js', 'js/sticky.min.js',
+                   'js/vue.min.js', 'js/awesome.js'],
+    # 登录页原来就没有加载 sticky
+    'signin.js': ['js/jquery.min.js', 'js/sha1.min.js', 'js/uikit.min.js', 'js/vue.min.js', 'js/awesome.js']
+}
+
+_RE_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_RE_CSS_SPACE = re.compile(r'\s+')
+_RE_CSS_PUNCT = re.compile(r'\s*([{};:,>])\s*')
+_RE_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+# 这些字符后面的 / 是正则表达式的开始而不是除号
+_JS_REGEX_PREFIX = '(,=:[!&|?{};+-*%<>~^'
+
+
+def minify_css(text):
+    text = _RE_CSS_COMMENT.sub('', text)
+    text = _RE_CSS_SPACE.sub(' ', text)
+    text = _RE_CSS_PUNCT.sub(r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    '''
+    去掉注释、缩进和空行。换行保留，不会因为自动插入分号改变语义。
+    '''
+    out = []
+    i, n = 0, len(text)
+    last = ''
+    while i < n:
+        c = text[i]
+        if c in '\'"`':
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' else 1
+            out.append(text[i:j + 1])
+            i = j + 1
+            last = c
+        elif text.startswith('//', i):
+            j = text.find('\n', i)
+            i = n if j < 0 else j
+        elif text.startswith('/*', i):
+            j = text.find('*/', i + 2)
+            i = n if j < 0 else j + 2
+            out.append(' ')
+        elif c == '/' and (last == '' or last in _JS_REGEX_PREFIX):
+            # 正则表达式字面量，原样输出
+            j = i + 1
+            in_class = False
+            while j < n and (text[j] != '/' or in_class) and text[j] != '\n':
+                if text[j] == '\\':
+                    j += 1
+                elif text[j] == '[':
+                    in_class = True
+                elif text[j] == ']':
+                    in_class = False
+                j += 1
+            out.append(text[i:j + 1])
+            i = j + 1
+            last = '/'
+        else:
+            out.append(c)
+            if not c.isspace():
+                last = c
+            i += 1
+    lines = (line.strip() for line in ''.join(out).split('\n'))
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def _minify(path, text):
+    # 已经压缩过的第三方库不再处理
+    if '.min.' in os.path.basename(path):
+        return text
+    if path.endswith('.css'):
+        return minify_css(text)
+    if path.endswith('.js'):
+        return minify_js(text)
+    return text
+
+
+def _hashed_name(name, data):
+    base, ext = os.path.splitext(name)
+    return '%s.%s%s' % (base, hashlib.md5(data).hexdigest()[:10], ext)
+
+
+class _Builder(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.dist = os.path.join(root, DIST_DIR)
+        self.manifest = {}
+        self.written = set()
+
+    def write(self, name, data):
+        hashed = _hashed_name(name, data)
+        path = os.path.join(self.dist, hashed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.isfile(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+        self.written.add(os.path.normpath(path))
+        self.manifest[name] = '%s/%s' % (DIST_DIR, hashed.replace(os.sep, '/'))
+        return self.manifest[name]
+
+    def copy(self, relpath):
+        # CSS里引用的字体、图片也带上hash，否则不能长期缓存
+        if relpath not in self.manifest:
+            with open(os.path.join(self.root, relpath), 'rb') as f:
+                self.write(relpath, f.read())
+        return self.manifest[relpath]
+
+    def rewrite_urls(self, css, source):
+        # 把 url(../fonts/x.woff) 换成带hash的文件；合并后的文件在 dist/ 下，相对路径要重新算
+        def repl(m):
+            url = m.group(2)
+            if url.startswith(('data:', 'http:', 'https:', '//', '/')):
+                return m.group(0)
+            path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+            relpath = os.path.normpath(os.path.join(os.path.dirname(source), path)).replace(os.sep, '/')
+            if not os.path.isfile(os.path.join(self.root, relpath)):
+                logging.warning('%s: missing %s' % (source, url))
+                return m.group(0)
+            return 'url(%s%s)' % (URL_PREFIX + self.copy(relpath), suffix)
+        return _RE_CSS_URL.sub(repl, css)
+
+    def bundle(self, name, sources):
+        parts = []
+        for source in sources:
+            with open(os.path.join(self.root, source), encoding='utf-8') as f:
+                text = _minify(source, f.read())
+            if name.endswith('.css'):
+                text = self.rewrite_urls(text, source)
+            parts.append(text.strip())
+        # JS文件之间加分号换行，防止前一个文件结尾没有分号
+        sep = '\n' if name.endswith('.css') else ';\n'
+        return self.write(name, (sep.join(parts) + '\n').encode('utf-8'))
+
+    def clean(self):
+        # 删掉上次构建留下的、这次没有用到的文件(包括它们的 .gz)
+        for dirpath, dirnames, filenames in os.walk(self.dist):
+            for name in filenames:
+                path = os.path.normpath(os.path.join(dirpath, name))
+                if name == MANIFEST or path in self.written or path[:-3] in self.written:
+                    continue
+                os.remove(path)
+
+
+def build(root=STATIC_ROOT, bundles=BUNDLES):
+    '''
+    构建所有 bundles，写出 manifest.json，返回 manifest(名字 -> static 下的相对路径)。
+    '''
+    builder = _Builder(root)
+    for name, sources in sorted(bundles.items()):
+        logging.info('bundle %s => %s' % (name, builder.bundle(name, sources)))
+    builder.clean()
+    with open(os.path.join(builder.dist, MANIFEST), 'w') as f:
+        json.dump(builder.manifest, f, indent=2, sort_keys=True)
+    return builder.manifest
+
+
+# 运行时: 名字 -> URL列表
+_urls = {}
+
+
+def init(root=STATIC_ROOT, bundles=BUNDLES):
+    '''
+    读取 manifest.json。没有构建过时 assets() 返回各个源文件的URL。
+    '''
+    _urls.clear()
+    path = os.path.join(root, DIST_DIR, MANIFEST)
+    manifest = {}
+    if os.path.isfile(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    else:
+        logging.warning('%s not found, serving unbundled assets.' % path)
+    for name, sources in bundles.items():
+        if name in manifest:
+            _urls[name] = [URL_PREFIX + manifest[name]]
+        else:
+            _urls[name] = [URL_PREFIX + s for s in sources]
+
+
+def assets(name):
+    '''
+    模板中使用: 返回 name 这个资源的URL列表。
+    '''
+    return _urls[name]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    manifest = build(sys.argv[1] if len(sys.argv) > 1 else STATIC_ROOT)
+    print('%s files in manifest' % len(manifest))
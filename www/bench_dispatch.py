@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+coroweb.RequestHandler 分发开销的微基准: 同样的处理函数和请求，
+对比每次请求都 inspect.signature 的旧实现和路由注册时预先生成绑定计划的新实现.
+
+    python3 bench_dispatch.py
+    python3 bench_dispatch.py --number 200000
+'''
+
+import sys, time, asyncio, inspect, logging, argparse
+
+from urllib import parse
+
+from coroweb import RequestHandler
+
+
+class LegacyRequestHandler(RequestHandler):
+    '''
+    重构前的 __call__，只用于对比。
+    '''
+
+    def __init__(self, app, func, path=''):
+        self._app = app
+        self._func = func
+
+    async def __call__(self, request):
+        required_args = inspect.signature(self._func).parameters
+        logging.info('required args: %s' % str(required_args))
+        args = await self.get_args(request)
+        kw = {arg: value for arg, value in args.items() if arg in required_args}
+        kw.update(dict(**request.match_info))
+        if 'request' in required_args:
+            kw['request'] = request
+        logging.info('call with args: %s' % str(kw))
+        return await self._func(**kw)
+
+    async def get_args(self, request):
+        if request.method == 'GET':
+            qs = request.query_string
+            return {k: v[0] for k, v in parse.parse_qs(qs, True).items()}
+        return dict()
+
+
+class FakeRequest(object):
+
+    def __init__(self, method='GET', query_string='', match_info=None):
+        self.method = method
+        self.query_string = query_string
+        self.match_info = match_info or {}
+        self.content_type = ''
+
+
+async def get_blog(id):
+    return id
+
+
+async def api_blogs(*, page='1'):
+    return page
+
+
+async def api_update_blog(id, request, *, name='', summary='', content=''):
+    return id
+
+
+CASES = [
+    ('get_blog(id)', get_blog, '/blog/{id}', FakeRequest(match_info={'id': '1467000000000'})),
+    ('api_blogs(*, page)', api_blogs, '/api/blogs', FakeRequest(query_string='page=2')),
+    ('api_update_blog(id, request)', api_update_blog, '/api/blogs/{id}',
+     FakeRequest(match_info={'id': '1467000000000'})),
+]
+
+
+def measure(loop, handler, request, number):
+    async def run():
+        for i in range(number):
+            await handler(request)
+    start = time.perf_counter()
+    loop.run_until_complete(run())
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='RequestHandler dispatch overhead')
+    parser.add_argument('--number', type=int, default=50000)
+    parser.add_argument('--log-level', default='INFO', help='the app logs at INFO by default')
+    args = parser.parse_args(argv)
+    # 日志输出到空处理器：保留格式化字符串的开销，但不刷屏
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()), handlers=[logging.NullHandler()])
+    loop = asyncio.get_event_loop()
+    print('%-32s %12s %12s %8s' % ('handler', 'legacy us', 'planned us', 'speedup'))
+    for name, func, path, request in CASES:
+        legacy = measure(loop, LegacyRequestHandler(None, func, path), request, args.number)
+        planned = measure(loop, RequestHandler(None, func, path), request, args.number)
+        print('%-32s %12.2f %12.2f %7.1fx' % (name, legacy, planned, legacy / planned))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
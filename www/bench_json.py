@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+JSON序列化的基准: /api/comments、/api/blogs 那样的 dict(page=Page, comments=[Comment...]) 结果，
+对比原来 json.dumps(default=lambda o: o.__dict__) 的写法和 serialize.dumps.
+
+	python3 bench_json.py
+	python3 bench_json.py --rows 2 10 100 1000
+'''
+
+import sys, json, time, argparse
+
+import serialize
+from apis import Page
+from models import Blog, Comment
+
+
+def legacy_dumps(r):
+	return json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8')
+
+
+def comments_payload(n):
+	comments = [Comment(id='%050d' % i, blog_id='%050d' % 1, user_id='%050d' % 2, user_name='读者%s' % i,
+						user_image='http://www.gravatar.com/avatar/x?d=mm&s=120', content='评论内容 ' * 20,
+						created_at=1467000000.0 + i) for i in range(n)]
+	return dict(page=Page(n * 5, 2, n), comments=comments)
+
+
+def blogs_payload(n):
+	blogs = [Blog(id='%050d' % i, user_id='%050d' % 2, user_name='elie', user_image='about:blank',
+				  name='博客标题%s' % i, summary='摘要 ' * 30, content='正文内容 ' * 500, created_at=1467000000.0 + i,
+				  comment_count=i, last_comment_at=1467000000.0) for i in range(n)]
+	return dict(page=Page(n * 5, 2, n), blogs=blogs)
+
+
+def measure(fn, payload, number):
+	fn(payload)
+	best = None
+	for i in range(3):
+		start = time.perf_counter()
+		for j in range(number):
+			fn(payload)
+		elapsed = (time.perf_counter() - start) / number
+		best = elapsed if best is None else min(best, elapsed)
+	return best * 1e6
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='JSON serialization benchmark')
+	parser.add_argument('--rows', type=int, nargs='+', default=[2, 10, 100, 1000])
+	args = parser.parse_args(argv)
+	print('serialize backend: %s' % serialize.BACKEND)
+	print('%-20s %8s %12s %12s %8s %10s' % ('payload', 'rows', 'legacy us', 'new us', 'speedup', 'bytes'))
+	for name, make in (('api_comments', comments_payload), ('api_blogs', blogs_payload)):
+		for n in args.rows:
+			payload = make(n)
+			number = max(10, 20000 // n)
+			legacy = measure(legacy_dumps, payload, number)
+			new = measure(serialize.dumps, payload, number)
+			print('%-20s %8d %12.1f %12.1f %7.1fx %10d' % (name, n, legacy, new, legacy / new, len(serialize.dumps(payload))))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+中间件链的微基准:
+
+1. 链本身的开销: 同样层数、什么都不做的中间件，对比旧式工厂(每个请求都要 await 一遍工厂，
+   每层一个 @asyncio.coroutine 生成器)和新式 @web.middleware(每层一个 functools.partial)。
+   拼链的方式和 aiohttp 的 Application._handle 一样.
+2. app.MIDDLEWARES 整条链处理一个返回JSON的请求，打开分阶段计时，输出各阶段的统计.
+
+    python3 bench_middleware.py
+    python3 bench_middleware.py --number 100000
+'''
+
+import sys, time, asyncio, logging, argparse, functools
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+import app as webapp
+import timing
+from config import configs
+
+
+def legacy_factory():
+    '''
+    重构前的写法，只用于对比。
+    '''
+    @asyncio.coroutine
+    def factory(app, handler):
+        @asyncio.coroutine
+        def middleware(request):
+            return (yield from handler(request))
+        return middleware
+    return factory
+
+
+def new_middleware():
+    @web.middleware
+    async def middleware(request, handler):
+        return await handler(request)
+    return middleware
+
+
+async def run_legacy(app, factories, handler, request):
+    # aiohttp 对旧式中间件: 每个请求都 await 一遍所有工厂
+    for factory in reversed(factories):
+        handler = await factory(app, handler)
+    return await handler(request)
+
+
+async def run_new(app, middlewares, handler, request):
+    # aiohttp 对新式中间件: 每层只是绑定下一层的 partial
+    for m in reversed(middlewares):
+        handler = functools.update_wrapper(functools.partial(m, handler=handler), handler)
+    return await handler(request)
+
+
+async def api_blogs(request):
+    return dict(page=dict(page_index=1, item_count=0), blogs=[])
+
+
+def measure(loop, run, number):
+    async def loop_body():
+        for i in range(number):
+            await run()
+    start = time.perf_counter()
+    loop.run_until_complete(loop_body())
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def make_app(recorder):
+    app = web.Application()
+    app['__timing__'] = recorder
+    app['__request_timing__'] = configs.timing
+    app['__metrics__'] = None
+    app['__ratelimiter__'] = None
+    app['__compress__'] = configs.compress
+    app['__max_body_size__'] = configs.request.max_body_size
+    app['__max_buffered_body__'] = configs.request.max_buffered_body
+    return app
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='middleware chain overhead')
+    parser.add_argument('--number', type=int, default=50000)
+    parser.add_argument('--log-level', default='INFO', help='the app logs at INFO by default')
+    args = parser.parse_args(argv)
+    # 日志输出到空处理器：保留格式化字符串的开销，但不刷屏(导入app时已经 basicConfig 过了)
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, args.log_level.upper()))
+    root.handlers = [logging.NullHandler()]
+    loop = asyncio.get_event_loop()
+
+    depth = len(webapp.MIDDLEWARES)
+    app = make_app(None)
+    request = make_mocked_request('GET', '/api/blogs', app=app)
+    factories = [legacy_factory() for i in range(depth)]
+    middlewares = [new_middleware() for i in range(depth)]
+    legacy = measure(loop, lambda: run_legacy(app, factories, api_blogs, request), args.number)
+    new = measure(loop, lambda: run_new(app, middlewares, api_blogs, request), args.number)
+    print('%-32s %12s %12s %8s' % ('chain', 'legacy us', 'new us', 'speedup'))
+    print('%-32s %12.2f %12.2f %7.1fx' % ('%d pass-through layers' % depth, legacy, new, legacy / new))
+
+    recorder = timing.StageRecorder()
+    app = make_app(recorder)
+    request = make_mocked_request('GET', '/api/blogs', headers={'Accept-Encoding': 'gzip'}, app=app)
+    full = measure(loop, lambda: run_new(app, webapp.MIDDLEWARES, api_blogs, request), args.number)
+    print('%-32s %12s %12.2f' % ('app.MIDDLEWARES, JSON', '', full))
+    print()
+    print('%-10s %10s %10s %10s %10s %10s' % ('stage', 'count', 'mean us', 'p50 us', 'p90 us', 'p99 us'))
+    for stage, count, mean, p50, p90, p99 in recorder.summary():
+        print('%-10s %10d %10.1f %10.1f %10.1f %10.1f' % (stage, count, mean * 1e6, p50 * 1e6, p90 * 1e6, p99 * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
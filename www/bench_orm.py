@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+orm.py 的微基准测试，数据库换成 fakedb.FakePool，测出来的只有orm自身的开销
+(拼SQL、cls(**r)构造对象、getValueOrDefault、日志等).
+
+	python3 bench_orm.py                 # 运行并和 bench_orm_baseline.json 对比
+	python3 bench_orm.py --save          # 运行并把结果保存为新的基线
+	python3 bench_orm.py --rows 1000     # findAll 每次返回的行数
+	python3 bench_orm.py --log-level INFO  # 打开orm的SQL日志，看日志本身的开销
+
+save/update/remove 的 retained 里有 FakePool.executed 记下的语句和参数，不是orm泄漏.
+提交的基线是在 Python 3.7 上跑的，换了机器先 --save 一次再对比.
+'''
+
+import gc, os, sys, time, json, asyncio, logging, argparse, tracemalloc
+
+import orm
+from fakedb import FakePool
+from models import Blog
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_orm_baseline.json')
+
+
+def _blog_row(i):
+	return dict(id='%050d' % i, user_id='u%s' % i, user_name='elie', user_image='about:blank',
+				name='blog %s' % i, summary='summary %s' % i, content='content ' * 50, created_at=1467000000.0 + i)
+
+
+def make_cases(rows):
+	blog = Blog(**_blog_row(0))
+
+	def find():
+		return Blog.find(blog.id)
+
+	def find_all():
+		return Blog.findAll(orderBy='created_at desc', limit=(0, rows))
+
+	def save():
+		return Blog(user_id='u', user_name='elie', user_image='about:blank', name='n', summary='s', content='c').save()
+
+	def update():
+		return blog.update()
+
+	def remove():
+		return blog.remove()
+
+	return [('find', find), ('findAll(%s)' % rows, find_all), ('save', save), ('update', update), ('remove', remove)]
+
+
+def _run(loop, op, n, keep=None):
+	@asyncio.coroutine
+	def run():
+		for i in range(n):
+			r = yield from op()
+			if keep is not None:
+				keep.append(r)
+	loop.run_until_complete(run())
+
+
+def measure(loop, op, number, repeat):
+	# 先预热，再取 repeat 次中最快的一次
+	_run(loop, op, max(1, number // 10))
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		_run(loop, op, number)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	# 单独跑一遍统计内存分配(tracemalloc会拖慢运行，所以不和计时混在一起)，对比前后快照里内存块的个数:
+	# allocs 为每次操作分配、返回时还在用的内存块(返回的结果先留着，对象本身也算在内)，
+	# retained 为结果丢掉之后仍然留着的内存块(泄漏的迹象)
+	samples = min(number, 200)
+	keep = []
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	_run(loop, op, samples, keep)
+	during = tracemalloc.take_snapshot()
+	del keep[:]
+	gc.collect()
+	after = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+	allocs = sum(s.count_diff for s in during.compare_to(before, 'filename') if s.count_diff > 0)
+	retained = sum(s.count_diff for s in after.compare_to(before, 'filename'))
+	return dict(ops=number / best, allocs=allocs / samples, retained=retained / samples)
+
+
+def compare(results, baseline, threshold):
+	regressed = []
+	print('%-16s %14s %12s %14s %10s' % ('op', 'ops/sec', 'allocs/op', 'retained/op', 'vs base'))
+	for name, r in results.items():
+		base = baseline.get(name)
+		delta = ''
+		if base:
+			change = (r['ops'] - base['ops']) / base['ops'] * 100
+			delta = '%+.1f%%' % change
+			if change < -threshold:
+				regressed.append(name)
+		print('%-16s %14.0f %12.1f %14.2f %10s' % (name, r['ops'], r['allocs'], r['retained'], delta))
+	return regressed
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='orm micro benchmarks')
+	parser.add_argument('--rows', type=int, default=100, help='rows returned by findAll')
+	parser.add_argument('--number', type=int, default=2000, help='operations per run')
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--log-level', default='WARNING')
+	parser.add_argument('--save', action='store_true', help='save results as the new baseline')
+	parser.add_argument('--threshold', type=float, default=10.0, help='fail if ops/sec drops by more than this percent')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+	pool = FakePool({'blogs': [_blog_row(i) for i in range(max(args.rows, 1))]})
+	orm.set_pool(pool)
+	loop = asyncio.get_event_loop()
+
+	results = {}
+	for name, op in make_cases(args.rows):
+		number = args.number if not name.startswith('findAll') else max(1, args.number * 10 // max(args.rows, 10))
+		results[name] = measure(loop, op, number, args.repeat)
+
+	baseline = {}
+	if os.path.exists(BASELINE):
+		with open(BASELINE) as f:
+			baseline = json.load(f)
+	regressed = compare(results, baseline, args.threshold)
+	if args.save:
+		with open(BASELINE, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+		print('baseline saved to %s' % BASELINE)
+		return 0
+	if regressed:
+		print('regressed by more than %s%%: %s' % (args.threshold, ', '.join(regressed)))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
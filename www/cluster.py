@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+多进程运行(server.py)时 worker 之间的广播.
+
+页面缓存、请求合并的缓存和搜索索引都在各个 worker 的内存里，一个 worker 上写了博客或评论，
+其他 worker 也要让缓存失效、更新索引。每个 worker 绑定一个 unix 数据报套接字 <dir>/worker-<pid>.sock，
+publish() 给目录里其他的套接字各发一个数据报，热重载时还没退出的旧 worker 也能收到:
+
+    cluster.subscribe('search', on_search_change)
+    cluster.publish('search', blog_id)
+
+对方正在重启时消息会丢，但重启后的 worker 缓存本来就是空的。单进程运行(app.py)时 publish 什么都不做.
+'''
+
+import os, json, socket, asyncio, logging
+
+import pagecache, singleflight
+
+_sock = None
+_dir = None
+_path = None
+# 消息类型 -> 处理函数
+_handlers = {}
+
+
+def init(loop, directory):
+    '''
+    本进程开始接收其他 worker 的消息。
+    '''
+    global _sock, _dir, _path
+    os.makedirs(directory, exist_ok=True)
+    _dir = directory
+    _path = os.path.join(directory, 'worker-%d.sock' % os.getpid())
+    # pid 被重复使用了，原来的进程早就不在了
+    if os.path.exists(_path):
+        os.unlink(_path)
+    _sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    _sock.bind(_path)
+    _sock.setblocking(False)
+    loop.add_reader(_sock.fileno(), _receive, loop)
+
+
+def close(loop):
+    global _sock
+    if _sock is None:
+        return
+    loop.remove_reader(_sock.fileno())
+    _sock.close()
+    _sock = None
+    if os.path.exists(_path):
+        os.unlink(_path)
+
+
+def subscribe(kind, fn):
+    _handlers[kind] = fn
+
+
+def publish(kind, *args):
+    if _sock is None:
+        return
+    data = json.dumps([kind, args]).encode('utf-8')
+    for name in os.listdir(_dir):
+        peer = os.path.join(_dir, name)
+        if not name.endswith('.sock') or peer == _path:
+            continue
+        try:
+            _sock.sendto(data, peer)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 崩溃的 worker 留下的套接字文件
+            try:
+                os.unlink(peer)
+            except FileNotFoundError:
+                pass
+        except OSError as e:
+            # 对方收不过来(缓冲区满)，最多等缓存过期
+            logging.warning('cluster: send %s to %s failed: %s' % (kind, peer, e))
+
+
+def _receive(loop):
+    while True:
+        try:
+            data = _sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        try:
+            kind, args = json.loads(data.decode('utf-8'))
+            fn = _handlers.get(kind)
+            if fn is None:
+                continue
+            r = fn(*args)
+            # 处理函数可以是协程(比如要查库)
+            if asyncio.iscoroutine(r):
+                asyncio.ensure_future(r, loop=loop).add_done_callback(_log_error)
+        except Exception as e:
+            logging.exception('cluster: bad message %r: %s' % (data[:200], e))
+
+
+def _log_error(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logging.error('cluster: message handler failed: %s' % fut.exception())
+
+
+def _invalidate_local(*tags):
+    pagecache.invalidate(*tags)
+    singleflight.invalidate(*tags)
+
+
+def invalidate(*tags):
+    '''
+    让所有 worker 里带有这些标签的缓存页面和处理函数结果失效。
+    '''
+    _invalidate_local(*tags)
+    publish('invalidate', *tags)
+
+
+subscribe('invalidate', _invalidate_local)
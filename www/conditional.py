@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+条件GET: ETag / Last-Modified 校验器和 304 响应.
+
+处理函数在查库、渲染之前算出版本，客户端缓存仍然有效时直接返回 304:
+
+    if conditional.check(request, etag=conditional.make_etag(blog.id, blog.updated_at), last_modified=blog.updated_at):
+        return web.HTTPNotModified()
+
+返回模板的处理函数也可以在结果里带上 '__version__' 和 '__last_modified__'，由 response_middleware 在渲染前检查.
+
+conditional_middleware 把校验器写进最终的响应头；处理函数没有给出 ETag 的 GET 响应，
+按响应体的 md5 自动生成一个，省不了渲染但省得了传输.
+'''
+
+import hashlib, email.utils
+
+from aiohttp import web
+
+
+def make_etag(*parts):
+    '''
+    用决定页面内容的各个版本字段生成弱ETag，例如 make_etag(blog.id, blog.updated_at)。
+    '''
+    key = '\x00'.join(str(p) for p in parts)
+    return 'W/"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def _etag_matches(header, etag):
+    # If-None-Match 用弱比较: 忽略 W/ 前缀
+    if header.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == opaque:
+            return True
+    return False
+
+
+def _parse_http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_fresh(request, etag=None, last_modified=None):
+    '''
+    客户端缓存的版本是否仍然有效。有 If-None-Match 时只看 ETag，忽略 If-Modified-Since。
+    '''
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    inm = request.headers.get('If-None-Match')
+    if inm is not None:
+        return etag is not None and _etag_matches(inm, etag)
+    ims = request.headers.get('If-Modified-Since')
+    if ims is not None and last_modified is not None:
+        since = _parse_http_date(ims)
+        # HTTP日期只精确到秒
+        return since is not None and int(last_modified) <= since
+    return False
+
+
+def check(request, etag=None, last_modified=None):
+    '''
+    记下本次响应的校验器，返回客户端缓存是否仍然有效(有效时处理函数应返回 304)。
+    '''
+    request.__etag__ = etag
+    request.__last_modified__ = last_modified
+    return is_fresh(request, etag, last_modified)
+
+
+def check_page(request, r):
+    '''
+    模板参数里带有 '__version__' 时，按版本和当前用户生成ETag并检查，返回客户端缓存是否仍然有效。
+    这样处理函数的结果和请求无关，可以给多个请求共用(见 @get 的 coalesce)。
+    '''
+    version = r.get('__version__')
+    if version is None:
+        return False
+    # 页面上会显示当前登录的用户，ETag 要区分用户
+    user = request.__user__
+    etag = make_etag(user.id if user is not None else '', *version)
+    return check(request, etag=etag, last_modified=r.get('__last_modified__'))
+
+
+def apply(request, resp):
+    '''
+    给响应加上校验器；没有显式校验器的 200 响应按响应体生成 ETag，客户端版本一致时换成 304。
+    '''
+    if request.method not in ('GET', 'HEAD'):
+        return resp
+    etag = getattr(request, '__etag__', None)
+    last_modified = getattr(request, '__last_modified__', None)
+    if etag is None and last_modified is None:
+        # 只处理一次性生成好的响应体；流式响应、文件和重定向原样返回
+        if type(resp) is not web.Response or resp.status != 200 or not resp.body or 'ETag' in resp.headers:
+            return resp
+        etag = '"%s"' % hashlib.md5(resp.body).hexdigest()
+        if is_fresh(request, etag):
+            resp = web.HTTPNotModified()
+    if resp.status not in (200, 304):
+        return resp
+    if etag is not None:
+        resp.headers['ETag'] = etag
+    if last_modified is not None:
+        resp.headers['Last-Modified'] = email.utils.formatdate(last_modified, usegmt=True)
+    if 'Cache-Control' not in resp.headers:
+        # 内容随时可能变化: 允许缓存，但每次使用前都要带着校验器回来确认
+        resp.headers['Cache-Control'] = 'no-cache'
+    return resp
@@ -32,6 +32,10 @@ def merga(default, override):
 				r[k] = override[k]
 		else:
 			r[k] = v
+	# override里新增的配置项(比如 shards 下的各个分片)也要保留
+	for k, v in override.items():
+		if k not in default:
+			r[k] = v
 	return r
 
 #把配置文件转换为Dict类实例
@@ -1,4 +1,7 @@
 #默认配置文件
+
+import os
+
 configs = {
 	'debug' : True,
 	'db' : {
@@ -10,6 +13,141 @@ configs = {
 	},
 	'session' :{
 		'secret' : 'Awesome'
+	},
+	# 主键类型: 'string' 为旧的50位字符串ID，'bigint' 为 idgen.py 生成的整数ID(需先跑 migrate_ids.py)
+	# server.py 的 worker 从 worker_id 开始各用一个ID，热重载时新旧两组同时运行，共占 2 x workers 个
+	'ids' : {
+		'type' : 'string',
+		'worker_id' : 0,
+		'worker_bits' : 5,
+		'sequence_bits' : 7
+	},
+	# 评论表按 blog_id 水平分片: {分片名: 数据库配置}，未写的项(用户名、密码等)沿用 db 的配置。
+	# 每个分片库都要建好 comments 表；为空时评论和其他表一样存在 db 里。例如:
+	# 'shards' : {'c0' : {'db' : 'awesome_c0'}, 'c1' : {'port' : 3307, 'db' : 'awesome_c1'}}
+	'shards' : {},
+	'shard_replicas' : 100,
+	# 评论写缓冲: 先写本地日志并立即返回，攒够 max_batch 条或每隔 flush_interval 秒批量写库
+	# 日志的相对路径相对于代码目录，每次部署都是新目录；用 server.py 热重载时最好配成绝对路径，旧版本没写库的评论才能被接手
+	'write_behind' : {
+		'comments' : False,
+		'journal' : 'comments.journal',
+		'max_batch' : 100,
+		'flush_interval' : 1.0,
+		'fsync' : False
+	},
+	# 查询轨迹录制: path 不为空时把每条SQL写进这个NDJSON文件，用 replay.py 在本地重放
+	'trace' : {
+		'path' : None,
+		'sample' : 1.0,
+		'args' : True
+	},
+	# 全文搜索索引文件，为空时不启用 /api/search
+	'search' : {
+		'index' : 'search.index'
+	},
+	# 每隔多少秒用 comments 表的真实数据修正一次博客的评论计数，0 为不修正
+	'counters' : {
+		'reconcile_interval' : 3600
+	},
+	# POST请求体的大小上限(字节)，长博客草稿要能放得下；
+	# max_buffered_body 是同时在内存里缓冲的请求体总字节数，超过时新的请求返回503
+	'request' : {
+		'max_body_size' : 4 * 1024 * 1024,
+		'max_buffered_body' : 64 * 1024 * 1024
+	},
+	# gzip压缩动态响应: 小于 min_size 字节的不压缩，level 1-9 越大越省流量越费CPU
+	# 静态文件用 python3 compress.py 预先压缩，不受这里影响
+	'compress' : {
+		'enabled' : True,
+		'min_size' : 1024,
+		'level' : 6
+	},
+	# 匿名访客的首页和博客页整页缓存，写博客和评论时失效；ttl 是缓存的最长保存时间(秒)
+	'pagecache' : {
+		'enabled' : True,
+		'max_entries' : 1000,
+		'ttl' : 300
+	},
+	# 按路由限流: 'ip' 按客户端IP、'user' 按登录会话，rate 为每秒补充的次数，burst 为最多连续请求的次数
+	# trust_proxy: 从nginx设置的 X-Real-IP 取客户端IP(app只监听127.0.0.1，请求都经过nginx)；max_keys 为最多记录的客户端数
+	'ratelimit' : {
+		'enabled' : True,
+		'trust_proxy' : True,
+		'max_keys' : 100000,
+		'routes' : {
+			'POST /api/authenticate' : {'ip' : {'rate' : 0.2, 'burst' : 10}},
+			'POST /api/register' : {'ip' : {'rate' : 0.02, 'burst' : 5}},
+			'POST /api/blogs/{id}/comments' : {'ip' : {'rate' : 0.5, 'burst' : 20}, 'user' : {'rate' : 0.1, 'burst' : 5}}
+		}
+	},
+	# python3 server.py 多进程运行: workers 为 0 时按CPU核数启动，各 worker 用 SO_REUSEPORT 监听同一个端口；
+	# unix 不为空时改为监听这个 unix 套接字(给nginx用)。cluster_dir 放 worker 之间互相通知用的套接字。
+	# 单进程的 python3 app.py 只用 host 和 port
+	'server' : {
+		'host' : '127.0.0.1',
+		'port' : 9000,
+		'workers' : 0,
+		'reuse_port' : True,
+		'unix' : None,
+		'unix_mode' : 0o660,
+		'cluster_dir' : '/tmp/awesome',
+		'shutdown_timeout' : 10.0,
+		'restart_delay' : 1.0,
+		# 热重载(kill -HUP 主进程)时从这个目录启动新 worker，为空时取启动 server.py 的目录(不解析符号链接)
+		'app_dir' : None,
+		# 新 worker 要在这么多秒内预热完成，否则放弃这次重载
+		'ready_timeout' : 60.0
+	},
+	# 博客正文的markdown转换: 不短于 inline_limit 个字符的放到 processes 个进程里转换，processes 为 0 时都在事件循环里转换；
+	# 同时转换 max_inflight 篇，再多的排队，排队超过 max_waiting 篇或转换超过 timeout 秒返回503
+	'render' : {
+		'processes' : 2,
+		'inline_limit' : 8192,
+		'max_inflight' : 4,
+		'max_waiting' : 32,
+		'timeout' : 10.0
+	},
+	# 后台任务队列(jobs.py): 任务存在 path 这个SQLite文件里，每个进程同时执行 concurrency 个，没有新任务时每隔 poll_interval 秒查一次；
+	# 执行超过 timeout 秒算失败，失败后隔 retry_delay 秒、2倍、4倍...重试，失败 max_attempts 次后不再执行。
+	# 多进程运行时所有 worker 共用这个文件。path 是相对路径时放在 data_dir 下，不放在当前目录:
+	# worker 的当前目录是这次发布的目录，部署切换 www 符号链接并热重载后，旧文件里排着的任务就没人执行了
+	'jobs' : {
+		'enabled' : True,
+		'data_dir' : os.path.join(os.path.expanduser('~'), '.awesome'),
+		'path' : 'jobs.sqlite3',
+		'concurrency' : 2,
+		'poll_interval' : 1.0,
+		'timeout' : 60.0,
+		'max_attempts' : 5,
+		'retry_delay' : 5.0
+	},
+	# 博客页的评论实时推送(Server-Sent Events): 每个进程最多 max_subscribers 个连接，
+	# 每个连接最多积压 queue_size 个事件，超过就断开让它重连；每个博客保留最近 history 条评论，重连时补发；
+	# 每隔 heartbeat 秒给空闲连接发一个注释行，防止被代理断开；retry 是断开后浏览器重连的间隔(毫秒)
+	'live' : {
+		'enabled' : True,
+		'max_subscribers' : 10000,
+		'queue_size' : 16,
+		'history' : 32,
+		'heartbeat' : 20.0,
+		'retry' : 3000
+	},
+	# 按阶段(auth、handler、render、serialize、total)统计请求耗时，每隔 report_interval 秒写进日志
+	# 管理员的请求带 Server-Timing 响应头，server_timing 为 True 时所有请求都带(只在调试时打开)
+	# 超过 slow_request 秒的请求把各部分的耗时写一行日志，0 表示不记录
+	'timing' : {
+		'enabled' : False,
+		'report_interval' : 60,
+		'server_timing' : False,
+		'slow_request' : 0.5
+	},
+	# /metrics(Prometheus文本格式)，管理员登录后可以看，Prometheus 抓取时带 Authorization: Bearer <token>
+	# token 为空时只有管理员能看；lag_interval 是测事件循环延迟的间隔(秒)
+	'metrics' : {
+		'enabled' : True,
+		'token' : '',
+		'lag_interval' : 0.5
 	}
 
 
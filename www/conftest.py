@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+pytest 配置: 没装 aiomysql 时不收集原来那几个直接连数据库的测试脚本.
+新的测试模块自己用 pytest.importorskip 跳过.
+'''
+
+collect_ignore = []
+
+try:
+	import aiomysql
+except ImportError:
+	collect_ignore += ['test_models.py', 'test_orm.py', 'orm_test.py']
@@ -1,15 +1,20 @@
-import asyncio, os, inspect, logging, functools
+import asyncio, os, re, copy, json, inspect, logging, functools
 
 from urllib import parse
 
 from aiohttp import web
 
 from apis import APIError
+from static import StaticHandler
+from singleflight import Flight
 
 
 # get 和 post 为修饰方法,主要是为对象上加上'__method__'和'__route__'属性
 # 为了把我们定义的url实际处理方法，以get请求或post请求区分
-def get(path):
+# coalesce=True 时并发的相同请求(参数相同)只调用一次处理函数，结果再缓存 ttl 秒，
+# 过期后 stale 秒内先返回旧结果并在后台刷新；tags 是失效用的标签，可以引用参数，例如 'blog:{id}'。
+# 处理函数的结果会给多个请求使用，所以不能依赖 request，需要的话用 vary(request) 把相关的部分加到key里
+def get(path, *, coalesce=False, ttl=0, stale=0, tags=(), vary=None):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kw):
@@ -17,6 +22,7 @@ def get(path):
 
         wrapper.__method__ = 'GET'
         wrapper.__route__ = path
+        wrapper.__coalesce__ = dict(ttl=ttl, stale=stale, tags=tuple(tags), vary=vary) if coalesce else None
         return wrapper
 
     return decorator
@@ -199,72 +205,237 @@ def has_request_arg(fn):
 #             return dict(error=e.error, data=e.data, message=e.message)
 
 
+# ---------------------------------请求体解析---------------------------------
+# 请求体只解析一次，结果缓存在 request.__data__ 上，中间件和处理函数都通过 request_data() 取，
+# 不会各自调用 request.json()/request.post() 重复解析。
+# 请求体按块读入并检查大小上限(app['__max_body_size__'])，超过直接返回413，不会先整个缓冲下来。
+# 所有请求正在缓冲的请求体加起来不超过 app['__max_buffered_body__'] 字节，超过的请求返回503，
+# 大量并发的大请求体不会把进程内存撑爆。
+
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+DEFAULT_MAX_BUFFERED_BODY = 32 * 1024 * 1024
+_READ_CHUNK_SIZE = 64 * 1024
+
+# 本进程正在缓冲的请求体字节数
+_buffered = 0
+
+
+class HTTPBodyTooLarge(web.HTTPClientError):
+    status_code = 413
+
+
+class _BodyBuffer(object):
+    '''
+    一个请求体占用的缓冲额度，with 结束时(解析完)归还。
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+
+    def reserve(self, size):
+        global _buffered
+        if size <= self.size:
+            return
+        if _buffered + size - self.size > self.limit:
+            raise web.HTTPServiceUnavailable(text='Too many large request bodies, try again later',
+                                             headers={'Retry-After': '1'})
+        _buffered += size - self.size
+        self.size = size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        global _buffered
+        _buffered -= self.size
+        self.size = 0
+        return False
+
+
+async def _read_body(request, max_size, buf):
+    if request.content_length is not None:
+        if request.content_length > max_size:
+            raise HTTPBodyTooLarge(text='Request body too large: %s > %s' % (request.content_length, max_size))
+        buf.reserve(request.content_length)
+    body = bytearray()
+    while True:
+        chunk = await request.content.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        body.extend(chunk)
+        if len(body) > max_size:
+            raise HTTPBodyTooLarge(text='Request body too large: > %s' % max_size)
+        buf.reserve(len(body))
+    # 不再复制成 bytes，解码直接用 bytearray
+    return body
+
+
+async def request_data(request):
+    '''
+    返回POST请求体解析后的dict(JSON对象或表单)，同一个请求多次调用只解析一次。
+    '''
+    data = getattr(request, '__data__', None)
+    if data is not None:
+        return data
+    data = dict()
+    if request.method == 'POST':
+        ct = request.content_type.lower()
+        if ct.startswith('application/json') or ct.startswith('application/x-www-form-urlencoded'):
+            with _BodyBuffer(request.app.get('__max_buffered_body__', DEFAULT_MAX_BUFFERED_BODY)) as buf:
+                body = await _read_body(request, request.app.get('__max_body_size__', DEFAULT_MAX_BODY_SIZE), buf)
+                try:
+                    if ct.startswith('application/json'):
+                        data = json.loads(body.decode('utf-8')) if body else dict()
+                    else:
+                        data = {k: v[0] for k, v in parse.parse_qs(body.decode('utf-8'), True).items()}
+                except ValueError:
+                    raise web.HTTPBadRequest(text='Invalid request body')
+                del body
+            if not isinstance(data, dict):
+                raise web.HTTPBadRequest(text='JSON Body must be object')
+        elif ct.startswith('multipart/form-data'):
+            data = dict(await request.post())
+    request.__data__ = data
+    return data
+
+
 ############## 某网友重构的 RequestHandler #######################################################################
 # 代码逻辑：从以下3个来源接受参数，经过处理整合到一字典kw中，最后字典解压方式传参**kw
 # yield from self._func(**kw)调用URL处理函数，然后通过工厂函数把结果转换为web.Response对象
 # 1.网页中的GET和POST方法（获取/?page=10还有json或form的数据。）
 # 2.request.match_info（获取@get('/api/{table}')装饰器里面的参数）
 # 3.def __call__(self, request)（获取request参数）
+#
+# 函数的参数表在路由注册时就分析好(绑定计划)，每个请求只做必要的取值：
+# 哪些参数来自路径，哪些来自GET/POST数据，哪些必须传，要不要注入request。
+# 参数全部来自路径的函数(比如 get_blog(id))根本不会去解析请求体或查询串。
+
+_RE_ROUTE_ARG = re.compile(r'\{(\w+)(?::[^}]*)?\}')
+
+
+# APIError 转成的结果
+def _is_error(r):
+    return isinstance(r, dict) and 'error' in r and '__template__' not in r
+
+
+# dict(模板参数、JSON结果)可以给多个请求共用，出错的结果(比如404)不共用，等待的请求各自重新计算。
+# 服务忙(503)给正在等的请求共用，不让它们在最忙的时候一起重试；每个请求各发一个新的 Response(只能发送一次)
+def _shareable(r):
+    if isinstance(r, dict):
+        return not _is_error(r)
+    return isinstance(r, web.HTTPServiceUnavailable)
+
+
+# 缓存给之后的请求用的只有正常的结果
+def _cacheable(r):
+    return isinstance(r, dict) and not _is_error(r)
+
+
+def _copy_result(r):
+    if isinstance(r, web.HTTPServiceUnavailable):
+        return web.HTTPServiceUnavailable(headers={k: r.headers[k] for k in ('Retry-After',) if k in r.headers})
+    # 每个请求一份浅拷贝，response_middleware 会往里面加 __user__
+    return copy.copy(r) if isinstance(r, dict) else r
+
 
 class RequestHandler(object):
-    def __init__(self, app, func):
+    def __init__(self, app, func, path=''):
         self._app = app
         self._func = func
+        params = inspect.signature(func).parameters
+        # 变长参数是可缺省的，不参与绑定
+        named = [p for p in params.values() if p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)]
+        self._has_var_kw = any(p.kind == p.VAR_KEYWORD for p in params.values())
+        self._has_request = 'request' in params
+        route_args = set(_RE_ROUTE_ARG.findall(path))
+        # 来自路径的参数，**kw 的函数拿到全部路径参数
+        self._path_args = tuple(name for name in route_args if name in params or self._has_var_kw)
+        # 来自GET查询串或POST数据的参数，为None表示不需要解析
+        data_args = tuple(p.name for p in named if p.name != 'request' and p.name not in route_args)
+        self._data_args = data_args if data_args or self._has_var_kw else None
+        # 没有默认值、必须传的参数
+        self._required_args = tuple(p.name for p in named if p.default is p.empty and p.name != 'request')
+        logging.info('bind %s: path = %s, data = %s, required = %s, request = %s' % (
+            func.__name__, self._path_args, self._data_args, self._required_args, self._has_request))
+        # 合并并发的相同请求
+        self._flight = None
+        coalesce = getattr(func, '__coalesce__', None)
+        if coalesce is not None:
+            if self._has_request and coalesce['vary'] is None:
+                raise ValueError('%s takes request, coalesce needs vary=' % func.__name__)
+            self._flight = Flight(coalesce['ttl'], coalesce['stale'], shareable=_shareable, cacheable=_cacheable)
+            self._tags = coalesce['tags']
+            self._vary = coalesce['vary']
 
     async def __call__(self, request):
-        # 获取函数的参数表
-        required_args = inspect.signature(self._func).parameters
-        logging.info('required args: %s' % str(required_args))
-
+        kw = {}
         # 1.获取从GET或POST传进来的参数值，如果函数参数表有这参数名就加入
-        args = await self.get_args(request)
-        kw = {arg: value for arg, value in args.items() if arg in required_args}
+        if self._data_args is not None:
+            args = await self.get_args(request)
+            if self._has_var_kw:
+                kw.update(args)
+            else:
+                for name in self._data_args:
+                    if name in args:
+                        kw[name] = args[name]
 
         # 2.获取match_info的参数值，例如@get('/blog/{id}')之类的参数值
-        kw.update(dict(**request.match_info))
+        if self._path_args:
+            match_info = request.match_info
+            for name in self._path_args:
+                kw[name] = match_info[name]
 
         # 3.如果有request参数的话也加入
-        if 'request' in required_args:
+        if self._has_request:
             kw['request'] = request
 
-        # 校验参数的正确性
-        self.check_args(required_args, kw)
-        logging.info('call with args: %s' % str(kw))
+        # 校验参数的正确性，没有默认值又没有传值的话就报错
+        for name in self._required_args:
+            if name not in kw:
+                return web.HTTPBadRequest(text='Missing argument: %s' % name)
+        if self._flight is not None:
+            return await self._call_shared(request, kw)
+        return await self._call(kw)
+
+    async def _call(self, kw):
         try:
             return await self._func(**kw)
         except APIError as e:
             return dict(error=e.error, data=e.data, message=e.message)
 
+    async def _call_shared(self, request, kw):
+        key = tuple(sorted((k, v) for k, v in kw.items() if k != 'request'))
+        if self._vary is not None:
+            key += (self._vary(request),)
+        tags = tuple(t.format(**kw) for t in self._tags)
+        r = await self._flight.do(key, lambda: self._call(kw), tags)
+        return _copy_result(r)
+
     async def get_args(self, request):
-        # 从POST方法截取数据
+        # 从POST方法截取数据，和中间件共用一次解析的结果
         if request.method == 'POST':
-            if request.content_type.startswith('application/json'):
-                return await request.json()
-            elif request.content_type.startswith('application/x-www-form-urlencoded'):
-                return await request.post()
+            return await request_data(request)
         # 从GET方法截取数据，例如/?page=2
         elif request.method == 'GET':
             qs = request.query_string
-            return {k: v[0] for k, v in parse.parse_qs(qs, True).items()}
+            if qs:
+                return {k: v[0] for k, v in parse.parse_qs(qs, True).items()}
         return dict()
 
-    def check_args(self, required_args, args):
-        for arg in required_args.values():
-            # 如果参数类型不是变长列表和变长字典，变长参数是可缺省的
-            if arg.kind not in (arg.VAR_POSITIONAL, arg.VAR_KEYWORD):
-                # 如果还是没有默认值，而且还没有传值的话就报错
-                if arg.default == arg.empty and arg.name not in args:
-                    return web.HTTPBadRequest('Missing argument: %s' % arg.name)
-
 
 ############## 某网友重构的 RequestHandler #######################################################################
 
 # 添加静态页面的路径
 # Adds a router and a handler for returning static files.
 # Useful for serving static content like images, javascript and css files.
+# 静态文件由 static.StaticHandler 发送，构建时生成的 .gz 文件直接发给接受gzip的客户端
+# static/dist/ 下是 assets.py 生成的带hash的文件，内容不会变，让浏览器缓存一年并且不再验证
 def add_static(app):
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
-    app.router.add_static('/static/', path)
+    app.router.add_route('GET', '/static/dist/{filename:.+}',
+                         StaticHandler(os.path.join(path, 'dist'), 'public, max-age=31536000, immutable'))
+    app.router.add_route('GET', '/static/{filename:.+}', StaticHandler(path))
     logging.info('add static %s => %s' % ('/static/', path))
 
 
@@ -286,7 +457,7 @@ def add_route(app, fn):
     # RequestHandler(app, fn)构造add_route的第3个参数，RequestHandler有__call__属性，将其实例视为函数，所以RequestHandler就是对
     # 真正的url处理函数进行了封装。通过__call__实现实例的自身调用，处理 request 参数。
 
-    app.router.add_route(method, path, RequestHandler(app, fn))
+    app.router.add_route(method, path, RequestHandler(app, fn, path))
     # RequestHandler的主要作用就是构成标准的app.router.add_route第三个参数，
     # 还有就是获取不同的函数的对应的参数，就这两个主要作用。只要你实现了这个作用基本上是随你怎么写都行的，
     # 当然最好加上参数验证的功能，否则出错了却找不到出错的消息是一件很头痛的是事情。
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+博客评论计数(blogs.comment_count / last_comment_at)的维护，计数变化时同时更新 blogs.updated_at.
+
+发表和删除评论时由 handlers 原子地增减计数，列表页直接读计数，不需要每篇博客 count(*) 一次。
+开启评论写缓冲时，发表评论不再单独更新计数，写缓冲每写库一批评论调用一次 comments_flushed()，每篇博客只更新一次；
+博客已经被删除时(其他 worker 写缓冲里的评论晚于删除任务写库)，再删一次这篇博客的评论。
+reconcile() 用 comments 表的真实统计修正计数的偏差(进程崩溃、并发编辑等原因造成的)，
+app 里定期执行，也可以直接运行本文件执行一次:
+	python3 counters.py
+'''
+
+import time, asyncio, logging
+
+import cluster, jobs
+from models import Blog, Comment
+
+# reconcile() 跳过这么多秒内有过变化的博客
+RECONCILE_GRACE = 60.0
+
+
+@asyncio.coroutine
+def comment_created(comment):
+	yield from Blog.increment(comment.blog_id, 'comment_count', 1, last_comment_at=comment.created_at, updated_at=time.time())
+
+
+@asyncio.coroutine
+def comments_flushed(comments):
+	'''
+	写缓冲把一批评论写库后调用，按博客汇总后更新计数。
+	'''
+	per_blog = {}
+	for c in comments:
+		blog_id, num, last = per_blog.get(str(c.blog_id), (c.blog_id, 0, 0.0))
+		per_blog[str(c.blog_id)] = (blog_id, num + 1, max(last, c.created_at))
+	now = time.time()
+	for blog_id, num, last in per_blog.values():
+		n = yield from Blog.increment(blog_id, 'comment_count', num, last_comment_at=last, updated_at=now)
+		if n == 0:
+			# 博客在评论写库之前被删除了，删除评论的任务可能已经执行过，再删一次
+			logging.info('blog %s deleted before its comments were flushed' % blog_id)
+			jobs.enqueue('blog.delete_comments', blog_id=blog_id)
+	cluster.invalidate('index', *['blog:%s' % k for k in per_blog])
+
+
+@asyncio.coroutine
+def comment_deleted(comment):
+	# last_comment_at 不往回算，留给 reconcile() 修正
+	yield from Blog.increment(comment.blog_id, 'comment_count', -1, updated_at=time.time())
+
+
+@asyncio.coroutine
+def reconcile():
+	'''
+	修正所有博客的评论计数，返回修正了多少篇博客。
+
+	comments 的统计和 blogs 的计数是先后两次读的(评论可能在别的分片上，没法放在一个事务里)，
+	两次读之间写库、改计数的评论会被算错。所以跳过 RECONCILE_GRACE 秒内有过变化的博客:
+	计数在开始之后被改过(updated_at)，或者最新的评论是最近发表的(可能已写库、计数还没加上)，留给下一次修正。
+	'''
+	started = time.time()
+	recent = started - RECONCILE_GRACE
+	actual = {}
+	rows = yield from Comment.selectRows(
+		'select `blog_id`, count(`id`) _num_, max(`created_at`) _last_ from `comments` group by `blog_id`')
+	for r in rows:
+		num, last = actual.get(str(r['blog_id']), (0, 0.0))
+		actual[str(r['blog_id'])] = (num + r['_num_'], max(last, r['_last_'] or 0.0))
+	# 写缓冲里还没写库的评论也还没计数(见 comments_flushed)，两边都不算
+	fixed = 0
+	for b in (yield from Blog.selectRows('select `id`, `comment_count`, `last_comment_at`, `updated_at` from `blogs`')):
+		num, last = actual.get(str(b['id']), (0, 0.0))
+		if b['comment_count'] == num and b['last_comment_at'] == last:
+			continue
+		if (b['updated_at'] or 0.0) >= recent or last >= recent:
+			continue
+		# 按差值修正而不是直接覆盖: 读完 blogs 之后才加上的计数不会被冲掉
+		affected = yield from Blog.increment(b['id'], 'comment_count', num - b['comment_count'],
+										   last_comment_at=last, updated_at=time.time())
+		if affected:
+			fixed += 1
+			cluster.invalidate('index', 'blog:%s' % b['id'])
+			logging.info('reconcile blog %s: comment_count %s => %s' % (b['id'], b['comment_count'], num))
+	return fixed
+
+
+# 定期执行，失败了等下一次就好，不重试
+@jobs.job('counters.reconcile', max_attempts=1)
+@asyncio.coroutine
+def reconcile_job():
+	fixed = yield from reconcile()
+	logging.info('comment counters reconciled, %s blogs fixed' % fixed)
+
+
+def schedule(loop, interval):
+	'''
+	每隔 interval 秒把 reconcile() 加入后台任务队列。
+	'''
+	def tick():
+		jobs.enqueue('counters.reconcile')
+		loop.call_later(interval, tick)
+
+	loop.call_later(interval, tick)
+
+
+if __name__ == '__main__':
+	import orm
+	from config import configs
+	logging.basicConfig(level=logging.INFO)
+	loop = asyncio.get_event_loop()
+	loop.run_until_complete(orm.create_pool(loop, **configs.db))
+	if configs.shards:
+		loop.run_until_complete(orm.create_shard_pools(loop, configs.shards, configs.shard_replicas, **configs.db))
+	print('%s blogs fixed' % loop.run_until_complete(reconcile()))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+内存里的假aiomysql连接池，只实现了orm.py用到的接口，用来在没有MySQL的情况下测orm自身的开销.
+
+	pool = FakePool({'blogs': [row, row, ...]})
+	orm.set_pool(pool)
+
+select 按 from `表名` 返回事先放好的行(支持 limit ? 和 limit ?, ?)，count查询返回行数，
+insert/update/delete 不改数据，只记在 executed 里，返回 rowcount=1。
+'''
+
+import re
+
+_RE_TABLE = re.compile(r'from `(\w+)`')
+_RE_LIMIT = re.compile(r'limit %s(, %s)?$')
+
+
+def _coroutine_result(value):
+	# 相当于一个立即完成的协程，orm里可以 yield from 它
+	if False:
+		yield
+	return value
+
+
+class FakeCursor(object):
+
+	def __init__(self, pool):
+		self._pool = pool
+		self._rows = []
+		self.rowcount = 0
+
+	def execute(self, sql, args=()):
+		self._pool.queries += 1
+		if sql.startswith('select'):
+			rows = self._pool.tables.get(_RE_TABLE.search(sql).group(1), [])
+			m = _RE_LIMIT.search(sql)
+			if m:
+				if m.group(1):
+					offset, limit = args[-2], args[-1]
+				else:
+					offset, limit = 0, args[-1]
+				rows = rows[offset:offset + limit]
+			if ' _num_ ' in sql:
+				rows = [{'_num_': len(rows)}]
+			self._rows = rows
+			self.rowcount = len(rows)
+		else:
+			self._pool.executed.append((sql, list(args or ())))
+			self._rows = []
+			self.rowcount = 1
+		return _coroutine_result(self.rowcount)
+
+	def fetchall(self):
+		# 和DictCursor一样，每次返回新的dict
+		return _coroutine_result([dict(r) for r in self._rows])
+
+	def fetchmany(self, size):
+		return _coroutine_result([dict(r) for r in self._rows[:size]])
+
+	def close(self):
+		return _coroutine_result(None)
+
+
+class FakeConnection(object):
+
+	def __init__(self, pool):
+		self._pool = pool
+
+	def cursor(self, cursor_class=None):
+		return _coroutine_result(FakeCursor(self._pool))
+
+	def begin(self):
+		return _coroutine_result(None)
+
+	def commit(self):
+		return _coroutine_result(None)
+
+	def rollback(self):
+		return _coroutine_result(None)
+
+
+class _ConnectionContextManager(object):
+
+	def __init__(self, conn):
+		self._conn = conn
+
+	def __enter__(self):
+		return self._conn
+
+	def __exit__(self, *exc):
+		return False
+
+
+class FakePool(object):
+
+	def __init__(self, tables=None):
+		self.tables = tables or {}
+		self.queries = 0
+		# 执行过的 insert/update/delete: [(sql, args)]，测试里检查写了什么
+		self.executed = []
+		self._conn = FakeConnection(self)
+
+	# 对应 with (yield from pool) as conn
+	def __iter__(self):
+		return _coroutine_result(_ConnectionContextManager(self._conn))
+
+	__await__ = __iter__
@@ -1,14 +1,15 @@
-import re, time, json, logging, hashlib, base64, asyncio
+import re, time, json, hmac, logging, hashlib, base64, asyncio
 
 from coroweb import get, post
 from aiohttp import web
 
 from models import User, Comment, Blog, next_id
+import writebehind, search, counters, serialize, conditional, cluster, render, metrics, jobs, live
+from streaming import JsonStream
 
 from config import configs
 
-from apis import Page, APIValueError, APIResourceNotFoundError, APIError
-import markdown2
+from apis import Page, APIValueError, APIResourceNotFoundError, APIPermissionError, APIError
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -21,6 +22,10 @@ COOKIE_NAME = 'awesession'
 _COOKIE_KEY = configs.session.secret
 
 
+# 写博客、评论后让缓存的页面和处理函数结果失效，多进程运行时所有 worker 的都失效
+def _invalidate(*tags):
+	cluster.invalidate(*tags)
+
 # 检测当前用户是不是admin用户
 def check_admin(request):
 	if request.__user__ is None or not request.__user__.admin:
@@ -122,7 +127,8 @@ def show_all_users():
 # 	}
 
 # 首页，会显示博客列表
-@get('/')
+# 同时到来的相同请求只查一次库，结果缓存1秒，之后10秒内先返回旧结果再在后台刷新
+@get('/', coalesce=True, ttl=1, stale=10, tags=('index',))
 def index(*, page='1'):
 	# 获取到要展示的博客页数是第几页
 	page_index = get_page_index(page)
@@ -138,7 +144,10 @@ def index(*, page='1'):
 		blogs = yield from Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit))
 	# 把首页改造一下，从__base__.html继承一个blogs.shtml
 	# blogs.html中使用blogs数据，没有js对象
+	# 页面内容由这一页的博客版本决定，没有变化就不用再渲染(见 conditional.check_page)
+	# 删除博客不会改变剩下博客的 updated_at，所以首页只给 ETag 不给 Last-Modified
 	return {'__template__': 'blogs.html',
+			'__version__': (num, page_index) + tuple((b.id, b.updated_at) for b in blogs),
 			'page': page,
 			'blogs': blogs}
 
@@ -219,7 +228,7 @@ def api_register_user(*, email, name, passwd):
 	# 返回的是json数据，所以设置content-type为json的
 	r.content_type = 'application/json'
 	# 把对象转换成json格式返回
-	r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+	r.body = serialize.dumps(user)
 	return r
 
 
@@ -261,7 +270,7 @@ def authenticate(*, email, passwd):
 	# 返回的是json数据，所以设置content-type为json的
 	r.content_type = 'application/json'
 	# 把对象转换成json格式返回
-	r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+	r.body = serialize.dumps(user)
 	return r
 
 
@@ -323,6 +332,9 @@ def api_create_blog(request, *, name, summary, content):
 				name=name.strip(), summary=summary.strip(), content=content.strip())
 	# 保存
 	yield from blog.save()
+	# 加入搜索索引
+	search.index_blog(blog)
+	_invalidate('index')
 	return blog
 
 # ------------end Day 11 - 编写日志创建页---------------------------------------
@@ -358,7 +370,11 @@ def api_update_blog(id, request, *, name, summary, content):
 	blog.name = name.strip()
 	blog.summary = summary.strip()
 	blog.content = content.strip()
-	yield from blog.update()
+	blog.updated_at = time.time()
+	# 只更新编辑的这几列，评论计数由评论接口维护
+	yield from blog.update(['name', 'summary', 'content', 'updated_at'])
+	search.index_blog(blog)
+	_invalidate('index', 'blog:%s' % id)
 	return blog
 
 
@@ -378,30 +394,68 @@ def api_update_blog(id, request, *, name, summary, content):
 #   return dict(id=id)
 
 
+# 删除博客的评论: 评论多的博客一次删完会长时间锁表，分批删除；任务可能重复执行，删完了再删也没关系
+@jobs.job('blog.delete_comments')
+@asyncio.coroutine
+def delete_blog_comments(blog_id):
+	buffer = writebehind.get(Comment)
+	if buffer is not None:
+		for c in buffer.pending('blog_id', blog_id):
+			buffer.discard(c.id)
+	total = 0
+	while True:
+		n = yield from Comment.removeWhere('blog_id=?', [blog_id], shardKey=blog_id, limit=500)
+		total += n
+		if n < 500:
+			break
+	logging.info('blog %s: %s comments deleted' % (blog_id, total))
+
+
 @post('/api/blogs/{id}/delete')
 def api_delete_blog(request, *, id):
 	check_admin(request)
 	blog = yield from Blog.find(id)
 	yield from blog.remove()
+	search.remove_blog(id)
+	_invalidate('index', 'blog:%s' % id)
+	# 评论在后台删除；其他 worker 写缓冲里的评论过一会儿才写库，晚一点删。
+	# 删除任务之后才写库的评论由 counters.comments_flushed() 发现博客不在了再删一次
+	jobs.enqueue('blog.delete_comments', delay=configs.write_behind.flush_interval * 5, blog_id=id)
 	return dict(id=id)
 
 
 
 # ---------------------------------进入某条博客---------------------------------
 # 日志详情页
-@get('/blog/{id}')
+# 热门博客的并发请求只查一次库、转换一次markdown
+@get('/blog/{id}', coalesce=True, ttl=1, stale=10, tags=('blog:{id}',))
 def get_blog(id):
 	# 根据博客id查询该博客信息
 	blog = yield from Blog.find(id)
+	if blog is None:
+		# 页面请求返回404页面，不是API的JSON错误
+		return web.HTTPNotFound()
 	# 根据博客id查询该条博客的评论
-	comments = yield from Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
-	# markdown2是个扩展模块，这里把博客正文和评论套入到markdonw2中
+	comments = yield from Comment.findAll('blog_id=?', [id], orderBy='created_at desc', shardKey=id)
+	# 写缓冲里还没写库的评论也要显示出来
+	buffer = writebehind.get(Comment)
+	if buffer is not None:
+		comments = buffer.pending('blog_id', id) + comments
+		comments.sort(key=lambda c: c.created_at, reverse=True)
+	# 评论用 text2html 转成html，博客正文用 markdown2 转换(见 render.py)
 	for c in comments:
 		c.html_content = text2html(c.content)
-	blog.html_content = markdown2.markdown(blog.content)
+	# 长文章在进程池里转换，不阻塞事件循环；进程池忙不过来时返回503
+	try:
+		blog.html_content = yield from render.markdown(blog.content)
+	except render.RenderBusy:
+		return web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
 	# 返回页面
 	# /api/blogs/{{ blog.id }}/comments
+	# 博客和评论计数都没变时客户端的缓存仍然有效，不用再渲染
 	return {'__template__': 'blog.html',
+			'__version__': (blog.id, blog.updated_at),
+			'__last_modified__': blog.updated_at,
 			'blog': blog,
 			'comments': comments}
 
@@ -423,22 +477,60 @@ def api_create_comment(id, request, *, content):
 	# 构建一条评论数据
 	comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image,
 					  content=content.strip())
-	# 保存到评论表里
-	yield from comment.save()
+	# 保存到评论表里，开启写缓冲时先进缓冲，稍后批量写库，评论计数也在写库时按批更新
+	buffer = writebehind.get(Comment)
+	if buffer is not None:
+		buffer.add(comment)
+	else:
+		yield from comment.save()
+		# 博客的评论计数加一
+		yield from counters.comment_created(comment)
+	# 博客页和首页上的评论数都变了
+	_invalidate('index', 'blog:%s' % id)
+	# 推给正在看这篇博客的读者，事件id用创建时间，重连时补发断开后的评论
+	event = dict(comment, html_content=text2html(comment.content))
+	live.publish('comments:%s' % id, repr(comment.created_at), 'comment', event)
 	return comment
 
+# 博客页用 EventSource 订阅新评论；since 是页面上最新一条评论的创建时间，
+# 页面渲染之后、连上之前发表的评论也会补发。浏览器重连时带 Last-Event-ID
+@get('/api/blogs/{id}/comments/stream')
+def api_comments_stream(id, request, *, since=None):
+	return live.EventStream('comments:%s' % id, last_id=request.headers.get('Last-Event-ID') or since)
+
 # ---------------------------------end 进入某条博客---------------------------------
 
 
 # 获取所有博客信息
 @get('/api/blogs')
-def api_blogs(*, page='1'):
+def api_blogs(request, *, page='1', format=''):
+	# format=ndjson 时导出全部博客，只有管理员可以导出
+	if format == 'ndjson':
+		check_admin(request)
+		return JsonStream(Blog.iterPages(orderBy='created_at desc'), ndjson=True)
 	page_index = get_page_index(page)
 	num = yield from Blog.findNumber('count(id)')
 	p = Page(num, page_index)
 	if num == 0:
 		return dict(page=p, blogs=())
-	blogs = yield from Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+	# 边从数据库读边输出，不再先把整页博客(含正文)读进内存
+	return JsonStream(Blog.iterAll(orderBy='created_at desc', limit=(p.offset, p.limit)), key='blogs', head=dict(page=p))
+
+# 全文搜索博客，按BM25得分排序，返回的博客不带正文
+@get('/api/search')
+def api_search(*, q='', page='1'):
+	page_index = get_page_index(page)
+	hits = search.query(q) if q.strip() else []
+	p = Page(len(hits), page_index)
+	if p.limit == 0:
+		return dict(page=p, blogs=())
+	scores = dict(hits[p.offset:p.offset + p.limit])
+	ids = list(scores.keys())
+	blogs = yield from Blog.findAll('`id` in (%s)' % ', '.join(['?'] * len(ids)), ids)
+	for b in blogs:
+		b.score = scores[str(b.id)]
+		del b['content']
+	blogs.sort(key=lambda b: b.score, reverse=True)
 	return dict(page=p, blogs=blogs)
 
 # ---------------------------------用户管理页面 http://localhost:9000/manage/users---------------------------------
@@ -450,17 +542,36 @@ def manage_users(*, page='1'):
 
 # --Day 9-编写API,返回所有的用户信息---
 @get('/api/users')
-def api_get_users(*, page='1'):
+def api_get_users(request, *, page='1', format=''):
+	if format == 'ndjson':
+		check_admin(request)
+		return JsonStream(User.iterPages(orderBy='created_at desc'), ndjson=True, transform=_mask_passwd)
 	page_index = get_page_index(page)
 	num = yield from User.findNumber('count(id)')
 	p = Page(num, page_index)
 	if num == 0:
 		return dict(page=p, users=())
-	users = yield from User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
-	for u in users:
-		u.passwd = '******'
-	# 只要返回一个 dict，后续的 response 这个 middleware 就可以把结果序列化为 JSON 并返回
-	return dict(page=p, users=users)
+	# 返回 JsonStream，response 这个 middleware 会边读边把结果以分块的 JSON 输出
+	users = User.iterAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+	return JsonStream(users, key='users', head=dict(page=p), transform=_mask_passwd)
+
+# Prometheus 抓取的指标: 管理员登录后可以看，或者带上 configs.metrics.token
+@get('/metrics')
+def get_metrics(request):
+	m = request.app['__metrics__']
+	if m is None:
+		return web.HTTPNotFound()
+	token = configs.metrics.token
+	auth = request.headers.get('Authorization', '')
+	user = request.__user__
+	if not (token and hmac.compare_digest(auth, 'Bearer %s' % token)) and (user is None or not user.admin):
+		return web.HTTPForbidden()
+	body = m.render(recorder=request.app['__timing__']).encode('utf-8')
+	return web.Response(body=body, headers={'Content-Type': metrics.CONTENT_TYPE, 'Cache-Control': 'no-store'})
+
+def _mask_passwd(u):
+	u.passwd = '******'
+	return u
 
 # ---------------------------------end 用户管理页面---------------------------------
 
@@ -475,15 +586,20 @@ def manage_comments(*, page='1'):
 			'page_index': get_page_index(page)}
 
 # 根据page获取评论，注释可参考 index 函数的注释，不细写了
+# 评论分片存储时，计数和分页查询会在所有分片上执行后归并
 @get('/api/comments')
-def api_comments(*, page='1'):
+def api_comments(request, *, page='1', format=''):
+	# format=ndjson 时导出全部评论，每行一个JSON对象；按页查询，导出期间不一直占着数据库连接
+	if format == 'ndjson':
+		check_admin(request)
+		return JsonStream(Comment.iterPages(orderBy='created_at desc'), ndjson=True)
 	page_index = get_page_index(page)
 	num = yield from Comment.findNumber('count(id)')
 	p = Page(num, page_index)
 	if num == 0:
 		return dict(page=p, comments=())
-	comments = yield from Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
-	return dict(page=p, comments=comments)
+	comments = Comment.iterAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+	return JsonStream(comments, key='comments', head=dict(page=p))
 
 # 删除某个评论
 @post('/api/comments/{id}/delete')
@@ -491,13 +607,20 @@ def api_delete_comments(id, request):
 	logging.info(id)
 	# 先检查是否是管理员操作，只有管理员才有删除评论权限
 	check_admin(request)
-	# 查询一下评论id是否有对应的评论
-	c = yield from Comment.find(id)
-	# 没有的话抛出错误
+	# 还在写缓冲里的评论直接丢弃，它还没有计数
+	buffer = writebehind.get(Comment)
+	c = buffer.discard(id) if buffer is not None else None
 	if c is None:
-		raise APIResourceNotFoundError('Comment')
-	# 有的话删除
-	yield from c.remove()
+		# 查询一下评论id是否有对应的评论
+		c = yield from Comment.find(id)
+		# 没有的话抛出错误
+		if c is None:
+			raise APIResourceNotFoundError('Comment')
+		# 有的话删除
+		yield from c.remove()
+		# 博客的评论计数减一
+		yield from counters.comment_deleted(c)
+	_invalidate('index', 'blog:%s' % c.blog_id)
 	return dict(id=id)
 # ---------------------------------end 管理评论页面---------------------------------
 
@@ -510,8 +633,11 @@ def manage():
 
 # 获取某条博客的信息
 @get('/api/blogs/{id}')
-def api_get_blog(*, id):
+def api_get_blog(id, request):
 	blog = yield from Blog.find(id)
+	if blog is not None and conditional.check(request, etag=conditional.make_etag(blog.id, blog.updated_at),
+											  last_modified=blog.updated_at):
+		return web.HTTPNotModified()
 	return blog
 
 
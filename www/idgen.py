@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+snowflake风格的整数ID生成器.
+
+ID由高到低依次为: 毫秒时间戳(相对epoch) | worker id | 毫秒内序列号，
+整体按时间单调递增，可直接存为 bigint 主键。
+'''
+
+import time, threading, logging
+
+# 2016-01-01 00:00:00 UTC，本项目最早的数据也晚于这个时间
+DEFAULT_EPOCH = 1451606400000
+
+# 默认位宽: 41位时间戳 + 5位worker + 7位序列号 = 53位。
+# 53位以内的整数可以被浏览器里的JavaScript(Number)精确表示，管理页面通过JSON拿到的id不会丢精度；
+# 需要经典的 41/10/12 布局时可以在配置里改 worker_bits 和 sequence_bits。
+DEFAULT_WORKER_BITS = 5
+DEFAULT_SEQUENCE_BITS = 7
+
+# 时钟回拨在这个毫秒数以内时，原地等待时钟追上来，超过则直接报错
+DEFAULT_MAX_BACKWARD_MS = 10
+
+
+class ClockSkewError(RuntimeError):
+	pass
+
+
+class IdWorker(object):
+	'''
+	线程安全的ID生成器，每个进程(worker)必须使用不同的 worker_id。
+	'''
+
+	def __init__(self, worker_id=0, epoch=DEFAULT_EPOCH, worker_bits=DEFAULT_WORKER_BITS,
+				 sequence_bits=DEFAULT_SEQUENCE_BITS, max_backward_ms=DEFAULT_MAX_BACKWARD_MS):
+		max_worker_id = (1 << worker_bits) - 1
+		if worker_id < 0 or worker_id > max_worker_id:
+			raise ValueError('worker_id must be between 0 and %s' % max_worker_id)
+		self.worker_id = worker_id
+		self.epoch = epoch
+		self.max_backward_ms = max_backward_ms
+		self._sequence_mask = (1 << sequence_bits) - 1
+		self.max_sequence = self._sequence_mask
+		self._worker_shift = sequence_bits
+		self._timestamp_shift = sequence_bits + worker_bits
+		self._last_timestamp = -1
+		self._sequence = 0
+		self._lock = threading.Lock()
+
+	def _now(self):
+		return int(time.time() * 1000)
+
+	def _wait_until(self, timestamp):
+		now = self._now()
+		while now < timestamp:
+			time.sleep((timestamp - now) / 1000.0)
+			now = self._now()
+		return now
+
+	def next_id(self):
+		with self._lock:
+			timestamp = self._now()
+			# 时钟回拨: 小幅回拨等待追平，大幅回拨拒绝发号，避免产生重复ID
+			if timestamp < self._last_timestamp:
+				backward = self._last_timestamp - timestamp
+				if backward > self.max_backward_ms:
+					raise ClockSkewError('clock moved backwards by %sms, refusing to generate id' % backward)
+				logging.warning('clock moved backwards by %sms, waiting...' % backward)
+				timestamp = self._wait_until(self._last_timestamp)
+			if timestamp == self._last_timestamp:
+				self._sequence = (self._sequence + 1) & self._sequence_mask
+				# 当前毫秒的序列号用完了，等到下一毫秒
+				if self._sequence == 0:
+					timestamp = self._wait_until(self._last_timestamp + 1)
+			else:
+				self._sequence = 0
+			self._last_timestamp = timestamp
+			return self.make_id(timestamp, self.worker_id, self._sequence)
+
+	def make_id(self, timestamp, worker_id, sequence):
+		'''
+		按当前布局拼出一个ID，迁移旧数据时也用它根据旧ID里的时间戳生成新ID。
+		'''
+		return ((timestamp - self.epoch) << self._timestamp_shift) | (worker_id << self._worker_shift) | sequence
+
+	def parse_id(self, id):
+		'''
+		把ID拆回 (毫秒时间戳, worker_id, 序列号)。
+		'''
+		id = int(id)
+		sequence = id & self._sequence_mask
+		worker_id = (id >> self._worker_shift) & ((1 << (self._timestamp_shift - self._worker_shift)) - 1)
+		timestamp = (id >> self._timestamp_shift) + self.epoch
+		return timestamp, worker_id, sequence
+
+
+_worker = None
+
+
+def init(worker_id=0, **kw):
+	'''
+	用配置初始化进程内的ID生成器，多进程部署时每个进程的worker_id必须不同。
+	'''
+	global _worker
+	_worker = IdWorker(worker_id, **kw)
+	logging.info('init id worker: worker_id = %s' % worker_id)
+	return _worker
+
+
+def get_worker():
+	global _worker
+	if _worker is None:
+		_worker = IdWorker()
+	return _worker
+
+
+def next_long_id():
+	return get_worker().next_id()
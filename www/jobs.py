@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+后台任务队列: 任务存在本地 SQLite 文件里，每个 app 进程里有几个执行任务的协程.
+
+处理函数里调用 enqueue() 就返回(同步写一行 SQLite，不用 await)，任务在后台执行:
+
+    @jobs.job('blog.delete_comments')
+    @asyncio.coroutine
+    def delete_comments(blog_id):
+        ...
+
+    jobs.enqueue('blog.delete_comments', blog_id=id)
+
+- 至少执行一次: 取任务时只是租用 lease 秒，执行成功才删除；进程崩溃或超时后租期一过会被重新取出，任务要能重复执行.
+- 失败重试: 第 n 次失败后等 retry_delay * 2^(n-1) 秒再试，失败 max_attempts 次后标记为 dead，不再执行.
+- 优先级: priority 大的先执行，相同的按到期时间先后.
+
+server.py 多进程运行时所有 worker 共用一个 SQLite 文件，取任务在一个写事务里完成，一个任务不会同时给两个进程.
+命令行查看和操作队列:
+
+    python3 jobs.py list
+    python3 jobs.py enqueue counters.reconcile '{}'
+    python3 jobs.py retry-dead
+'''
+
+import os, sys, json, time, socket, sqlite3, asyncio, logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+_SCHEMA = '''
+create table if not exists jobs (
+    id integer primary key autoincrement,
+    name text not null,
+    payload text not null,
+    priority integer not null default 0,
+    state text not null default 'queued',
+    run_at real not null,
+    lease_until real not null default 0,
+    lease_owner text,
+    attempts integer not null default 0,
+    max_attempts integer not null,
+    last_error text,
+    created_at real not null
+);
+create index if not exists jobs_ready on jobs (state, priority, run_at);
+'''
+
+# 名字 -> (协程函数, max_attempts)
+_registry = {}
+
+_queue = None
+
+
+def job(name, max_attempts=None):
+    '''
+    把协程函数注册为名为 name 的任务，参数来自 enqueue() 的关键字参数(要能转成JSON)。
+    '''
+    def decorator(fn):
+        _registry[name] = (fn, max_attempts)
+        return fn
+    return decorator
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+    # WAL: 读写不互相阻塞，写入不用每次都同步整个文件
+    conn.execute('pragma journal_mode=wal')
+    conn.execute('pragma synchronous=normal')
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+class JobQueue(object):
+
+    def __init__(self, path, concurrency=2, poll_interval=1.0, timeout=60.0, max_attempts=5, retry_delay=5.0):
+        self.path = path
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # 租期比超时长一些，超时的任务来得及记下失败
+        self.lease = timeout + 30
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.owner = '%s:%s' % (socket.gethostname(), os.getpid())
+        # enqueue 在事件循环的线程里用
+        self._conn = _connect(path)
+        # 取任务、记录结果可能要等别的进程的写锁，放到单独的线程里，不阻塞事件循环
+        self._db_thread = ThreadPoolExecutor(1)
+        self._db_conn = _connect(path)
+        self._loop = None
+        self._wakeup = None
+        self._poller = None
+        self._running = set()
+        self._stopping = False
+
+    def enqueue(self, name, payload, priority=0, delay=0, max_attempts=None):
+        now = time.time()
+        if max_attempts is None:
+            max_attempts = _registry.get(name, (None, None))[1] or self.max_attempts
+        cur = self._conn.execute(
+            'insert into jobs (name, payload, priority, run_at, max_attempts, created_at) values (?, ?, ?, ?, ?, ?)',
+            (name, json.dumps(payload, ensure_ascii=False), priority, now + delay, max_attempts, now))
+        if self._wakeup is not None and not delay:
+            self._wakeup.set()
+        return cur.lastrowid
+
+    # ---------------------------------在 _db_thread 里执行---------------------------------
+
+    def _claim(self, limit):
+        now = time.time()
+        conn = self._db_conn
+        # immediate: 一开始就拿写锁，多个进程不会取到同一个任务
+        conn.execute('begin immediate')
+        try:
+            # 执行中进程被杀掉的任务没机会记下失败，租期过后在这里按次数用完算作失败
+            conn.execute('update jobs set state=\'dead\', lease_until=0, last_error=\'lease expired\' '
+                         'where state=\'queued\' and lease_until>0 and lease_until<=? and attempts>=max_attempts', (now,))
+            rows = conn.execute(
+                'select id, name, payload, attempts, max_attempts from jobs where state=\'queued\' and run_at<=? '
+                'and lease_until<=? and attempts<max_attempts order by priority desc, run_at limit ?',
+                (now, now, limit)).fetchall()
+            for row in rows:
+                conn.execute('update jobs set lease_until=?, lease_owner=?, attempts=attempts+1 where id=?',
+                             (now + self.lease, self.owner, row[0]))
+            conn.execute('commit')
+        except BaseException:
+            conn.execute('rollback')
+            raise
+        return rows
+
+    def _complete(self, id):
+        self._db_conn.execute('delete from jobs where id=? and lease_owner=?', (id, self.owner))
+
+    def _fail(self, id, attempts, max_attempts, error):
+        if attempts >= max_attempts:
+            self._db_conn.execute('update jobs set state=\'dead\', lease_until=0, last_error=? where id=? and lease_owner=?',
+                                  (error, id, self.owner))
+            return
+        run_at = time.time() + self.retry_delay * 2 ** (attempts - 1)
+        self._db_conn.execute('update jobs set run_at=?, lease_until=0, last_error=? where id=? and lease_owner=?',
+                              (run_at, error, id, self.owner))
+
+    # ---------------------------------事件循环里的执行者---------------------------------
+
+    def _db(self, fn, *args):
+        return self._loop.run_in_executor(self._db_thread, fn, *args)
+
+    def start(self, loop):
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._poller = asyncio.ensure_future(self._poll(), loop=loop)
+        logging.info('job queue %s: %s runners' % (self.path, self.concurrency))
+
+    async def _poll(self):
+        while not self._stopping:
+            # 先清除再取任务，取的过程中加入的任务会让下面的等待立即返回
+            self._wakeup.clear()
+            free = self.concurrency - len(self._running)
+            rows = []
+            if free > 0:
+                try:
+                    rows = await self._db(self._claim, free)
+                except sqlite3.Error as e:
+                    logging.warning('job queue: claim failed: %s' % e)
+            for row in rows:
+                task = asyncio.ensure_future(self._run(*row))
+                self._running.add(task)
+                task.add_done_callback(self._on_done)
+            # 本进程加入任务、有任务执行完时被唤醒；其他进程加入的任务要等下一次轮询
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_done(self, task):
+        self._running.discard(task)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self, id, name, payload, attempts, max_attempts):
+        fn = _registry.get(name, (None, None))[0]
+        start = time.perf_counter()
+        try:
+            if fn is None:
+                raise LookupError('unknown job %s' % name)
+            await asyncio.wait_for(fn(**json.loads(payload)), self.timeout)
+        except asyncio.CancelledError:
+            # 进程退出时没执行完，租期过了由别的进程重新执行
+            raise
+        except Exception as e:
+            logging.exception('job %s #%s failed (attempt %s/%s): %s' % (name, id, attempts + 1, max_attempts, e))
+            await self._db(self._fail, id, attempts + 1, max_attempts, '%s: %s' % (type(e).__name__, e))
+            return
+        logging.info('job %s #%s done in %.1fms' % (name, id, (time.perf_counter() - start) * 1e3))
+        await self._db(self._complete, id)
+
+    async def stop(self, timeout=10.0):
+        '''
+        不再取新任务，等正在执行的任务最多 timeout 秒。
+        '''
+        self._stopping = True
+        if self._poller is not None:
+            self._wakeup.set()
+            await self._poller
+        if self._running:
+            done, pending = await asyncio.wait(list(self._running), timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._db_thread.shutdown(wait=True)
+        self._conn.close()
+        self._db_conn.close()
+
+
+def resolve_path(path, data_dir):
+    '''
+    相对路径按 data_dir 解析(不按当前目录)，目录不存在时创建。
+    '''
+    path = os.path.join(data_dir, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def init(path, **kw):
+    global _queue
+    _queue = JobQueue(path, **kw)
+    return _queue
+
+
+def get_queue():
+    return _queue
+
+
+def enqueue(name, priority=0, delay=0, max_attempts=None, **payload):
+    '''
+    加入一个任务，立即返回任务id。没有启用任务队列时直接在后台执行一次(不重试，进程退出就丢了)，返回 None。
+    '''
+    if _queue is not None:
+        return _queue.enqueue(name, payload, priority, delay, max_attempts)
+    fn = _registry[name][0]
+    loop = asyncio.get_event_loop()
+
+    def run():
+        asyncio.ensure_future(fn(**payload), loop=loop).add_done_callback(_log_error)
+
+    loop.call_later(delay, run)
+    return None
+
+
+def _log_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error('background job failed: %s' % task.exception())
+
+
+def main(argv):
+    import argparse
+    from config import configs
+    parser = argparse.ArgumentParser(description='background job queue')
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('list', help='show queued and dead jobs')
+    p = sub.add_parser('enqueue', help='add a job')
+    p.add_argument('name')
+    p.add_argument('payload', nargs='?', default='{}', help='JSON object of keyword arguments')
+    p.add_argument('--priority', type=int, default=0)
+    sub.add_parser('retry-dead', help='put dead jobs back into the queue')
+    args = parser.parse_args(argv)
+    conn = _connect(resolve_path(configs.jobs.path, configs.jobs.data_dir))
+    now = time.time()
+    if args.command == 'list':
+        for row in conn.execute('select id, name, state, priority, attempts, max_attempts, run_at, lease_until, '
+                                'last_error from jobs order by state, priority desc, run_at'):
+            id, name, state, priority, attempts, max_attempts, run_at, lease_until, error = row
+            if state == 'queued' and lease_until > now:
+                state = 'running'
+            print('#%-6s %-24s %-8s prio=%-3s tries=%s/%s due=%+.0fs %s' % (
+                id, name, state, priority, attempts, max_attempts, run_at - now, error or ''))
+    elif args.command == 'enqueue':
+        cur = conn.execute('insert into jobs (name, payload, priority, run_at, max_attempts, created_at) '
+                           'values (?, ?, ?, ?, ?, ?)',
+                           (args.name, json.dumps(json.loads(args.payload)), args.priority, now,
+                            configs.jobs.max_attempts, now))
+        print('job #%s queued' % cur.lastrowid)
+    elif args.command == 'retry-dead':
+        cur = conn.execute('update jobs set state=\'queued\', attempts=0, run_at=? where state=\'dead\'', (now,))
+        print('%s jobs requeued' % cur.rowcount)
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
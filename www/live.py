@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Server-Sent Events 推送: 处理函数返回 EventStream，response_middleware 保持连接，把发布到这个主题的事件推给浏览器(EventSource).
+
+    # 订阅
+    return live.EventStream('comments:%s' % id, last_id=request.headers.get('Last-Event-ID'))
+    # 发布，多进程运行时也推给其他 worker 上的订阅者
+    live.publish('comments:%s' % blog_id, comment.id, 'comment', comment)
+
+每个订阅者只有一个等待中的协程和一个有界队列。发布时事件只编码一次，同一份字节放进所有订阅者的队列；
+心跳由一个定时器统一发，不是每个连接一个。队列满了(客户端收得太慢)就断开它，EventSource 会自己重连.
+
+每个主题保留最近 history 个事件，重连时按 Last-Event-ID 补发断开期间的事件；
+事件id要按发布顺序递增(比如创建时间)，客户端要能处理重复收到的事件.
+'''
+
+import asyncio, logging
+
+from collections import deque, OrderedDict
+
+from aiohttp import web
+
+import serialize, cluster
+
+# 放进队列表示连接该结束了
+_CLOSE = None
+
+_PING = b': ping\n\n'
+
+# 保留历史事件的主题数上限，超过时丢弃最久没有发布的主题的历史
+_MAX_TOPICS = 1024
+
+
+class EventStream(object):
+
+    def __init__(self, topic, last_id=None):
+        self.topic = topic
+        self.last_id = last_id
+
+
+def encode(id, event, data):
+    return b'id: %s\nevent: %s\ndata: %s\n\n' % (str(id).encode('utf-8'), event.encode('utf-8'), serialize.dumps(data))
+
+
+class Hub(object):
+
+    def __init__(self, max_subscribers=10000, queue_size=16, history=32, heartbeat=20.0, retry=3000):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.history = history
+        self.heartbeat = heartbeat
+        # 断开后浏览器隔多少毫秒重连
+        self.retry = retry
+        # 主题 -> 订阅者的队列
+        self._topics = {}
+        # 主题 -> 最近的 (id, 编码好的事件)
+        self._history = OrderedDict()
+        self.subscribers = 0
+        self.published = 0
+        self.dropped = 0
+        self._handle = None
+        self._closed = False
+
+    def start(self, loop):
+        if self.heartbeat:
+            self._handle = loop.call_later(self.heartbeat, self._ping, loop)
+
+    def _ping(self, loop):
+        # 代理和浏览器都会断开太久没有数据的连接
+        for queues in self._topics.values():
+            for q in queues:
+                if q.empty():
+                    q.put_nowait(_PING)
+        self._handle = loop.call_later(self.heartbeat, self._ping, loop)
+
+    def subscribe(self, topic):
+        '''
+        返回订阅者的队列，订阅者已满时返回 None。
+        '''
+        if self._closed or self.subscribers >= self.max_subscribers:
+            return None
+        q = asyncio.Queue(self.queue_size + 1)
+        self._topics.setdefault(topic, set()).add(q)
+        self.subscribers += 1
+        return q
+
+    def unsubscribe(self, topic, q):
+        queues = self._topics.get(topic)
+        if queues is None or q not in queues:
+            return
+        queues.discard(q)
+        if not queues:
+            del self._topics[topic]
+        self.subscribers -= 1
+
+    def replay(self, topic, last_id):
+        '''
+        返回 id 大于 last_id 的历史事件。
+        '''
+        if last_id is None:
+            return []
+        return [frame for id, frame in self._history.get(topic, ()) if _after(id, last_id)]
+
+    def publish_local(self, topic, id, event, data):
+        frame = encode(id, event, data)
+        self.published += 1
+        if self.history:
+            recent = self._history.get(topic)
+            if recent is None:
+                recent = self._history[topic] = deque(maxlen=self.history)
+                if len(self._history) > _MAX_TOPICS:
+                    self._history.popitem(last=False)
+            else:
+                self._history.move_to_end(topic)
+            recent.append((str(id), frame))
+        for q in list(self._topics.get(topic, ())):
+            # 留一个位置给 _CLOSE
+            if q.qsize() >= self.queue_size:
+                self.dropped += 1
+                self.unsubscribe(topic, q)
+                q.put_nowait(_CLOSE)
+            else:
+                q.put_nowait(frame)
+
+    def close(self):
+        '''
+        结束所有连接(worker 退出时)，不再接受订阅。
+        '''
+        self._closed = True
+        if self._handle is not None:
+            self._handle.cancel()
+        for topic, queues in list(self._topics.items()):
+            for q in list(queues):
+                self.unsubscribe(topic, q)
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(_CLOSE)
+
+
+def _after(id, last_id):
+    # id 是数字(时间戳、整数ID)时按数值比较
+    try:
+        return float(id) > float(last_id)
+    except ValueError:
+        return id > last_id
+
+
+_hub = None
+
+
+def init(loop, **kw):
+    global _hub
+    _hub = Hub(**kw)
+    _hub.start(loop)
+    return _hub
+
+
+def get_hub():
+    return _hub
+
+
+def publish(topic, id, event, data):
+    '''
+    把事件推给所有 worker 上这个主题的订阅者，data 要能转成JSON。
+    '''
+    if _hub is None:
+        return
+    _hub.publish_local(topic, id, event, data)
+    cluster.publish('live', topic, str(id), event, data)
+
+
+def _on_publish(topic, id, event, data):
+    if _hub is not None:
+        _hub.publish_local(topic, id, event, data)
+
+
+cluster.subscribe('live', _on_publish)
+
+
+async def on_shutdown(app):
+    # 不然 worker 排空时要等所有订阅者的超时
+    if _hub is not None:
+        _hub.close()
+
+
+async def write_event_stream(request, stream):
+    hub = _hub
+    if hub is None:
+        return web.HTTPNotFound()
+    # 先订阅再补发历史事件，两者之间发布的事件不会漏掉(可能重复)
+    q = hub.subscribe(stream.topic)
+    if q is None:
+        return web.HTTPServiceUnavailable(headers={'Retry-After': '10'})
+    try:
+        resp = web.StreamResponse(headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        resp.content_type = 'text/event-stream'
+        resp.charset = 'utf-8'
+        await resp.prepare(request)
+        await resp.write(b'retry: %d\n\n' % hub.retry)
+        for frame in hub.replay(stream.topic, stream.last_id):
+            await resp.write(frame)
+        while True:
+            frame = await q.get()
+            if frame is _CLOSE:
+                break
+            await resp.write(frame)
+        await resp.write_eof()
+    except ConnectionResetError as e:
+        # 客户端已经断开(关掉页面、网络中断)
+        logging.debug('event stream %s closed: %s' % (stream.topic, e))
+    finally:
+        hub.unsubscribe(stream.topic, q)
+    return resp
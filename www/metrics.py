@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+进程内的指标，以 Prometheus 文本格式从 /metrics 输出.
+
+请求路径上只做字典里的整数加法和 Histogram.observe(事件循环是单线程的，不需要锁)，
+连接池、缓存命中、GC、内存这些在抓取时才去读:
+
+    m = metrics.Metrics()
+    m.observe_request('GET', '/blog/{id}', 200, 0.012)
+    m.start(loop, lag_interval=0.5)
+    text = m.render(recorder=app['__timing__'])
+'''
+
+import gc, os, sys, time
+
+import orm, pagecache, singleflight, live
+from timing import Histogram
+
+PREFIX = 'awesome_'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 事件循环延迟的桶上界(秒)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def route_label(request):
+    '''
+    用路由模板(/blog/{id})而不是实际路径作为标签，标签的取值个数才是有限的。没匹配上路由的请求都算作 'unmatched'。
+    '''
+    route = getattr(request.match_info, 'route', None)
+    resource = getattr(route, 'resource', None)
+    if resource is None:
+        return 'unmatched'
+    info = resource.get_info()
+    return info.get('path') or info.get('formatter') or info.get('prefix') or 'unmatched'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Writer(object):
+
+    def __init__(self):
+        self.lines = []
+
+    def header(self, name, kind, help):
+        self.lines.append('# HELP %s %s' % (name, help))
+        self.lines.append('# TYPE %s %s' % (name, kind))
+
+    def sample(self, name, value, **labels):
+        if labels:
+            name += '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+        self.lines.append('%s %s' % (name, _format_value(value)))
+
+    def histogram(self, name, h, **labels):
+        for le, count in h.cumulative():
+            self.sample(name + '_bucket', count, le=_format_value(le), **labels)
+        self.sample(name + '_sum', h.sum, **labels)
+        self.sample(name + '_count', h.count, **labels)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _rss_bytes():
+    # Linux 上读 /proc，其他系统只能拿到峰值(ru_maxrss，macOS 是字节，Linux 是KB)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.start_time = time.time()
+        # (method, route, status) -> 次数
+        self._requests = {}
+        # (method, route) -> Histogram
+        self._latency = {}
+        self._lag = Histogram(LAG_BUCKETS)
+        self._last_lag = 0.0
+
+    def observe_request(self, method, route, status, seconds):
+        key = (method, route, status)
+        self._requests[key] = self._requests.get(key, 0) + 1
+        h = self._latency.get((method, route))
+        if h is None:
+            h = self._latency[(method, route)] = Histogram()
+        h.observe(seconds)
+
+    def start(self, loop, lag_interval=0.5):
+        '''
+        每隔 lag_interval 秒排一次回调，回调实际执行的时间比预定的晚多少就是事件循环的延迟。
+        '''
+        def schedule():
+            expected = loop.time() + lag_interval
+            loop.call_at(expected, tick, expected)
+
+        def tick(expected):
+            lag = max(0.0, loop.time() - expected)
+            self._last_lag = lag
+            self._lag.observe(lag)
+            schedule()
+
+        if lag_interval:
+            schedule()
+
+    def render(self, recorder=None):
+        w = _Writer()
+        self._render_requests(w, recorder)
+        self._render_pools(w)
+        self._render_caches(w)
+        self._render_live(w)
+        self._render_runtime(w)
+        return w.text()
+
+    def _render_requests(self, w, recorder):
+        name = PREFIX + 'http_requests_total'
+        w.header(name, 'counter', 'HTTP requests by route and status.')
+        for (method, route, status), n in sorted(self._requests.items()):
+            w.sample(name, n, method=method, route=route, status=status)
+        name = PREFIX + 'http_request_duration_seconds'
+        w.header(name, 'histogram', 'HTTP request latency by route.')
+        for (method, route), h in sorted(self._latency.items()):
+            w.histogram(name, h, method=method, route=route)
+        # 打开了 configs.timing 时，各阶段的耗时
+        if recorder is not None:
+            name = PREFIX + 'http_stage_duration_seconds'
+            w.header(name, 'histogram', 'Time spent in each request stage (auth, handler, render, serialize).')
+            for stage, h in sorted(recorder.histograms.items()):
+                w.histogram(name, h, stage=stage)
+
+    def _render_pools(self, w):
+        pools = orm.named_pools()
+        name = PREFIX + 'db_pool_connections'
+        w.header(name, 'gauge', 'Database pool connections by state.')
+        for pool_name, pool in pools:
+            w.sample(name, pool.freesize, pool=pool_name, state='idle')
+            w.sample(name, pool.size - pool.freesize, pool=pool_name, state='in_use')
+        name = PREFIX + 'db_pool_max_connections'
+        w.header(name, 'gauge', 'Database pool size limit.')
+        for pool_name, pool in pools:
+            w.sample(name, pool.maxsize, pool=pool_name)
+
+    def _render_caches(self, w):
+        # 命中率用 rate(...{result="hit"}) / rate(...) 算
+        name = PREFIX + 'cache_requests_total'
+        w.header(name, 'counter', 'Cache lookups by cache and result.')
+        cache = pagecache.get_cache()
+        if cache is not None:
+            w.sample(name, cache.hits, cache='page', result='hit')
+            w.sample(name, cache.misses, cache='page', result='miss')
+        totals = {}
+        for flight in singleflight.flights():
+            for result, n in flight.stats.items():
+                totals[result] = totals.get(result, 0) + n
+        for result, n in sorted(totals.items()):
+            w.sample(name, n, cache='coalesce', result=result)
+        name = PREFIX + 'page_cache_entries'
+        w.header(name, 'gauge', 'Pages held in the anonymous page cache.')
+        w.sample(name, len(cache) if cache is not None else 0)
+
+    def _render_live(self, w):
+        hub = live.get_hub()
+        if hub is None:
+            return
+        name = PREFIX + 'sse_subscribers'
+        w.header(name, 'gauge', 'Open Server-Sent Events connections.')
+        w.sample(name, hub.subscribers)
+        name = PREFIX + 'sse_events_total'
+        w.header(name, 'counter', 'Events published to local subscribers.')
+        w.sample(name, hub.published)
+        name = PREFIX + 'sse_dropped_total'
+        w.header(name, 'counter', 'Subscribers disconnected for falling behind.')
+        w.sample(name, hub.dropped)
+
+    def _render_runtime(self, w):
+        name = PREFIX + 'event_loop_lag_seconds'
+        w.header(name, 'histogram', 'How late scheduled event loop callbacks ran.')
+        w.histogram(name, self._lag)
+        name = PREFIX + 'event_loop_lag_last_seconds'
+        w.header(name, 'gauge', 'Most recent event loop lag sample.')
+        w.sample(name, self._last_lag)
+        w.header('python_gc_collections_total', 'counter', 'Garbage collections by generation.')
+        for generation, stats in enumerate(gc.get_stats()):
+            w.sample('python_gc_collections_total', stats['collections'], generation=generation)
+        w.header('python_gc_objects_collected_total', 'counter', 'Objects collected by generation.')
+        for generation, stats in enumerate(gc.get_stats()):
+            w.sample('python_gc_objects_collected_total', stats['collected'], generation=generation)
+        w.header('python_gc_generation_count', 'gauge', 'Current gc.get_count() by generation.')
+        for generation, count in enumerate(gc.get_count()):
+            w.sample('python_gc_generation_count', count, generation=generation)
+        w.header('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.')
+        w.sample('process_resident_memory_bytes', _rss_bytes())
+        times = os.times()
+        w.header('process_cpu_seconds_total', 'counter', 'User and system CPU time.')
+        w.sample('process_cpu_seconds_total', times.user + times.system)
+        w.header('process_start_time_seconds', 'gauge', 'Start time of the process since the epoch.')
+        w.sample('process_start_time_seconds', self.start_time)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+把 blogs/comments 的 varchar(50) 字符串主键迁移为 idgen.py 生成的 bigint 主键.
+
+旧ID的前15位就是生成时的毫秒时间戳，新ID按这个时间戳重新生成，所以迁移后的顺序和原来一致。
+users 表不迁移：用户id参与了密码加盐，改掉后所有已注册用户都无法登录。
+
+用法:
+	python3 migrate_ids.py            # 只打印将要执行的SQL
+	python3 migrate_ids.py --report   # 只列出所属博客已删除、迁移时会被删掉的评论id
+	python3 migrate_ids.py --execute  # 真正执行，执行前请先 fab backup
+迁移完成后把配置里的 ids.type 改为 'bigint' 再重启。
+'''
+
+import sys, asyncio, logging
+
+import orm
+from config import configs
+from idgen import IdWorker
+
+
+def _legacy_timestamp(old_id, created_at):
+	# 旧ID形如 '%015d%s000' % (毫秒时间戳, uuid4().hex)
+	prefix = str(old_id)[:15]
+	if prefix.isdigit():
+		return int(prefix)
+	return int(created_at * 1000)
+
+
+def assign_ids(worker, rows):
+	'''
+	rows 为 (旧id, created_at) 列表，返回 {旧id: 新id}，同一毫秒内的记录用序列号区分。
+	'''
+	mapping = {}
+	last_ts, seq = None, 0
+	items = sorted(((_legacy_timestamp(old_id, created_at), old_id) for old_id, created_at in rows))
+	for ts, old_id in items:
+		if last_ts is not None and ts <= last_ts:
+			ts = last_ts
+			seq += 1
+			# 同一毫秒里的序列号用完了，借用下一毫秒
+			if seq > worker.max_sequence:
+				ts, seq = ts + 1, 0
+		else:
+			seq = 0
+		last_ts = ts
+		mapping[old_id] = worker.make_id(ts, worker.worker_id, seq)
+	return mapping
+
+
+# 没有对应博客的孤儿评论无法换算 blog_id，迁移时会被清理掉
+DELETE_ORPHANS = 'delete from `comments` where `new_blog_id` is null'
+
+
+def find_orphans(blogs, comments):
+	'''
+	返回所属博客已不存在的评论id，它们会在迁移中被删除。
+	'''
+	blog_ids = set(r['id'] for r in blogs)
+	return [r['id'] for r in comments if r['blog_id'] not in blog_ids]
+
+
+def build_statements(blog_ids, comment_ids):
+	sqls = [
+		('alter table `blogs` add column `new_id` bigint null', ()),
+		('alter table `comments` add column `new_id` bigint null, add column `new_blog_id` bigint null', ()),
+	]
+	for old_id, new_id in blog_ids.items():
+		sqls.append(('update `blogs` set `new_id`=? where `id`=?', (new_id, old_id)))
+	for old_id, new_id in comment_ids.items():
+		sqls.append(('update `comments` set `new_id`=? where `id`=?', (new_id, old_id)))
+	sqls.extend([
+		('update `comments` c join `blogs` b on c.`blog_id`=b.`id` set c.`new_blog_id`=b.`new_id`', ()),
+		(DELETE_ORPHANS, ()),
+		('alter table `blogs` drop primary key, drop column `id`, '
+		 'change column `new_id` `id` bigint not null, add primary key (`id`)', ()),
+		('alter table `comments` drop primary key, drop column `id`, drop column `blog_id`, '
+		 'change column `new_id` `id` bigint not null, change column `new_blog_id` `blog_id` bigint not null, '
+		 'add primary key (`id`), add key `idx_blog_id` (`blog_id`)', ()),
+	])
+	return sqls
+
+
+async def migrate(loop, execute=False, report=False):
+	await orm.create_pool(loop=loop, **configs.db)
+	ids = configs.ids
+	worker = IdWorker(ids.worker_id, worker_bits=ids.worker_bits, sequence_bits=ids.sequence_bits)
+	blogs = await orm.select('select `id`, `created_at` from `blogs`', [])
+	comments = await orm.select('select `id`, `blog_id`, `created_at` from `comments`', [])
+	orphans = find_orphans(blogs, comments)
+	if orphans:
+		logging.warning('%s comments belong to deleted blogs and will be removed' % len(orphans))
+	if report:
+		# 只列出将被删除的评论，不做任何修改
+		for comment_id in orphans:
+			print(comment_id)
+		return
+	blog_ids = assign_ids(worker, [(r['id'], r['created_at']) for r in blogs])
+	comment_ids = assign_ids(worker, [(r['id'], r['created_at']) for r in comments])
+	logging.info('migrating %s blogs and %s comments' % (len(blog_ids), len(comment_ids)))
+	for sql, args in build_statements(blog_ids, comment_ids):
+		if execute:
+			affected = await orm.execute(sql, args)
+			if sql == DELETE_ORPHANS:
+				logging.warning('removed %s orphan comments' % affected)
+		else:
+			print('%s; -- %s' % (sql, list(args)))
+
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO)
+	loop = asyncio.get_event_loop()
+	argv = sys.argv[1:]
+	loop.run_until_complete(migrate(loop, '--execute' in argv, '--report' in argv))
+	loop.close()
@@ -5,7 +5,9 @@
 '''
 import time, uuid
 
-from orm import Model, StringField, BooleanField, FloatField, TextField
+from orm import Model, StringField, BooleanField, FloatField, TextField, IntegerField
+from idgen import next_long_id
+from config import configs
 
 
 # 使用时间戳和UUID库结合生成唯一ID：
@@ -15,6 +17,21 @@ def next_id():
 	return '%015d%s000' % (int(time.time() * 1000), uuid.uuid4().hex)
 
 
+# blogs 和 comments 的主键类型由配置 ids.type 决定，'bigint' 时用 idgen 生成的整数ID，
+# 索引和 comments.blog_id 都比 varchar(50) 小得多。
+# users 的 id 参与了密码的sha1加盐，改掉会让已有密码全部失效，所以始终保持字符串。
+def _id_field():
+	if configs.ids.type == 'bigint':
+		return IntegerField(primary_key=True, default=next_long_id, ddl='bigint')
+	return StringField(primary_key=True, default=next_id, ddl='varchar(50)')
+
+
+def _ref_field():
+	if configs.ids.type == 'bigint':
+		return IntegerField(default=None, ddl='bigint')
+	return StringField(ddl='varchar(50)')
+
+
 class User(Model):
 	__table__ = 'users'
 
@@ -30,7 +47,7 @@ class User(Model):
 class Blog(Model):
 	__table__ = 'blogs'
 
-	id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
+	id = _id_field()
 	user_id = StringField(ddl='varchar(50)')
 	user_name = StringField(ddl='varchar(50)')
 	user_image = StringField(ddl='varchar(500)')
@@ -38,13 +55,20 @@ class Blog(Model):
 	summary = StringField(ddl='varchar(200)')
 	content = TextField()
 	created_at = FloatField(default=time.time)
+	# 博客这一行最后修改的时间(包括评论计数的变化)，用作页面的 Last-Modified / ETag
+	updated_at = FloatField(default=time.time)
+	# 评论数和最后评论时间，发表/删除评论时更新，counters.reconcile() 定期修正偏差
+	comment_count = IntegerField()
+	last_comment_at = FloatField()
 
 
 class Comment(Model):
 	__table__ = 'comments'
+	# 配置了 shards 时按 blog_id 分片存储
+	__shard_key__ = 'blog_id'
 
-	id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
-	blog_id = StringField(ddl='varchar(50)')
+	id = _id_field()
+	blog_id = _ref_field()
 	user_id = StringField(ddl='varchar(50)')
 	user_name = StringField(ddl='varchar(50)')
 	user_image = StringField(ddl='varchar(500)')
@@ -5,28 +5,35 @@ __author__ = 'Fanley Huang'
 
 import asyncio
 import logging
+import time
+import bisect
+import hashlib
 import aiomysql
 
+import timing
+
 
 def log(sql, args=()):
 	logging.info('SQL: %s' % sql)
 
 
+# 查询轨迹记录器(qtrace.TraceRecorder)，为None时不记录
+_recorder = None
+
+
+def set_recorder(recorder):
+	global _recorder
+	_recorder = recorder
+
+
 # The library provides connection pool as well as plain Connection objects.
 # pool = yield from aiomysql.create_pool(host='127.0.0.1', port=3306,
 #                                            user='root', password='',
 #                                            db='mysql', loop=loop)
 @asyncio.coroutine
-def create_pool(loop, **kw):
-	'''
-	创建连接池.
-	'''
-	logging.info('create database connection pool...')
-	# py的变量可以指向函数，当然也可以指向generator和corotine
-	global __pool
-	# 创建数据库连接池
+def _make_pool(loop, **kw):
 	# A coroutine that creates a pool of connections to MySQL database.
-	__pool = yield from aiomysql.create_pool(loop=loop,  # 传递消息循环对象loop用于异步执行，loop – is an optional event loop instance
+	return (yield from aiomysql.create_pool(loop=loop,  # 传递消息循环对象loop用于异步执行，loop – is an optional event loop instance
 			# 获取dict['key']的value，必须指定没有默认值
 			user=kw['user'],  # 数据库用户名，必须指定
 			password=kw['password'],  # 用户密码，必须指定
@@ -38,7 +45,100 @@ def create_pool(loop, **kw):
 			autocommit=kw.get('autocommit', True),  # 默认自动提交事务
 			maxsize=kw.get('maxsize', 10),  # 默认连接池最最多10个请求
 			minsize=kw.get('minsize', 1),  # 默认连接池最少1个请求
-	)
+	))
+
+
+@asyncio.coroutine
+def create_pool(loop, **kw):
+	'''
+	创建连接池.
+	'''
+	logging.info('create database connection pool...')
+	# py的变量可以指向函数，当然也可以指向generator和corotine
+	global __pool
+	# 创建数据库连接池
+	__pool = yield from _make_pool(loop, **kw)
+
+
+# 直接替换默认连接池，基准测试用它换上 fakedb.FakePool
+def set_pool(pool):
+	global __pool
+	__pool = pool
+
+
+# ---------------------------------水平分片---------------------------------
+# 定义了 __shard_key__ 的Model(比如按 blog_id 分片的 Comment)会按分片键的一致性哈希路由到不同的数据库，
+# 没有配置分片时所有Model都走默认的 __pool。
+__shard_pools = {}  # 分片名 -> 连接池
+__shard_ring = None
+
+
+class HashRing(object):
+	'''
+	一致性哈希环，每个节点放 replicas 个虚拟节点，增减分片时只有少量的key会换分片。
+	'''
+
+	def __init__(self, nodes, replicas=100):
+		self._ring = []
+		for node in nodes:
+			for i in range(replicas):
+				self._ring.append((self._hash('%s#%s' % (node, i)), node))
+		self._ring.sort()
+		self._keys = [h for h, node in self._ring]
+
+	@staticmethod
+	def _hash(key):
+		return int(hashlib.md5(str(key).encode('utf-8')).hexdigest()[:16], 16)
+
+	def get_node(self, key):
+		# str(key): 路由参数里的'123'和库里读出来的123要落到同一个分片
+		i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+		return self._ring[i][1]
+
+
+@asyncio.coroutine
+def create_shard_pools(loop, shards, replicas=100, **defaults):
+	'''
+	shards 为 {分片名: 数据库配置}，没写的配置项(用户名、密码等)取 defaults。
+	'''
+	global __shard_ring
+	for name, kw in shards.items():
+		conf = dict(defaults)
+		conf.update(kw)
+		logging.info('create shard pool %s => %s:%s/%s' % (name, conf.get('host'), conf.get('port'), conf.get('db')))
+		__shard_pools[name] = yield from _make_pool(loop, **conf)
+	__shard_ring = HashRing(sorted(shards.keys()), replicas)
+
+
+def is_sharded():
+	return __shard_ring is not None
+
+
+def shard_pool(key):
+	'''
+	返回分片键 key 所在分片的连接池.
+	'''
+	return __shard_pools[__shard_ring.get_node(key)]
+
+
+def shard_pools():
+	return [__shard_pools[name] for name in sorted(__shard_pools.keys())]
+
+
+# 关闭所有连接池，等借出去的连接都还回来
+@asyncio.coroutine
+def close_pools():
+	for name, pool in named_pools():
+		pool.close()
+		yield from pool.wait_closed()
+
+
+# 所有连接池: [(名字, 连接池)]，默认连接池叫 'default'，/metrics 用
+def named_pools():
+	# create_pool() 之前还没有 __pool 这个全局变量
+	pool = globals().get('__pool')
+	pools = [('default', pool)] if pool is not None else []
+	return pools + [(name, __shard_pools[name]) for name in sorted(__shard_pools.keys())]
 
 
 # Cursors are created by the Connection.cursor() coroutine: they are bound
@@ -47,16 +147,17 @@ def create_pool(loop, **kw):
 
 # select函数，负责查询
 @asyncio.coroutine
-def select(sql, args, size=None):
+def select(sql, args, size=None, pool=None):
 	'''
-	要执行SELECT语句，我们用select函数执行
+	要执行SELECT语句，我们用select函数执行，pool 为空时使用默认连接池
 	'''
 	log(sql, args)
 	global __pool
 	logging.info('select = %s and args = %s' % (sql, args))
+	start = time.time()
 	# 从连接池取一个conn出来，with..as..会在运行完后把conn放回连接池
 	# getting connection from pool of connections
-	with (yield from __pool) as conn:
+	with (yield from (pool or __pool)) as conn:
 		# A cursor which returns results as a dictionary. All methods and arguments same as Cursor.
 		cur = yield from conn.cursor(aiomysql.DictCursor)  # create dict cursor
 		# cursor.execute("SELECT Host, User FROM user"):execute sql query
@@ -67,20 +168,26 @@ def select(sql, args, size=None):
 			rs = yield from cur.fetchall()  # 取出所有结果
 		yield from cur.close()  # 关闭cursor
 		logging.info('rows returned: %s' % len(rs))
+		elapsed = time.time() - start
+		# 记到当前请求的耗时分解里(Server-Timing 的 db)
+		timing.add('db', elapsed)
+		if _recorder is not None:
+			_recorder.record(start, sql, args, elapsed)
 		return rs
 
 
 # create default cursor
 #     cursor = yield from conn.cursor()
 @asyncio.coroutine
-def execute(sql, args, autocommit=True):  # execute(query, args=None)
+def execute(sql, args, autocommit=True, pool=None):  # execute(query, args=None)
 	'''
 	要执行INSERT、UPDATE、DELETE语句，可以定义一个通用的execute()函数，
 	因为这3种SQL的执行都需要相同的参数，以及返回一个整数表示影响的行数
 	'''
 	log(sql)
+	start = time.time()
 	# 从连接池取一个conn出来，with..as..会在运行完后把conn放回连接池
-	with (yield from __pool) as conn:
+	with (yield from (pool or __pool)) as conn:
 		if not autocommit:
 			yield from conn.begin()
 		try:
@@ -96,9 +203,130 @@ def execute(sql, args, autocommit=True):  # execute(query, args=None)
 				# 顺序，顺序执行操作时，有一个执行失败，则之前操作成功的也会回滚，即未操作的状态。
 				yield from conn.rollback()
 			raise
+		elapsed = time.time() - start
+		timing.add('db', elapsed)
+		if _recorder is not None:
+			_recorder.record(start, sql, args, elapsed)
 		return affected
 
 
+# 在所有 pools 上并发执行同一条查询，返回每个分片的结果列表
+@asyncio.coroutine
+def select_all(sql, args, pools, size=None):
+	return (yield from asyncio.gather(*[select(sql, args, size, pool) for pool in pools]))
+
+
+# 流式查询: 用服务端游标(SSDictCursor)每次取 batch 行，结果集再大内存里也只有一批
+# 迭代期间一直占着一个连接，调用方中途停止迭代时游标会被关闭，连接放回连接池
+async def select_iter(sql, args, batch=100, pool=None):
+	log(sql, args)
+	# 只算等数据库的时间，不算调用方处理每一行的时间
+	waited = 0.0
+	with (await (pool or __pool)) as conn:
+		cur = await conn.cursor(aiomysql.SSDictCursor)
+		try:
+			start = time.perf_counter()
+			await cur.execute(sql.replace('?', '%s'), args or ())
+			while True:
+				rs = await cur.fetchmany(batch)
+				waited += time.perf_counter() - start
+				if not rs:
+					break
+				for r in rs:
+					yield r
+				start = time.perf_counter()
+		finally:
+			await cur.close()
+			timing.add('db', waited)
+
+
+# 解析 orderBy(如 'created_at desc, id')，返回 [(列名, 是否降序)]
+def _parse_order(orderBy):
+	order = []
+	for item in [o.strip() for o in orderBy.split(',') if o.strip()]:
+		parts = item.replace('`', '').split()
+		order.append((parts[0], len(parts) > 1 and parts[1].lower() == 'desc'))
+	return order
+
+
+# 键集分页: 按 (col, 主键) 排序，每页从上一页最后一行之后开始，每页单独取一次连接
+async def _iter_keyset(cls, where, args, col, desc, pageSize, pool):
+	pk = cls.__primary_key__
+	op, direction = ('<', 'desc') if desc else ('>', 'asc')
+	last = None
+	while True:
+		sql = [cls.__select__]
+		conds = ['(%s)' % where] if where else []
+		params = list(args or [])
+		if last is not None:
+			conds.append('(`%s` %s ? or (`%s` = ? and `%s` %s ?))' % (col, op, col, pk, op))
+			params.extend((last[col], last[col], last[pk]))
+		if conds:
+			sql.append('where')
+			sql.append(' and '.join(conds))
+		sql.append('order by `%s` %s, `%s` %s limit ?' % (col, direction, pk, direction))
+		params.append(pageSize)
+		rs = await select(' '.join(sql), params, pool=pool)
+		for r in rs:
+			yield r
+		if len(rs) < pageSize:
+			return
+		last = rs[-1]
+
+
+# 按 orderBy 对多个分片取回的行做归并排序
+def _sort_rows(rows, orderBy):
+	for col, reverse in reversed(_parse_order(orderBy)):
+		rows.sort(key=lambda r: r[col], reverse=reverse)
+	return rows
+
+
+# 按 order 排序时 a 是否应该排在 b 前面
+def _row_before(a, b, order):
+	for col, desc in order:
+		if a[col] != b[col]:
+			return (a[col] > b[col]) if desc else (a[col] < b[col])
+	return False
+
+
+# 归并多个分片的有序流，每个分片都已经按 orderBy 排好序
+async def _merge_iters(iters, orderBy):
+	order = _parse_order(orderBy) if orderBy else []
+	heads = []
+	for it in iters:
+		try:
+			heads.append([await it.__anext__(), it])
+		except StopAsyncIteration:
+			pass
+	try:
+		while heads:
+			best = heads[0]
+			for h in heads[1:]:
+				if _row_before(h[0], best[0], order):
+					best = h
+			yield best[0]
+			try:
+				best[0] = await best[1].__anext__()
+			except StopAsyncIteration:
+				heads.remove(best)
+	finally:
+		for h in heads:
+			await h[1].aclose()
+
+
+# 合并各分片上 findNumber 的结果，只支持能合并的聚合函数
+def _merge_numbers(selectField, values):
+	values = [v for v in values if v is not None]
+	func = selectField.strip().lower()
+	if func.startswith('count') or func.startswith('sum'):
+		return sum(values)
+	if func.startswith('max'):
+		return max(values) if values else None
+	if func.startswith('min'):
+		return min(values) if values else None
+	raise ValueError('Cannot merge %s across shards' % selectField)
+
+
 # 构造sql语句参数字符串，最后返回的字符串会以','分割多个'?'，如 num==3，则会返回 '?, ?, ?'
 # >>> create_args_string(3)
 # '?, ?, ?'
@@ -137,8 +365,9 @@ class BooleanField(Field):
 
 
 class IntegerField(Field):
-	def __init__(self, name=None, primary_key=False, default=0):
-		super().__init__(name, 'bigint', primary_key, default)
+	# 作主键时传入 default=idgen.next_long_id 之类的生成函数
+	def __init__(self, name=None, primary_key=False, default=0, ddl='bigint'):
+		super().__init__(name, ddl, primary_key, default)
 
 
 class FloatField(Field):
@@ -208,6 +437,9 @@ class ModelMetaclass(type):
 					fields.append(k)  # 记录不是主键的属性的 key 值
 		if not primaryKey:
 			raise RuntimeError('Primary key not found.')  # 如果没有主见则报错
+		shardKey = attrs.get('__shard_key__', None)  # 分片键，如 Comment 的 'blog_id'
+		if shardKey and shardKey not in mappings:
+			raise RuntimeError('Shard key not found: %s' % shardKey)
 		for k in mappings.keys():  # 遍历属性的value值是 Field 的key值
 			attrs.pop(k)  # 把类的方法集合中的属于Field类型的从attrs中移除
 		# print(k)
@@ -228,6 +460,7 @@ class ModelMetaclass(type):
 		attrs['__table__'] = tableName
 		attrs['__primary_key__'] = primaryKey  # 主键属性名'id'
 		attrs['__fields__'] = fields  # 除主键外的属性名:['password', 'name', 'email']
+		attrs['__shard_key__'] = shardKey
 		# 构造默认的SELECT, INSERT, UPDATE和DELETE语句:
 		# select `id`, `email`, `password`, `name` from `User`
 		attrs['__select__'] = 'select `%s`, %s from `%s`' % (primaryKey, ', '.join(escaped_fields), tableName)
@@ -284,7 +517,22 @@ class Model(dict, metaclass=ModelMetaclass):
 	# classmethod是用来指定一个类的方法为类方法，没有此参数指定的类的方法为实例方法，类方法既可以直接类调用(C.f())，也可以进行实例调用(C().f())。：
 	# 所有这些方法都用@asyncio.coroutine装饰，变成一个协程:
 
+	# 分片键值为 key 的记录所在的连接池，None 表示默认连接池
+	@classmethod
+	def _pool_for(cls, key):
+		if cls.__shard_key__ and is_sharded():
+			return shard_pool(key)
+		return None
+
+	# 没有给出分片键时需要查询的所有连接池(scatter-gather)
+	@classmethod
+	def _scatter_pools(cls, shardKey=None):
+		if cls.__shard_key__ and is_sharded() and shardKey is None:
+			return shard_pools()
+		return [cls._pool_for(shardKey)]
+
 	# Example: Comment.findAll('blog_id=?', [id], orderBy='created_at desc',limit=(page.offset, page.limit))
+	# 分片的Model传入 shardKey=blog_id 只查一个分片，否则查询所有分片后归并
 	@classmethod
 	@asyncio.coroutine
 	def findAll(cls, where=None, args=None, **kw):
@@ -300,6 +548,8 @@ class Model(dict, metaclass=ModelMetaclass):
 			sql.append('order by')
 			sql.append(orderBy)
 		limit = kw.get('limit', None)  # kw参数有无limit
+		pools = cls._scatter_pools(kw.get('shardKey', None))
+		offset = 0
 		if limit is not None:
 			sql.append('limit')
 			if isinstance(limit, int):  # limit带1个参数
@@ -307,53 +557,207 @@ class Model(dict, metaclass=ModelMetaclass):
 				args.append(limit)
 			elif isinstance(limit, tuple) and len(limit) == 2:  # limit带2个参数
 				sql.append('?, ?')
-				args.extend(limit)
+				if len(pools) > 1:
+					# 每个分片都要取前 offset+limit 条，归并后再截取
+					offset = limit[0]
+					args.extend((0, limit[0] + limit[1]))
+				else:
+					args.extend(limit)
 			else:
 				raise ValueError('Invalid limit value: %s' % str(limit))
-		rs = yield from select(' '.join(sql), args)  # 调用select方法，通过execute执行sql语句
+		if len(pools) == 1:
+			rs = yield from select(' '.join(sql), args, pool=pools[0])  # 调用select方法，通过execute执行sql语句
+			return [cls(**r) for r in rs]
+		rs = []
+		for rows in (yield from select_all(' '.join(sql), args, pools)):
+			rs.extend(rows)
+		if orderBy:
+			_sort_rows(rs, orderBy)
+		if limit is not None:
+			rs = rs[offset:offset + (limit if isinstance(limit, int) else limit[1])]
 		return [cls(**r) for r in rs]
 
+	# 和 findAll 参数相同，但返回异步迭代器，边从数据库读边产出对象，适合导出和流式输出
+	# Example: async for c in Comment.iterAll(orderBy='created_at desc'): ...
+	@classmethod
+	async def iterAll(cls, where=None, args=None, **kw):
+		sql = [cls.__select__]
+		if where:
+			sql.append('where')
+			sql.append(where)
+		args = list(args or [])
+		orderBy = kw.get('orderBy', None)
+		if orderBy:
+			sql.append('order by')
+			sql.append(orderBy)
+		pools = cls._scatter_pools(kw.get('shardKey', None))
+		limit = kw.get('limit', None)
+		offset, count = 0, None
+		if isinstance(limit, int):
+			count = limit
+		elif isinstance(limit, tuple) and len(limit) == 2:
+			offset, count = limit
+		elif limit is not None:
+			raise ValueError('Invalid limit value: %s' % str(limit))
+		if count is not None:
+			# 多个分片时每个分片取前 offset+limit 行，归并时再跳过 offset 行
+			sql.append('limit ?, ?')
+			args.extend((offset, count) if len(pools) == 1 else (0, offset + count))
+		batch = kw.get('batch', 100)
+		if len(pools) == 1:
+			rows, skip = select_iter(' '.join(sql), args, batch, pools[0]), 0
+		else:
+			rows, skip = _merge_iters([select_iter(' '.join(sql), args, batch, p) for p in pools], orderBy), offset
+		n = 0
+		try:
+			async for r in rows:
+				if skip:
+					skip -= 1
+					continue
+				if count is not None and n >= count:
+					break
+				n += 1
+				yield cls(**r)
+		finally:
+			await rows.aclose()
+
+	# 和 iterAll 一样边读边产出对象，但按 orderBy 列加主键做键集分页(keyset)，每页是一次普通查询，
+	# 查完就把连接放回连接池，导出整张表时不会一直占着连接。orderBy 只能是一列，例如 'created_at desc'
+	# Example: async for c in Comment.iterPages(orderBy='created_at desc', pageSize=500): ...
+	@classmethod
+	async def iterPages(cls, where=None, args=None, *, orderBy, pageSize=500, shardKey=None):
+		order = _parse_order(orderBy)
+		if len(order) != 1:
+			raise ValueError('iterPages needs exactly one orderBy column: %s' % orderBy)
+		col, desc = order[0]
+		pools = cls._scatter_pools(shardKey)
+		pages = [_iter_keyset(cls, where, args, col, desc, pageSize, p) for p in pools]
+		if len(pages) == 1:
+			rows = pages[0]
+		else:
+			rows = _merge_iters(pages, '%s %s, %s %s' % (col, 'desc' if desc else 'asc', cls.__primary_key__, 'desc' if desc else 'asc'))
+		try:
+			async for r in rows:
+				yield cls(**r)
+		finally:
+			await rows.aclose()
+
 	# Example: User.findNumber('count(id)')
 	@classmethod
 	@asyncio.coroutine
-	def findNumber(cls, selectField, where=None, args=None):
+	def findNumber(cls, selectField, where=None, args=None, shardKey=None):
 		' find number by select and where. '
 		sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
 		if where:
 			sql.append('where')
 			sql.append(where)
-		rs = yield from select(' '.join(sql), args, 1)
-		if len(rs) == 0:
+		pools = cls._scatter_pools(shardKey)
+		results = yield from select_all(' '.join(sql), args, pools, 1)
+		values = [rs[0]['_num_'] for rs in results if len(rs) > 0]
+		if len(values) == 0:
 			return None
-		return rs[0]['_num_']
+		if len(pools) == 1:
+			return values[0]
+		return _merge_numbers(selectField, values)
 
 	@classmethod
 	@asyncio.coroutine
-	def countRows(cls, selectField, where=None, args=None):
+	def countRows(cls, selectField, where=None, args=None, shardKey=None):
 		' find number by select and where. '
 		sql = ['select count(%s) _num_ from `%s`' % (selectField, cls.__table__)]
 		if where:
 			sql.append('where %s' % (where))
-		resultset = yield from select(' '.join(sql), args, 1)
-		if len(resultset) == 0:
+		results = yield from select_all(' '.join(sql), args, cls._scatter_pools(shardKey), 1)
+		values = [rs[0]['_num_'] for rs in results if len(rs) > 0]
+		if len(values) == 0:
 			return None
-		return resultset[0]['_num_']
+		return sum(values)
+
+
+	# 原子地给计数列加上 delta(结果不小于0)，kw 为同时要设置的其他列
+	# Example: Blog.increment(blog_id, 'comment_count', 1, last_comment_at=time.time())
+	@classmethod
+	@asyncio.coroutine
+	def increment(cls, pk, field, delta=1, **kw):
+		sets = ['`%s`=greatest(`%s`+?, 0)' % (field, field)] + ['`%s`=?' % k for k in kw.keys()]
+		args = [delta] + list(kw.values()) + [pk]
+		sql = 'update `%s` set %s where `%s`=?' % (cls.__table__, ', '.join(sets), cls.__primary_key__)
+		# 不知道记录在哪个分片时每个分片都执行一次，只有记录所在的分片会更新到行
+		affected = 0
+		for pool in cls._scatter_pools(pk if cls.__shard_key__ == cls.__primary_key__ else None):
+			affected += yield from execute(sql, args, pool=pool)
+		return affected
+
+	# 按条件删除，返回删除的行数；limit 用来分批删除大量记录，不长时间锁表
+	# limit 是一个库上的上限，在多个分片上删除时没法保证总数，所以这时必须给出 shardKey
+	# Example: Comment.removeWhere('blog_id=?', [blog_id], shardKey=blog_id, limit=500)
+	@classmethod
+	@asyncio.coroutine
+	def removeWhere(cls, where, args, shardKey=None, limit=None):
+		sql = 'delete from `%s` where %s' % (cls.__table__, where)
+		args = list(args)
+		pools = cls._scatter_pools(shardKey)
+		if limit is not None:
+			if len(pools) > 1:
+				raise ValueError('removeWhere with limit needs shardKey on sharded table %s' % cls.__table__)
+			sql += ' limit ?'
+			args.append(limit)
+		affected = 0
+		for pool in pools:
+			affected += yield from execute(sql, args, pool=pool)
+		return affected
 
+	# 在Model所在的所有分片上执行一条自定义查询，返回合并后的行(dict)，用于 group by 之类的统计
+	@classmethod
+	@asyncio.coroutine
+	def selectRows(cls, sql, args=None, shardKey=None):
+		rs = []
+		for rows in (yield from select_all(sql, args, cls._scatter_pools(shardKey))):
+			rs.extend(rows)
+		return rs
 
 	# Example: Blog.find(id)
 	@classmethod
 	@asyncio.coroutine
-	def find(cls, pk):
+	def find(cls, pk, shardKey=None):
 		' find object by primary key. '
 		# ?号的内容在select中实现格式输入
-		rs = yield from select('%s where `%s`=?' % (cls.__select__, cls.__primary_key__), [pk], 1)
-		if len(rs) == 0:
-			return None
-		return cls(**rs[0])
+		sql = '%s where `%s`=?' % (cls.__select__, cls.__primary_key__)
+		for rs in (yield from select_all(sql, [pk], cls._scatter_pools(shardKey), 1)):
+			if len(rs) > 0:
+				return cls(**rs[0])
+		return None
+
+	# 多行插入: insert into `t` (...) values (...), (...)，分片的Model按分片分组后各执行一次
+	# ignore=True 时用 insert ignore，主键已存在的行被跳过，重放写入日志时不会重复插入
+	@classmethod
+	@asyncio.coroutine
+	def saveAll(cls, instances, ignore=False):
+		' insert several objects with one statement per pool. '
+		groups = {}
+		for obj in instances:
+			args = list(map(obj.getValueOrDefault, cls.__fields__))
+			args.append(obj.getValueOrDefault(cls.__primary_key__))
+			pool = obj._pool()
+			groups.setdefault(id(pool), (pool, []))[1].append(args)
+		head, values = cls.__insert__.split(' values ', 1)
+		if ignore:
+			head = head.replace('insert into', 'insert ignore into', 1)
+		affected = 0
+		for pool, rows in groups.values():
+			sql = '%s values %s' % (head, ', '.join([values] * len(rows)))
+			affected += yield from execute(sql, [a for args in rows for a in args], pool=pool)
+		return affected
 
 	# -------------往Model类添加实例方法，就可以让所有子类调用实例方法：---------------#
 	# 所有这些方法都用@asyncio.coroutine装饰，变成一个协程:
 
+	# 当前实例所在分片的连接池
+	def _pool(self):
+		if self.__shard_key__:
+			return self._pool_for(self.getValue(self.__shard_key__))
+		return None
+
 	# 保存数据
 	@asyncio.coroutine
 	def save(self):
@@ -362,16 +766,22 @@ class Model(dict, metaclass=ModelMetaclass):
 		# 增加主键值到args中，没有则赋值为初始默认值：
 		args.append(self.getValueOrDefault(self.__primary_key__))
 		# 通过实例调用 save()，把数据存入响应的对象(表)，Example: user.save()
-		rows = yield from execute(self.__insert__, args)
+		rows = yield from execute(self.__insert__, args, pool=self._pool())
 		if rows != 1:
 			logging.warn('failed to insert record: affected rows: %s' % rows)
 
-	# 更新数据
+	# 更新数据，给出 fields 时只更新这几列，避免把计数器之类别处在改的列写回旧值
+	# Example: blog.update(['name', 'summary', 'content'])
 	@asyncio.coroutine
-	def update(self):
-		args = list(map(self.getValue, self.__fields__))
+	def update(self, fields=None):
+		if fields is None:
+			sql, fields = self.__update__, self.__fields__
+		else:
+			sql = 'update `%s` set %s where `%s`=?' % (self.__table__, ', '.join(
+				map(lambda f: '`%s`=?' % (self.__mappings__[f].name or f), fields)), self.__primary_key__)
+		args = list(map(self.getValue, fields))
 		args.append(self.getValue(self.__primary_key__))
-		rows = yield from execute(self.__update__, args)
+		rows = yield from execute(sql, args, pool=self._pool())
 		if rows != 1:
 			logging.warn('failed to update by primary key: affected rows: %s' % rows)
 
@@ -379,7 +789,7 @@ class Model(dict, metaclass=ModelMetaclass):
 	@asyncio.coroutine
 	def remove(self):
 		args = [self.getValue(self.__primary_key__)]
-		rows = yield from execute(self.__delete__, args)
+		rows = yield from execute(self.__delete__, args, pool=self._pool())
 		if rows != 1:
 			logging.warn('failed to remove by primary key: affected rows: %s' % rows)
 
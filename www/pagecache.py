@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+匿名访客的整页缓存: 首页和博客页对所有没登录的访客都一样，缓存编码好的响应字节(和gzip压缩后的字节)，
+命中时不经过 auth、不查数据库、不渲染模板.
+
+缓存项按标签失效: 首页(含翻页)的标签是 'index'，博客页是 'blog:<id>'。
+写博客、评论的处理函数调用 invalidate()，例如发表评论后:
+
+    pagecache.invalidate('index', 'blog:%s' % blog_id)
+
+失效只作用于当前进程，多进程部署时 ttl 是其他进程缓存的最长过期时间.
+
+缓存key只包含路径和页面用到的查询参数(例如首页的 page)，带着其他参数的请求不走缓存，
+随机的查询串不会挤掉真正的页面.
+'''
+
+import re, time, logging
+
+from urllib import parse
+
+from collections import OrderedDict
+
+import compress
+
+# 可以缓存的页面: 路径正则 -> 标签, 页面用到的查询参数
+_RULES = [
+    (re.compile(r'^/$'), lambda m: 'index', ('page',)),
+    (re.compile(r'^/blog/([^/]+)$'), lambda m: 'blog:%s' % m.group(1), ())
+]
+
+
+# 缓存页面时保存的响应头
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+
+class _Page(object):
+
+    def __init__(self, body, headers, tag, expires):
+        self.body = body
+        # 放进缓存时压缩一次，之后每次命中都直接发送压缩好的字节
+        mimetype = headers.get('Content-Type', '').split(';')[0].strip()
+        self.gz = compress.gzip_bytes(body) if compress.is_compressible(mimetype) else None
+        # 只保留和内容有关的响应头，见 CACHED_HEADERS
+        self.headers = headers
+        self.tag = tag
+        self.expires = expires
+
+
+class PageCache(object):
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._pages = OrderedDict()
+        # 标签 -> 失效次数。开始渲染后标签失效过的页面不能再放进缓存，否则会缓存失效前查出的旧数据
+        self._generations = {}
+        # 命中和未命中的次数，/metrics 用
+        self.hits = 0
+        self.misses = 0
+
+    def tag_for(self, path):
+        '''
+        返回 path 对应的标签，不能缓存的页面返回 None。
+        '''
+        for pattern, tag, params in _RULES:
+            m = pattern.match(path)
+            if m:
+                return tag(m)
+        return None
+
+    def lookup(self, path, query):
+        '''
+        返回 (标签, 缓存key)，不能缓存的请求返回 None。query 里有页面用不到的参数时也返回 None。
+        '''
+        for pattern, tag, params in _RULES:
+            m = pattern.match(path)
+            if m:
+                if any(k not in params for k in query):
+                    return None
+                # 和处理函数一样，重复的参数取第一个
+                args = [(k, query[k]) for k in params if k in query]
+                return tag(m), path + ('?' + parse.urlencode(args) if args else '')
+        return None
+
+    def generation(self, tag):
+        return self._generations.get(tag, 0)
+
+    def get(self, key):
+        page = self._pages.get(key)
+        if page is not None and page.expires < time.time():
+            del self._pages[key]
+            page = None
+        if page is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pages.move_to_end(key)
+        return page
+
+    def put(self, key, tag, generation, body, headers):
+        if self.generation(tag) != generation:
+            return None
+        page = _Page(body, headers, tag, time.time() + self._ttl)
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        while len(self._pages) > self._max_entries:
+            self._pages.popitem(last=False)
+        return page
+
+    def invalidate(self, *tags):
+        tags = set(tags)
+        for tag in tags:
+            self._generations[tag] = self.generation(tag) + 1
+        for key in [k for k, p in self._pages.items() if p.tag in tags]:
+            del self._pages[key]
+
+    def __len__(self):
+        return len(self._pages)
+
+
+_cache = None
+
+
+def init(max_entries=1000, ttl=300):
+    global _cache
+    _cache = PageCache(max_entries, ttl)
+    logging.info('page cache enabled: %s entries, ttl %ss' % (max_entries, ttl))
+
+
+def get_cache():
+    return _cache
+
+
+def invalidate(*tags):
+    '''
+    让带有这些标签的缓存页面失效，没有启用缓存时什么都不做。
+    '''
+    if _cache is not None:
+        _cache.invalidate(*tags)
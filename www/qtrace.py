@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+数据库查询轨迹: 记录线上的每条SQL，拿到本地用 replay.py 重放压测.
+
+轨迹文件是NDJSON，每行一条查询:
+	{"ts": 1467000000.123, "sql": "select ... where `id`=?", "args": ["..."], "dur": 0.0012}
+orm生成的SQL本来就是带?占位符的，sql字段直接就是查询的"形状"。
+'''
+
+import re, json, math, time, random, logging
+
+# saveAll 的多行insert每次行数不同，归成同一种形状
+_RE_MULTI_VALUES = re.compile(r'(values \([?, ]+\))(, \([?, ]+\))+')
+
+
+def shape(sql):
+	return _RE_MULTI_VALUES.sub(r'\1, ...', sql)
+
+
+class TraceRecorder(object):
+	'''
+	sample 为采样比例；record_args=False 时不记录参数(参数里有邮箱、密码摘要等)，这样的轨迹只能统计不能重放。
+	'''
+
+	def __init__(self, path, sample=1.0, record_args=True):
+		self.path = path
+		self.sample = sample
+		self.record_args = record_args
+		self._file = open(path, 'a', encoding='utf-8')
+		self._last_flush = time.time()
+		logging.info('recording query trace to %s (sample=%s)' % (path, sample))
+
+	def record(self, ts, sql, args, duration):
+		if self.sample < 1.0 and random.random() >= self.sample:
+			return
+		event = {'ts': round(ts, 6), 'sql': sql, 'dur': round(duration, 6)}
+		if self.record_args:
+			event['args'] = list(args or ())
+		self._file.write(json.dumps(event, ensure_ascii=False, default=str) + '\n')
+		# 最多每秒刷一次盘，进程被杀时最多丢最后一秒的记录
+		if ts - self._last_flush > 1.0:
+			self.flush()
+
+	def flush(self):
+		self._file.flush()
+		self._last_flush = time.time()
+
+	def close(self):
+		self.flush()
+		self._file.close()
+		logging.info('query trace %s closed' % self.path)
+
+
+def load(path):
+	'''
+	读取轨迹文件，按时间排序返回事件列表，跳过写了一半的行。
+	'''
+	events = []
+	with open(path, 'r', encoding='utf-8') as f:
+		for line in f:
+			try:
+				events.append(json.loads(line))
+			except ValueError:
+				logging.warning('skip broken trace line')
+	events.sort(key=lambda e: e['ts'])
+	return events
+
+
+def percentile(sorted_values, p):
+	if not sorted_values:
+		return 0.0
+	# nearest-rank
+	k = max(0, int(math.ceil(p / 100.0 * len(sorted_values))) - 1)
+	return sorted_values[min(k, len(sorted_values) - 1)]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+令牌桶限流: 登录、注册、发表评论这些要查库、算SHA1的接口，按IP和按用户各一个令牌桶.
+
+在 configs.ratelimit.routes 里按路由配置，rate 是每秒补充的令牌数，burst 是桶的容量:
+
+    'POST /api/authenticate' : {'ip' : {'rate' : 0.2, 'burst' : 10}}
+
+令牌用完时 app.ratelimit_middleware 直接返回 429 和 Retry-After，在 auth 之前，不会查数据库.
+按用户限流时用的是会话cookie(不验证，验证要查库)：伪造的cookie只能换一个桶，仍然受IP的限制.
+'''
+
+import re, math, time, hashlib
+
+from collections import OrderedDict
+
+
+class _Bucket(object):
+
+    __slots__ = ('tokens', 'updated', 'full_at')
+
+    def __init__(self, tokens, updated, full_at):
+        self.tokens = tokens
+        self.updated = updated
+        # 到这个时间桶就又满了，和没有这个桶一样，可以丢掉
+        self.full_at = full_at
+
+
+class BucketStore(object):
+    '''
+    key -> 令牌桶，最多保存 max_keys 个，满了先丢最久没用的，已经补满的桶随时可以丢掉。
+    '''
+
+    def __init__(self, max_keys=100000):
+        self._max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst, now=None):
+        '''
+        从桶里取一个令牌。返回 0 表示放行，否则返回还要等多少秒。
+        '''
+        now = time.time() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.full_at <= now:
+            tokens = burst
+        else:
+            tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        tokens -= 1
+        full_at = now + (burst - tokens) / rate
+        if bucket is None:
+            self._buckets[key] = _Bucket(tokens, now, full_at)
+            self._expire(now)
+        else:
+            bucket.tokens, bucket.updated, bucket.full_at = tokens, now, full_at
+        return 0
+
+    def _expire(self, now):
+        # 最久没用的桶在最前面，先丢掉已经补满的
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.full_at > now and len(self._buckets) <= self._max_keys:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _route_pattern(route):
+    # 'POST /api/blogs/{id}/comments' -> ('POST', ^/api/blogs/[^/]+/comments$)
+    method, path = route.split(None, 1)
+    pattern = re.sub(r'\\\{\w+\\\}', '[^/]+', re.escape(path))
+    return method.upper(), re.compile('^%s$' % pattern)
+
+
+class RateLimiter(object):
+
+    def __init__(self, routes, max_keys=100000, trust_proxy=False):
+        self._rules = []
+        for route, limits in routes.items():
+            method, pattern = _route_pattern(route)
+            self._rules.append((method, pattern, route, limits.get('ip'), limits.get('user')))
+        self._store = BucketStore(max_keys)
+        self._trust_proxy = trust_proxy
+
+    def client_ip(self, request):
+        # 部署在nginx后面时真实IP在 X-Real-IP 里，直接对外时这个头可以伪造，不能信
+        if self._trust_proxy:
+            ip = request.headers.get('X-Real-IP')
+            if ip:
+                return ip
+        peer = request.transport.get_extra_info('peername') if request.transport is not None else None
+        return peer[0] if peer else ''
+
+    def check(self, request, session=None):
+        '''
+        返回 0 表示放行，否则返回客户端应等待的秒数。session 是会话cookie的值。
+        '''
+        for method, pattern, route, ip_limit, user_limit in self._rules:
+            if method != request.method or not pattern.match(request.path):
+                continue
+            now = time.time()
+            wait = 0
+            if ip_limit:
+                wait = self._store.take(('ip', route, self.client_ip(request)), ip_limit['rate'], ip_limit['burst'], now)
+            if not wait and user_limit and session:
+                key = ('user', route, hashlib.md5(session.encode('utf-8')).hexdigest())
+                wait = self._store.take(key, user_limit['rate'], user_limit['burst'], now)
+            return wait
+        return 0
+
+
+def retry_after(wait):
+    # Retry-After 只能是整数秒
+    return str(max(1, int(math.ceil(wait))))
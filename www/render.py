@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Markdown 渲染服务: markdown2 是纯Python的正则，长文章一次转换要几十毫秒，期间事件循环上的其他连接都要等着.
+
+短于 inline_limit 个字符的直接在事件循环里转换(交给进程池的开销比转换本身还大)，
+更长的交给进程池。同时在进程池里转换的最多 max_inflight 篇，再排队等待的最多 max_waiting 篇，
+超过时抛出 RenderBusy，处理函数返回 503，而不是让请求越积越多:
+
+    try:
+        blog.html_content = yield from render.markdown(blog.content)
+    except render.RenderBusy:
+        return web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
+
+没有调用 init() 时(比如脚本里)全部直接转换.
+'''
+
+import signal, asyncio, logging, multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+import markdown2
+import timing
+
+
+class RenderBusy(Exception):
+    pass
+
+
+_executor = None
+_semaphore = None
+_inline_limit = 0
+_max_waiting = 0
+_timeout = None
+_waiting = 0
+
+
+def _init_process():
+    # Ctrl-C 由 server.py 的主进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def init(processes=2, inline_limit=8192, max_inflight=4, max_waiting=32, timeout=10.0):
+    '''
+    启动进程池。用 spawn 而不是 fork: 不把事件循环、数据库连接和监听套接字复制到子进程里。
+    '''
+    global _executor, _semaphore, _inline_limit, _max_waiting, _timeout
+    _executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                                    initializer=_init_process)
+    _semaphore = asyncio.Semaphore(max_inflight)
+    _inline_limit = inline_limit
+    _max_waiting = max_waiting
+    _timeout = timeout
+    logging.info('markdown render pool: %s processes, inline below %s chars' % (processes, inline_limit))
+
+
+async def warm_up():
+    # 子进程启动和导入 markdown2 要几百毫秒，不要留给第一篇长文章
+    if _executor is not None:
+        await asyncio.get_event_loop().run_in_executor(_executor, markdown2.markdown, '')
+
+
+def close():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+# 处理函数都是生成器写的协程，里面不能 yield from async def 的协程
+@asyncio.coroutine
+def markdown(text):
+    '''
+    把 markdown 转换为 html，耗时记在当前请求的 'markdown' 上。
+    '''
+    global _waiting
+    with timing.measure('markdown'):
+        if _executor is None or len(text) < _inline_limit:
+            return markdown2.markdown(text)
+        if _semaphore.locked() and _waiting >= _max_waiting:
+            raise RenderBusy()
+        _waiting += 1
+        try:
+            yield from _semaphore.acquire()
+        finally:
+            _waiting -= 1
+        try:
+            fut = asyncio.get_event_loop().run_in_executor(_executor, markdown2.markdown, text)
+        except BaseException:
+            _semaphore.release()
+            raise
+        # 子进程真正转换完才归还名额: 超时或请求被取消时转换还在进程池里占着一个进程
+        fut.add_done_callback(_release)
+        try:
+            return (yield from asyncio.wait_for(asyncio.shield(fut), _timeout))
+        except asyncio.TimeoutError:
+            # 子进程里的转换停不下来，只能不等它了
+            logging.warning('markdown render timed out after %ss (%s chars)' % (_timeout, len(text)))
+            raise RenderBusy()
+
+
+def _release(fut):
+    _semaphore.release()
+    # 没人等结果时也要取出异常，免得日志里报 exception was never retrieved
+    if not fut.cancelled():
+        fut.exception()
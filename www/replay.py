@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+把 qtrace 录下的查询轨迹重放到本地数据库，输出每种查询形状的延迟分位数.
+
+	python3 replay.py trace.ndjson                    # 按原速重放
+	python3 replay.py trace.ndjson --speed 4          # 4倍速
+	python3 replay.py trace.ndjson --speed 0          # 不等待，尽快发出
+	python3 replay.py trace.ndjson --concurrency 50 --skip-writes
+
+数据库连接取 config 里的 db 配置，不要对着线上库重放写操作。
+'''
+
+import sys, time, asyncio, logging, argparse
+
+import orm, qtrace
+from config import configs
+
+
+async def replay(loop, events, speed, concurrency, skip_writes):
+	sem = asyncio.Semaphore(concurrency)
+	latencies = {}  # 形状 -> [延迟]
+	errors = {}
+	t0 = events[0]['ts'] if events else 0
+	start = loop.time()
+
+	async def run_one(event):
+		sql = event['sql']
+		is_select = sql.lstrip().lower().startswith('select')
+		async with sem:
+			begin = loop.time()
+			try:
+				if is_select:
+					await orm.select(sql, event.get('args', []))
+				else:
+					await orm.execute(sql, event.get('args', []))
+			except Exception as e:
+				errors[qtrace.shape(sql)] = errors.get(qtrace.shape(sql), 0) + 1
+				logging.debug('replay failed: %s' % e)
+				return
+			latencies.setdefault(qtrace.shape(sql), []).append(loop.time() - begin)
+
+	tasks = []
+	for event in events:
+		if 'args' not in event:
+			continue
+		if skip_writes and not event['sql'].lstrip().lower().startswith('select'):
+			continue
+		# 按录制时的相对时间(除以倍速)发出，speed=0 表示不等待
+		if speed > 0:
+			delay = (event['ts'] - t0) / speed - (loop.time() - start)
+			if delay > 0:
+				await asyncio.sleep(delay)
+		tasks.append(asyncio.ensure_future(run_one(event)))
+	if tasks:
+		await asyncio.wait(tasks)
+	return latencies, errors, loop.time() - start
+
+
+def report(latencies, errors, elapsed):
+	total = sum(len(v) for v in latencies.values())
+	print('replayed %s queries in %.2fs (%.0f qps)' % (total, elapsed, total / elapsed if elapsed else 0))
+	print('%8s %9s %9s %9s %9s %7s  %s' % ('count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'errors', 'query'))
+	rows = sorted(latencies.items(), key=lambda kv: -sum(kv[1]))
+	for sql, values in rows:
+		values.sort()
+		print('%8d %9.2f %9.2f %9.2f %9.2f %7d  %s' % (
+			len(values), qtrace.percentile(values, 50) * 1000, qtrace.percentile(values, 90) * 1000,
+			qtrace.percentile(values, 99) * 1000, values[-1] * 1000, errors.get(sql, 0), sql))
+	for sql, n in errors.items():
+		if sql not in latencies:
+			print('%8d %9s %9s %9s %9s %7d  %s' % (0, '-', '-', '-', '-', n, sql))
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='replay a recorded query trace')
+	parser.add_argument('trace')
+	parser.add_argument('--speed', type=float, default=1.0, help='replay speed multiplier, 0 = as fast as possible')
+	parser.add_argument('--concurrency', type=int, default=10)
+	parser.add_argument('--skip-writes', action='store_true', help='only replay select statements')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.WARNING)
+	events = qtrace.load(args.trace)
+	loop = asyncio.get_event_loop()
+	db = dict(configs.db)
+	# 连接池至少要能支撑设定的并发
+	db['maxsize'] = max(db.get('maxsize', 10), args.concurrency)
+	loop.run_until_complete(orm.create_pool(loop, **db))
+	latencies, errors, elapsed = loop.run_until_complete(
+		replay(loop, events, args.speed, args.concurrency, args.skip_writes))
+	report(latencies, errors, elapsed)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
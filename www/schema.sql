@@ -31,6 +31,9 @@ create table blogs (
     `summary` varchar(200) not null,
     `content` mediumtext not null,
     `created_at` real not null,
+    `updated_at` real not null,
+    `comment_count` bigint not null default 0,
+    `last_comment_at` real not null default 0,
     key `idx_created_at` (`created_at`),
     primary key (`id`)
 ) engine=innodb default charset=utf8;
@@ -43,6 +46,14 @@ create table comments (
     `user_image` varchar(500) not null,
     `content` mediumtext not null,
     `created_at` real not null,
+    key `idx_blog_id` (`blog_id`),
     key `idx_created_at` (`created_at`),
     primary key (`id`)
-) engine=innodb default charset=utf8;
\ No newline at end of file
+) engine=innodb default charset=utf8;
+
+#升级已有的数据库(不要重新执行上面的建库语句)，按顺序执行:
+#博客评论计数，加完后执行一次 python3 counters.py 填上现有数据
+#alter table blogs add column `comment_count` bigint not null default 0, add column `last_comment_at` real not null default 0;
+#博客的修改时间，用于条件GET
+#alter table blogs add column `updated_at` real not null default 0;
+#update blogs set `updated_at`=greatest(`created_at`, `last_comment_at`);
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+进程内的博客全文搜索: 倒排索引 + BM25 排序.
+
+中文没有空格分词，连续的中日韩字符按二元组(bigram)切分，例如"异步编程" => 异步 步编 编程，
+查询用同样的方式切分，这样不需要词典也能匹配任意连续的词；英文和数字按单词切分并转小写。
+索引在启动时从磁盘加载，博客增删改时增量更新，并延迟几秒写回磁盘。
+'''
+
+import os, re, math, zlib, pickle, logging
+
+import cluster, jobs
+
+_RE_TOKEN = re.compile('[0-9a-z_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+_RE_CJK = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+
+# 标题命中比正文重要，标题和摘要里的词频按倍数计
+NAME_WEIGHT = 3
+SUMMARY_WEIGHT = 2
+
+# 索引文件格式变了就改这个版本号，旧文件会被丢弃重建
+INDEX_VERSION = 2
+
+# 数据库里算出的和 doc_checksum() 一致的校验和，启动时用来判断索引文件是不是最新的
+CHECKSUM_SQL = 'sum(crc32(concat_ws(char(10), coalesce(`name`, \'\'), coalesce(`summary`, \'\'), coalesce(`content`, \'\'))))'
+
+
+def tokenize(text):
+	tokens = []
+	for word in _RE_TOKEN.findall(text.lower()):
+		if _RE_CJK.match(word):
+			if len(word) == 1:
+				tokens.append(word)
+			else:
+				tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+		else:
+			tokens.append(word)
+	return tokens
+
+
+def doc_checksum(name, summary, content):
+	return zlib.crc32('\n'.join((name or '', summary or '', content or '')).encode('utf-8'))
+
+
+class SearchIndex(object):
+
+	def __init__(self, k1=1.2, b=0.75):
+		self.k1 = k1
+		self.b = b
+		self.postings = {}  # 词 -> {doc_id: 词频}
+		self.doc_terms = {}  # doc_id -> {词: 词频}，删除和更新文档时用
+		self.doc_len = {}
+		self.doc_crc = {}  # doc_id -> 索引时文档内容的 crc32
+		self.total_len = 0
+
+	def __len__(self):
+		return len(self.doc_len)
+
+	def add(self, doc_id, name='', summary='', content=''):
+		'''
+		添加或更新一篇文档。
+		'''
+		self.remove(doc_id)
+		terms = {}
+		for text, weight in ((name, NAME_WEIGHT), (summary, SUMMARY_WEIGHT), (content, 1)):
+			for token in tokenize(text or ''):
+				terms[token] = terms.get(token, 0) + weight
+		length = sum(terms.values())
+		self.doc_terms[doc_id] = terms
+		self.doc_len[doc_id] = length
+		self.total_len += length
+		self.doc_crc[doc_id] = doc_checksum(name, summary, content)
+		for term, tf in terms.items():
+			self.postings.setdefault(term, {})[doc_id] = tf
+
+	def checksum(self):
+		'''
+		所有文档内容校验和的和，等于数据库里的 CHECKSUM_SQL 时索引是最新的。
+		'''
+		return sum(self.doc_crc.values())
+
+	def remove(self, doc_id):
+		terms = self.doc_terms.pop(doc_id, None)
+		if terms is None:
+			return False
+		self.total_len -= self.doc_len.pop(doc_id)
+		self.doc_crc.pop(doc_id, None)
+		for term in terms:
+			docs = self.postings[term]
+			del docs[doc_id]
+			if not docs:
+				del self.postings[term]
+		return True
+
+	def search(self, query):
+		'''
+		返回按BM25得分从高到低排好序的 [(doc_id, score)]。
+		'''
+		n = len(self.doc_len)
+		if n == 0:
+			return []
+		avgdl = self.total_len / n
+		scores = {}
+		for term in set(tokenize(query)):
+			docs = self.postings.get(term)
+			if not docs:
+				continue
+			idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+			for doc_id, tf in docs.items():
+				norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+				scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+		return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+	def save(self, path):
+		# 多进程运行时每个 worker 都会写，临时文件不能同名
+		tmp = '%s.%d.tmp' % (path, os.getpid())
+		with open(tmp, 'wb') as f:
+			pickle.dump((INDEX_VERSION, self.k1, self.b, self.doc_terms, self.doc_crc), f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp, path)
+
+	@classmethod
+	def load(cls, path):
+		'''
+		从磁盘加载索引，文件不存在或版本不对时返回None。
+		'''
+		if not os.path.exists(path):
+			return None
+		try:
+			with open(path, 'rb') as f:
+				data = pickle.load(f)
+		except Exception as e:
+			logging.warning('failed to load search index %s: %s' % (path, e))
+			return None
+		if data[0] != INDEX_VERSION:
+			return None
+		version, k1, b, doc_terms, doc_crc = data
+		index = cls(k1, b)
+		index.doc_crc = doc_crc
+		for doc_id, terms in doc_terms.items():
+			length = sum(terms.values())
+			index.doc_terms[doc_id] = terms
+			index.doc_len[doc_id] = length
+			index.total_len += length
+			for term, tf in terms.items():
+				index.postings.setdefault(term, {})[doc_id] = tf
+		return index
+
+
+# ---------------------------------进程内的博客索引---------------------------------
+_index = None
+_path = None
+_loop = None
+_model = None
+_save_handle = None
+
+# 索引变更后延迟多少秒写盘，短时间内的多次修改只写一次
+SAVE_DELAY = 3.0
+
+
+async def init(loop, path, model):
+	'''
+	加载磁盘上的索引，和数据库里的博客数或内容校验和对不上(比如上次退出前没来得及写盘)时从 model 全量重建。
+	'''
+	global _index, _path, _loop, _model
+	_path, _loop, _model = path, loop, model
+	index = SearchIndex.load(path)
+	num = await model.findNumber('count(id)')
+	# 只改了博客内容、篇数没变的修改也要发现
+	checksum = int(await model.findNumber(CHECKSUM_SQL) or 0)
+	if index is None or len(index) != num or index.checksum() != checksum:
+		index = await _build(model)
+		index.save(path)
+	logging.info('search index loaded: %s docs, %s terms' % (len(index), len(index.postings)))
+	_index = index
+
+
+async def _build(model):
+	blogs = await model.findAll()
+	logging.info('rebuilding search index from %s blogs...' % len(blogs))
+	index = SearchIndex()
+	for blog in blogs:
+		index.add(str(blog.id), blog.name, blog.summary, blog.content)
+	return index
+
+
+def enabled():
+	return _index is not None
+
+
+def _schedule_save():
+	global _save_handle
+	if _save_handle is None:
+		_save_handle = _loop.call_later(SAVE_DELAY, _save)
+
+
+def _save():
+	global _save_handle
+	_save_handle = None
+	_index.save(_path)
+
+
+def _index_local(blog):
+	_index.add(str(blog.id), blog.name, blog.summary, blog.content)
+	_schedule_save()
+
+
+def _remove_local(id):
+	if _index.remove(str(id)):
+		_schedule_save()
+
+
+def index_blog(blog):
+	if _index is None:
+		return
+	_index_local(blog)
+	cluster.publish('search', str(blog.id))
+
+
+def remove_blog(id):
+	if _index is None:
+		return
+	_remove_local(id)
+	cluster.publish('search', str(id))
+
+
+# 其他 worker 上的博客有增删改，从数据库读出最新的内容更新本进程的索引
+async def _on_change(id):
+	if _index is None:
+		return
+	blog = await _model.find(id)
+	if blog is None:
+		_remove_local(id)
+	else:
+		_index_local(blog)
+
+
+cluster.subscribe('search', _on_change)
+
+
+# 修改了分词规则、或者索引和数据库对不上时: python3 jobs.py enqueue search.rebuild
+@jobs.job('search.rebuild', max_attempts=3)
+async def rebuild():
+	'''
+	从数据库全量重建索引并写盘，其他 worker 重新读取索引文件。
+	'''
+	global _index
+	if _index is None:
+		return
+	index = await _build(_model)
+	index.save(_path)
+	_index = index
+	cluster.publish('search_reload')
+	logging.info('search index rebuilt: %s docs, %s terms' % (len(index), len(index.postings)))
+
+
+def _on_reload():
+	global _index
+	if _index is None:
+		return
+	index = SearchIndex.load(_path)
+	if index is not None:
+		_index = index
+
+
+cluster.subscribe('search_reload', _on_reload)
+
+
+def query(q):
+	'''
+	返回 [(blog_id, score)]，没有启用搜索时返回空列表。
+	'''
+	if _index is None:
+		return []
+	return _index.search(q)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+JSON序列化: 直接输出UTF-8字节，按类型注册的编码函数只在注册时准备一次.
+
+装了 orjson 就用 orjson，否则退回标准库 json。Model 是 dict 的子类，两个后端都按 dict 直接编码，
+不会走 default 回调；Page 这类普通对象通过 register() 注册的函数转成 dict。
+'''
+
+import json, logging
+
+from apis import Page
+
+# 类型 -> 转换函数，转换结果必须是能直接编码的对象
+_encoders = {}
+# 实际对象类型 -> 转换函数(含按MRO找到的父类注册)，第一次遇到某个类型时填上
+_resolved = {}
+
+
+def register(cls, fn):
+	'''
+	注册 cls 类型对象的转换函数，例如 register(Page, lambda p: p.__dict__)。
+	'''
+	_encoders[cls] = fn
+	_resolved.clear()
+
+
+def _resolve(cls):
+	for base in cls.__mro__:
+		if base in _encoders:
+			return _encoders[base]
+	# 没有注册的对象沿用原来的做法，输出实例的属性
+	return _object_dict
+
+
+def _object_dict(o):
+	try:
+		return o.__dict__
+	except AttributeError:
+		raise TypeError('Object of type %s is not JSON serializable' % type(o).__name__)
+
+
+def _default(o):
+	cls = type(o)
+	fn = _resolved.get(cls)
+	if fn is None:
+		fn = _resolved[cls] = _resolve(cls)
+	return fn(o)
+
+
+_PAGE_FIELDS = ('item_count', 'page_count', 'page_index', 'page_size', 'offset', 'limit', 'has_next', 'has_previous')
+register(Page, lambda p: {k: getattr(p, k) for k in _PAGE_FIELDS})
+register(set, list)
+register(frozenset, list)
+
+try:
+	import orjson
+
+	BACKEND = 'orjson'
+
+	def dumps(obj):
+		'''
+		把对象编码为UTF-8的JSON字节串。
+		'''
+		return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+	BACKEND = 'json'
+	_encoder = json.JSONEncoder(ensure_ascii=False, default=_default, separators=(',', ':'))
+
+	def dumps(obj):
+		'''
+		把对象编码为UTF-8的JSON字节串。
+		'''
+		return _encoder.encode(obj).encode('utf-8')
+
+logging.info('json backend: %s' % BACKEND)
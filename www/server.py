@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+多进程(pre-fork)运行: 主进程启动 N 个 worker，每个 worker 有自己的事件循环和数据库连接池.
+
+    python3 server.py                               # worker 数取 configs.server.workers，0 为CPU核数
+    python3 server.py --workers 4
+    python3 server.py --unix /run/awesome/awesome.sock
+
+监听套接字都由主进程创建，worker 启动时继承: TCP 端口给每个 worker 编号各建一个设置了 SO_REUSEPORT 的套接字，
+由内核把新连接分给各个 worker(系统不支持时所有 worker 共用一个)；unix 套接字(nginx 里
+proxy_pass http://unix:/run/awesome/awesome.sock)所有 worker 共用一个.
+
+主进程只负责监督: worker 退出后重新启动同编号的 worker，启动后很快又崩溃的，重启间隔逐次加倍；
+收到 SIGTERM/SIGINT 时让所有 worker 处理完手上的请求、写完评论缓冲、关闭连接池后退出.
+
+收到 SIGHUP 时热重载: 从 app_dir(部署时切换的 www 符号链接)启动一组新代码的 worker，
+都预热完成(模板编译好、数据库连上)后才让旧 worker 停止接受连接并处理完手上的请求。监听套接字一直在主进程手里，
+旧 worker 关掉自己那份后新 worker 接着 accept，不会丢连接。新 worker 启动失败时保留旧的，什么都不变。
+主进程自己的代码(本文件的 Master)和监听地址、worker 数不会重新加载，改了要完整重启.
+
+supervisor 的配置:
+
+    [program:awesome]
+    command     = /usr/bin/python3 /srv/awesome/www/server.py
+    directory   = /srv/awesome/www
+    stopsignal  = TERM
+    stopwaitsecs = 30
+'''
+
+import os, sys, time, signal, select, socket, asyncio, logging, argparse, subprocess
+
+from config import configs
+
+logging.basicConfig(level=logging.INFO)
+
+BACKLOG = 1024
+
+# worker 运行不到这么多秒就退出算作崩溃，下次重启的间隔加倍
+MIN_UPTIME = 10.0
+MAX_RESTART_DELAY = 30.0
+
+
+def listen_tcp(host, port, reuse_port):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    return sock
+
+
+def listen_unix(path, mode):
+    # 上次没有正常退出时留下的套接字文件
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, mode)
+    sock.listen(BACKLOG)
+    return sock
+
+
+def app_dir():
+    '''
+    代码所在的目录，不解析符号链接: 热重载时要从链接现在指向的新目录启动 worker。
+    '''
+    if configs.server.app_dir:
+        return configs.server.app_dir
+    if os.path.isabs(sys.argv[0]):
+        return os.path.dirname(sys.argv[0])
+    # 相对路径启动时 os.getcwd() 已经是解析过链接的真实目录，shell 的 PWD 还是链接本身
+    pwd = os.environ.get('PWD')
+    if pwd and os.path.realpath(pwd) == os.getcwd():
+        return os.path.dirname(os.path.join(pwd, sys.argv[0]))
+    return os.path.dirname(os.path.abspath(sys.argv[0]))
+
+
+def run_worker(index, workers, sock, ready_fd, opts, generation=0):
+    '''
+    worker 进程: 在继承来的 sock 上提供服务，预热完成后往 ready_fd 写一个字节通知主进程。
+    '''
+    import app as webapp
+    import orm, writebehind, cluster, render, jobs
+    # Ctrl-C 由主进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.get_event_loop()
+    app = loop.run_until_complete(webapp.init_app(loop, index, workers, generation))
+    loop.run_until_complete(webapp.warm_up(app))
+    handler = app.make_handler()
+    srv = loop.run_until_complete(loop.create_server(handler, sock=sock))
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        os.write(ready_fd, b'1')
+    except BrokenPipeError:
+        # 崩溃后重启的 worker，主进程不等它
+        pass
+    os.close(ready_fd)
+    logging.info('worker %s (pid %s) serving' % (index, os.getpid()))
+    loop.run_forever()
+    # 不再接受新连接(套接字还在主进程和新 worker 手里)，等手上的请求处理完
+    logging.info('worker %s (pid %s) draining' % (index, os.getpid()))
+    srv.close()
+    loop.run_until_complete(srv.wait_closed())
+    loop.run_until_complete(app.shutdown())
+    loop.run_until_complete(handler.shutdown(opts.shutdown_timeout))
+    loop.run_until_complete(app.cleanup())
+    # 没执行完的任务租期过后由其他 worker 重新执行
+    if jobs.get_queue() is not None:
+        loop.run_until_complete(jobs.get_queue().stop(opts.shutdown_timeout))
+    loop.run_until_complete(writebehind.close_all())
+    loop.run_until_complete(orm.close_pools())
+    render.close()
+    cluster.close(loop)
+    loop.close()
+    logging.info('worker %s (pid %s) exited' % (index, os.getpid()))
+
+
+class _Worker(object):
+
+    def __init__(self, index, proc, ready_fd):
+        self.index = index
+        self.proc = proc
+        self.ready_fd = ready_fd
+        self.started = time.time()
+
+
+class Master(object):
+
+    def __init__(self, workers, sockets, opts):
+        self.workers = workers
+        # 编号 -> 监听套接字
+        self.sockets = sockets
+        self.opts = opts
+        # pid -> _Worker，正在服务的
+        self.children = {}
+        # pid -> (_Worker, 最晚退出时间)，热重载后等着处理完手上请求的旧 worker
+        self.draining = {}
+        # 每个编号连续崩溃的次数
+        self.failures = [0] * workers
+        # [(什么时候重启, 编号)]
+        self.pending = []
+        self.stopping = False
+        self.reload_requested = False
+        # 当前这组 worker 的代数，热重载时在 0 和 1 之间切换，新旧 worker 的 idgen worker_id 不重叠
+        self.generation = 0
+
+    def spawn(self, index, generation=None):
+        if generation is None:
+            generation = self.generation
+        r, w = os.pipe()
+        fd = self.sockets[index].fileno()
+        script = os.path.join(app_dir(), 'server.py')
+        args = [sys.executable, script, '--worker', str(index), '--workers', str(self.workers),
+                '--generation', str(generation), '--fd', str(fd), '--ready-fd', str(w)]
+        try:
+            proc = subprocess.Popen(args, pass_fds=(fd, w), cwd=os.path.dirname(script))
+        finally:
+            os.close(w)
+        return _Worker(index, proc, r)
+
+    def _wait_ready(self, workers, timeout):
+        '''
+        等这些 worker 预热完成，全部成功返回 True。
+        '''
+        waiting = {w.ready_fd: w for w in workers}
+        deadline = time.time() + timeout
+        ok = True
+        while waiting and ok and not self.stopping:
+            left = deadline - time.time()
+            if left <= 0:
+                logging.error('workers %s not ready in %ss' % (sorted(w.index for w in waiting.values()), timeout))
+                ok = False
+                break
+            readable, _, _ = select.select(list(waiting), [], [], min(left, 0.5))
+            for fd in readable:
+                w = waiting.pop(fd)
+                # 预热前就退出了，读到的是EOF
+                if not os.read(fd, 1):
+                    logging.error('worker %s (pid %s) exited before ready' % (w.index, w.proc.pid))
+                    ok = False
+            self._reap()
+        for w in workers:
+            os.close(w.ready_fd)
+        return ok and not waiting
+
+    def start(self):
+        for index in range(self.workers):
+            w = self.spawn(index)
+            self.children[w.proc.pid] = w
+        self._wait_ready(list(self.children.values()), self.opts.ready_timeout)
+
+    def reload(self):
+        logging.info('master: reloading workers from %s' % app_dir())
+        generation = 1 - self.generation
+        new = [self.spawn(index, generation) for index in range(self.workers)]
+        if not self._wait_ready(new, self.opts.ready_timeout):
+            logging.error('master: reload failed, keeping the old workers')
+            for w in new:
+                self._kill(w.proc.pid, signal.SIGKILL)
+                w.proc.wait()
+            return
+        old, self.children = self.children, {w.proc.pid: w for w in new}
+        self.generation = generation
+        # 等着重启的编号已经有新 worker 了
+        self.pending = []
+        self.failures = [0] * self.workers
+        deadline = time.time() + self.opts.shutdown_timeout + 5
+        for pid, w in old.items():
+            self.draining[pid] = (w, deadline)
+            self._kill(pid, signal.SIGTERM)
+        logging.info('master: reloaded, %s old workers draining' % len(old))
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+
+    def on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        for pid, (w, deadline) in list(self.draining.items()):
+            if w.proc.poll() is not None:
+                del self.draining[pid]
+                logging.info('old worker %s (pid %s) exited' % (w.index, pid))
+            elif time.time() > deadline:
+                logging.warning('old worker %s (pid %s) did not drain in time, killing' % (w.index, pid))
+                self._kill(pid, signal.SIGKILL)
+        for pid, w in list(self.children.items()):
+            code = w.proc.poll()
+            if code is None:
+                continue
+            del self.children[pid]
+            reason = 'signal %s' % -code if code < 0 else 'exit code %s' % code
+            if self.stopping:
+                logging.info('worker %s (pid %s) exited: %s' % (w.index, pid, reason))
+                continue
+            if time.time() - w.started < MIN_UPTIME:
+                self.failures[w.index] += 1
+            else:
+                self.failures[w.index] = 0
+            delay = min(self.opts.restart_delay * 2 ** self.failures[w.index], MAX_RESTART_DELAY)
+            logging.error('worker %s (pid %s) died: %s, restarting in %.1fs' % (w.index, pid, reason, delay))
+            self.pending.append((time.time() + delay, w.index))
+
+    def _restart_pending(self):
+        now = time.time()
+        for when, index in [p for p in self.pending if p[0] <= now]:
+            self.pending.remove((when, index))
+            w = self.spawn(index)
+            # 不等它预热，监听套接字上的连接由其他 worker 接着处理
+            os.close(w.ready_fd)
+            self.children[w.proc.pid] = w
+
+    def _shutdown(self):
+        logging.info('master: stopping workers...')
+        self.pending = []
+        deadline = time.time() + self.opts.shutdown_timeout + 5
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGTERM)
+        for pid in list(self.draining):
+            self._kill(pid, signal.SIGTERM)
+        while self.children or self.draining:
+            self._reap()
+            if time.time() > deadline:
+                for pid in list(self.children) + list(self.draining):
+                    logging.warning('worker pid %s did not exit in time, killing' % pid)
+                    self._kill(pid, signal.SIGKILL)
+                deadline = time.time() + 5
+            time.sleep(0.1)
+        logging.info('master: all workers exited')
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGHUP, self.on_reload)
+        self.start()
+        while not self.stopping:
+            # 上一次热重载的旧 worker 还没退出时先不重载，否则新 worker 会和它们用同一段 worker_id
+            if self.reload_requested and not self.draining:
+                self.reload_requested = False
+                self.reload()
+            self._reap()
+            self._restart_pending()
+            time.sleep(0.1)
+        self._shutdown()
+
+
+def worker_main(args):
+    sock = socket.socket(fileno=args.fd)
+    run_worker(args.worker, args.workers, sock, args.ready_fd, configs.server, args.generation)
+    return 0
+
+
+def main(argv):
+    opts = configs.server
+    parser = argparse.ArgumentParser(description='pre-fork server')
+    parser.add_argument('--workers', type=int, default=opts.workers, help='0 for one worker per CPU')
+    parser.add_argument('--host', default=opts.host)
+    parser.add_argument('--port', type=int, default=opts.port)
+    parser.add_argument('--unix', default=opts.unix, help='listen on this unix socket instead of host:port')
+    # 主进程启动 worker 时用的参数
+    parser.add_argument('--worker', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--generation', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--fd', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker is not None:
+        return worker_main(args)
+    workers = args.workers or os.cpu_count() or 1
+    # 每个 worker 用不同的 idgen worker_id，热重载时新旧两组 worker 同时运行，要留出两组
+    max_worker_id = (1 << configs.ids.worker_bits) - 1
+    if configs.ids.worker_id + 2 * workers - 1 > max_worker_id:
+        parser.error('ids.worker_id %s + 2 x %s workers (old and new during reload) exceeds the %s-bit worker id space' % (
+            configs.ids.worker_id, workers, configs.ids.worker_bits))
+    if args.unix:
+        sock = listen_unix(args.unix, opts.unix_mode)
+        sockets = [sock] * workers
+        where, reuse_port = args.unix, False
+    else:
+        reuse_port = opts.reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        if reuse_port:
+            sockets = [listen_tcp(args.host, args.port, True) for i in range(workers)]
+        else:
+            sockets = [listen_tcp(args.host, args.port, False)] * workers
+        where = 'http://%s:%s' % (args.host, args.port)
+    logging.info('master (pid %s): %s workers on %s, SO_REUSEPORT: %s' % (os.getpid(), workers, where, reuse_port))
+    try:
+        Master(workers, sockets, opts).run()
+    finally:
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+请求合并(single-flight)和微缓存: 同一个key同时只计算一次，并发的相同请求等待同一个结果；
+结果可以缓存 ttl 秒，过期后 stale 秒内先返回旧结果，同时在后台重新计算一次(stale-while-revalidate).
+
+路由上通过 @get 的参数使用，例如博客页:
+
+    @get('/blog/{id}', coalesce=True, ttl=1, stale=10, tags=('blog:{id}',))
+
+写操作之后用 invalidate('blog:%s' % id) 让带这个标签的缓存结果失效.
+'''
+
+import asyncio, logging
+
+from collections import OrderedDict
+
+# 所有 Flight，invalidate() 对它们都生效
+_flights = []
+
+
+class _Entry(object):
+
+    def __init__(self, value, fresh_until, stale_until, tags):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+        self.tags = tags
+
+
+class Flight(object):
+
+    def __init__(self, ttl=0, stale=0, max_entries=1000, shareable=None, cacheable=None):
+        self._ttl = ttl
+        self._stale = stale
+        self._max_entries = max_entries
+        # 判断结果能不能给正在等待的其他请求用，不能的话等待的请求各自重新计算
+        self._shareable = shareable or (lambda value: True)
+        # 判断结果能不能缓存给之后的请求用，比如出错、服务忙的结果可以给正在等的请求，但不能缓存
+        self._cacheable = cacheable or self._shareable
+        self._cache = OrderedDict()
+        self._inflight = {}
+        # 标签 -> 失效次数，计算开始后标签失效过的结果不缓存
+        self._generations = {}
+        # hit: 新鲜的缓存结果，stale: 旧结果，shared: 等到了别的请求的计算结果，miss: 自己计算
+        self.stats = dict(hit=0, stale=0, shared=0, miss=0)
+        _flights.append(self)
+
+    def _generation(self, tags):
+        return tuple(self._generations.get(t, 0) for t in tags)
+
+    async def do(self, key, fn, tags=()):
+        '''
+        返回 fn() 的结果；相同 key 正在计算时等待它的结果，不重复计算。
+        '''
+        loop = asyncio.get_event_loop()
+        entry = self._cache.get(key)
+        if entry is not None:
+            now = loop.time()
+            if now < entry.fresh_until:
+                self.stats['hit'] += 1
+                self._cache.move_to_end(key)
+                return entry.value
+            if now < entry.stale_until:
+                self.stats['stale'] += 1
+                # 先返回旧结果，后台只重新计算一次
+                if key not in self._inflight:
+                    self._start(key, fn, tags).add_done_callback(_log_error)
+                self._cache.move_to_end(key)
+                return entry.value
+            del self._cache[key]
+        fut = self._inflight.get(key, (None,))[0]
+        if fut is None:
+            # 自己发起计算的请求直接拿结果
+            self.stats['miss'] += 1
+            return await asyncio.shield(self._start(key, fn, tags))
+        value = await asyncio.shield(fut)
+        if not self._shareable(value):
+            self.stats['miss'] += 1
+            return await fn()
+        self.stats['shared'] += 1
+        return value
+
+    def _start(self, key, fn, tags):
+        # 计算放在单独的任务里，发起计算的请求被取消(客户端断开)时，等待的其他请求不受影响
+        fut = asyncio.ensure_future(self._run(key, fn, tags, self._generation(tags)))
+        self._inflight[key] = (fut, tags)
+        return fut
+
+    async def _run(self, key, fn, tags, generation):
+        try:
+            value = await fn()
+            if (self._ttl or self._stale) and self._cacheable(value) and self._generation(tags) == generation:
+                now = asyncio.get_event_loop().time()
+                self._cache[key] = _Entry(value, now + self._ttl, now + self._ttl + self._stale, tags)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self._max_entries:
+                    self._cache.popitem(last=False)
+            return value
+        finally:
+            # 失效时已经移除了，或者换成了新的计算
+            if self._inflight.get(key, (None,))[0] is asyncio.current_task():
+                del self._inflight[key]
+
+    def invalidate(self, *tags):
+        tags = set(tags)
+        for tag in tags:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+        for key in [k for k, e in self._cache.items() if tags.intersection(e.tags)]:
+            del self._cache[key]
+        # 失效前开始的计算可能读到了旧数据，之后的请求不再等待它
+        for key in [k for k, (fut, t) in self._inflight.items() if tags.intersection(t)]:
+            del self._inflight[key]
+
+
+def _log_error(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logging.error('background refresh failed: %s' % fut.exception())
+
+
+def flights():
+    return list(_flights)
+
+
+def invalidate(*tags):
+    '''
+    让所有 Flight 中带有这些标签的缓存结果失效。
+    '''
+    for flight in _flights:
+        flight.invalidate(*tags)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+静态文件: 文件内容、构建时生成的 .gz 文件和 ETag 第一次访问时读进内存，
+文件修改后(mtime变化)自动重新读取。客户端接受gzip且有 .gz 文件时直接发送压缩好的字节.
+'''
+
+import os, hashlib, mimetypes, email.utils
+
+from aiohttp import web
+
+import compress, conditional
+
+
+class _Entry(object):
+
+    def __init__(self, path, mtime):
+        self.mtime = mtime
+        with open(path, 'rb') as f:
+            self.body = f.read()
+        self.gz = None
+        gz = path + '.gz'
+        # .gz 比原文件旧说明没有重新构建，不能用
+        if os.path.isfile(gz) and os.path.getmtime(gz) >= mtime:
+            with open(gz, 'rb') as f:
+                self.gz = f.read()
+        content_type, encoding = mimetypes.guess_type(path)
+        self.content_type = content_type or 'application/octet-stream'
+        self.etag = '"%s"' % hashlib.md5(self.body).hexdigest()
+        self.last_modified = email.utils.formatdate(mtime, usegmt=True)
+
+
+class StaticHandler(object):
+
+    def __init__(self, root, cache_control=None):
+        self._root = os.path.realpath(root)
+        self._cache_control = cache_control
+        self._entries = {}
+
+    def _resolve(self, filename):
+        path = os.path.realpath(os.path.join(self._root, filename))
+        # 不允许用 .. 之类的路径跑出静态目录
+        if not path.startswith(self._root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _entry(self, path):
+        mtime = os.path.getmtime(path)
+        entry = self._entries.get(path)
+        if entry is None or entry.mtime != mtime:
+            entry = self._entries[path] = _Entry(path, mtime)
+        return entry
+
+    async def __call__(self, request):
+        path = self._resolve(request.match_info['filename'])
+        if path is None:
+            raise web.HTTPNotFound()
+        entry = self._entry(path)
+        headers = {'ETag': entry.etag, 'Last-Modified': entry.last_modified}
+        if self._cache_control:
+            headers['Cache-Control'] = self._cache_control
+        if entry.gz is not None:
+            headers['Vary'] = 'Accept-Encoding'
+        if conditional.is_fresh(request, entry.etag, entry.mtime):
+            return web.HTTPNotModified(headers=headers)
+        if entry.gz is not None and compress.accepts_gzip(request):
+            headers['Content-Encoding'] = 'gzip'
+            # 压缩版本的字节不同，只能作弱ETag
+            headers['ETag'] = 'W/' + entry.etag
+            body = entry.gz
+        else:
+            body = entry.body
+        resp = web.Response(body=body, headers=headers)
+        resp.content_type = entry.content_type
+        return resp
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+流式JSON响应: 处理函数返回 JsonStream，response_middleware 用分块传输边读数据库边输出，
+首字节时间和内存占用不再随页大小或导出的行数增长.
+
+    # 输出 {"page": {...}, "comments": [{...}, {...}]}
+    return JsonStream(Comment.iterAll(orderBy='created_at desc', limit=(p.offset, p.limit)),
+                      key='comments', head=dict(page=p))
+    # 导出整张表时输出NDJSON，每行一个对象；按页查询，不会在导出期间一直占着连接
+    return JsonStream(Comment.iterPages(orderBy='created_at desc'), ndjson=True)
+
+第一行读出来之后才发送响应头，查询出错(数据库错误、APIError)时还能返回正常的错误响应；
+之后再出错响应头已经发出去了，只能断开连接，客户端收到的是不完整的JSON，服务端日志里有 json stream aborted.
+'''
+
+import logging
+
+from aiohttp import web
+
+import serialize
+from apis import APIError
+
+# 攒够这么多字节再写一次socket
+_FLUSH_SIZE = 16 * 1024
+
+
+class JsonStream(object):
+
+    def __init__(self, rows, key=None, head=None, ndjson=False, transform=None):
+        # rows: 异步迭代器；key 和 head 只对JSON数组有用，数组放在 head 这个对象的 key 字段下
+        # transform: 输出前对每行做的处理，比如把用户的密码字段改成'******'
+        self.rows = rows
+        self.key = key
+        self.head = head or {}
+        self.ndjson = ndjson
+        self.transform = transform
+
+
+def _prefix(stream):
+    if stream.key is None:
+        return b'['
+    head = serialize.dumps(stream.head)
+    # 把 head 对象的 '}' 去掉，接上数组字段
+    sep = b',' if stream.head else b''
+    return head[:-1] + sep + serialize.dumps(stream.key) + b':['
+
+
+# 迭代器没有行
+_EMPTY = object()
+
+
+async def _next_row(rows):
+    try:
+        return await rows.__anext__()
+    except StopAsyncIteration:
+        return _EMPTY
+
+
+async def write_json_stream(request, stream):
+    rows = stream.rows.__aiter__()
+    # 发送响应头之前先取第一行，查询本身出错时返回普通的错误响应，而不是截断的200
+    try:
+        row = await _next_row(rows)
+    except BaseException as e:
+        if hasattr(rows, 'aclose'):
+            await rows.aclose()
+        if isinstance(e, APIError):
+            resp = web.Response(body=serialize.dumps(dict(error=e.error, data=e.data, message=e.message)))
+            resp.content_type = 'application/json;charset=utf-8'
+            return resp
+        raise
+    resp = web.StreamResponse()
+    if stream.ndjson:
+        resp.content_type = 'application/x-ndjson'
+    else:
+        resp.content_type = 'application/json'
+    resp.charset = 'utf-8'
+    resp.enable_chunked_encoding()
+    # 流式响应没法事后整体压缩，交给 aiohttp 边写边压缩(客户端不接受gzip时它不会压缩)
+    opts = request.app.get('__compress__')
+    if opts is not None and opts.enabled:
+        resp.enable_compression()
+    buf = bytearray() if stream.ndjson else bytearray(_prefix(stream))
+    first = True
+    try:
+        await resp.prepare(request)
+        while row is not _EMPTY:
+            if stream.transform is not None:
+                row = stream.transform(row)
+            if stream.ndjson:
+                buf += serialize.dumps(row)
+                buf += b'\n'
+            else:
+                if not first:
+                    buf += b','
+                buf += serialize.dumps(row)
+            first = False
+            if len(buf) >= _FLUSH_SIZE:
+                await resp.write(bytes(buf))
+                del buf[:]
+            row = await _next_row(rows)
+        if not stream.ndjson:
+            buf += b']}' if stream.key is not None else b']'
+        await resp.write(bytes(buf))
+        await resp.write_eof()
+    except Exception as e:
+        # 响应头已经发出去了，只能记日志并断开连接，客户端会收到不完整的JSON
+        logging.exception('json stream aborted: %s' % e)
+        raise
+    finally:
+        if hasattr(rows, 'aclose'):
+            await rows.aclose()
+    return resp
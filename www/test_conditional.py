@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''conditional.py 的测试'''
+
+import email.utils
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+import conditional
+
+
+def request(headers=None, method='GET'):
+    return make_mocked_request(method, '/blog/1', headers=headers or {})
+
+
+def test_make_etag_is_weak_and_stable():
+    etag = conditional.make_etag('1', 1.5)
+    assert etag.startswith('W/"') and etag.endswith('"')
+    assert etag == conditional.make_etag('1', 1.5)
+    assert etag != conditional.make_etag('1', 2.5)
+
+
+@pytest.mark.parametrize('header, fresh', [
+    ('*', True),
+    ('W/"abc"', True),
+    # 弱比较，强ETag也算匹配
+    ('"abc"', True),
+    ('"x", W/"abc"', True),
+    ('"x", "y"', False),
+])
+def test_if_none_match(header, fresh):
+    assert conditional.is_fresh(request({'If-None-Match': header}), etag='W/"abc"') is fresh
+
+
+def test_if_modified_since():
+    date = email.utils.formatdate(1000.0, usegmt=True)
+    # HTTP日期只精确到秒
+    assert conditional.is_fresh(request({'If-Modified-Since': date}), last_modified=1000.7)
+    assert not conditional.is_fresh(request({'If-Modified-Since': date}), last_modified=1001.0)
+    assert not conditional.is_fresh(request({'If-Modified-Since': 'garbage'}), last_modified=1.0)
+
+
+def test_if_none_match_wins_over_if_modified_since():
+    headers = {'If-None-Match': '"other"', 'If-Modified-Since': email.utils.formatdate(1000.0, usegmt=True)}
+    assert not conditional.is_fresh(request(headers), etag='"abc"', last_modified=10.0)
+
+
+def test_only_get_and_head():
+    assert conditional.is_fresh(request({'If-None-Match': '*'}, 'HEAD'), etag='"abc"')
+    assert not conditional.is_fresh(request({'If-None-Match': '*'}, 'POST'), etag='"abc"')
+
+
+def test_check_page_varies_by_user():
+    class User(object):
+        id = 'u1'
+    r = {'__version__': ('1', 1.5), '__last_modified__': 1.5}
+    req = request()
+    req.__user__ = User()
+    assert not conditional.check_page(req, r)
+    etag = req.__etag__
+    req = request({'If-None-Match': etag})
+    req.__user__ = User()
+    assert conditional.check_page(req, r)
+    # 未登录用户看到的页面不一样
+    req = request({'If-None-Match': etag})
+    req.__user__ = None
+    assert not conditional.check_page(req, r)
+
+
+def test_apply_validators_and_304():
+    req = request({'If-None-Match': 'W/"v1"'})
+    conditional.check(req, etag='W/"v1"', last_modified=1000.0)
+    resp = conditional.apply(req, web.HTTPNotModified())
+    assert resp.status == 304
+    assert resp.headers['ETag'] == 'W/"v1"'
+    assert resp.headers['Last-Modified'] == email.utils.formatdate(1000.0, usegmt=True)
+    assert resp.headers['Cache-Control'] == 'no-cache'
+
+
+def test_apply_body_etag():
+    resp = conditional.apply(request(), web.Response(body=b'hello'))
+    assert resp.status == 200
+    etag = resp.headers['ETag']
+    resp = conditional.apply(request({'If-None-Match': etag}), web.Response(body=b'hello'))
+    assert resp.status == 304
+    assert resp.headers['ETag'] == etag
+    # 重定向和非GET请求原样返回
+    redirect = web.HTTPFound('/')
+    assert conditional.apply(request(), redirect) is redirect
+    assert 'ETag' not in conditional.apply(request(method='POST'), web.Response(body=b'x')).headers
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''coroweb.py 请求体读取的测试'''
+
+import json, asyncio
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aiohttp import web, streams
+from aiohttp.test_utils import make_mocked_request
+
+import coroweb
+from coroweb import request_data, HTTPBodyTooLarge
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_request(chunks, headers, app=None):
+    '''
+    构造一个POST请求，请求体按 chunks 分块到达。
+    '''
+    payload = streams.StreamReader(mock.Mock(_reading_paused=False), loop=asyncio.get_event_loop())
+    for chunk in chunks:
+        payload.feed_data(chunk)
+    payload.feed_eof()
+    return make_mocked_request('POST', '/api/blogs', headers=headers, payload=payload, app=app or {})
+
+
+def test_content_length_over_limit_is_413():
+    req = make_request([b'x'], {'Content-Type': 'application/json', 'Content-Length': '101'},
+                       {'__max_body_size__': 100})
+    with pytest.raises(HTTPBodyTooLarge) as e:
+        run(request_data(req))
+    assert e.value.status == 413
+    # 没读请求体
+    assert req.content.read_nowait() == b'x'
+
+
+def test_chunked_body_over_limit_is_413():
+    req = make_request([b'{"a": "', b'x' * 60, b'x' * 60, b'"}'],
+                       {'Content-Type': 'application/json', 'Transfer-Encoding': 'chunked'},
+                       {'__max_body_size__': 100})
+    with pytest.raises(HTTPBodyTooLarge):
+        run(request_data(req))
+    assert coroweb._buffered == 0
+
+
+def test_body_parsed_once_and_cached():
+    body = json.dumps({'name': 'blog'}).encode('utf-8')
+    req = make_request([body[:5], body[5:]], {'Content-Type': 'application/json', 'Content-Length': str(len(body))})
+    first = run(request_data(req))
+    assert first == {'name': 'blog'}
+    # 请求体已经读完，第二次只能走缓存
+    assert run(request_data(req)) is first
+
+
+def test_form_body():
+    req = make_request([b'name=a&summary=b'], {'Content-Type': 'application/x-www-form-urlencoded'})
+    assert run(request_data(req)) == {'name': 'a', 'summary': 'b'}
+
+
+def test_buffered_bytes_over_budget_is_503(monkeypatch):
+    # 另外有请求正在缓冲 90 字节
+    monkeypatch.setattr(coroweb, '_buffered', 90)
+    app = {'__max_buffered_body__': 100}
+    req = make_request([b'{"a": 1}' * 2], {'Content-Type': 'application/json', 'Content-Length': '16'}, app)
+    with pytest.raises(web.HTTPServiceUnavailable) as e:
+        run(request_data(req))
+    assert e.value.headers['Retry-After'] == '1'
+    assert coroweb._buffered == 90
+    # 别的请求缓冲完之后可以接受
+    monkeypatch.setattr(coroweb, '_buffered', 0)
+    req = make_request([b'{"a": 1}'], {'Content-Type': 'application/json', 'Content-Length': '8'}, app)
+    assert run(request_data(req)) == {'a': 1}
+    assert coroweb._buffered == 0
+
+
+def coalesced(fn):
+    from coroweb import get, RequestHandler
+    handler = get('/blog/{id}', coalesce=True, ttl=10)(fn)
+    return RequestHandler(None, handler, '/blog/{id}')
+
+
+def test_coalesced_error_is_neither_shared_nor_cached():
+    from apis import APIResourceNotFoundError
+    calls = []
+
+    async def get_blog(id):
+        calls.append(id)
+        await asyncio.sleep(0.01)
+        raise APIResourceNotFoundError('Blog')
+    handler = coalesced(get_blog)
+
+    async def main():
+        rs = await asyncio.gather(*[handler._call_shared(None, dict(id='1')) for i in range(3)])
+        rs.append(await handler._call_shared(None, dict(id='1')))
+        return rs
+    rs = run(main())
+    assert all(r['error'] == 'value:notfound' for r in rs)
+    # 每个请求各自计算，错误结果不缓存
+    assert len(calls) == 4
+
+
+def test_coalesced_503_shared_with_waiters_only():
+    calls = []
+
+    async def get_blog(id):
+        calls.append(id)
+        await asyncio.sleep(0.01)
+        return web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
+    handler = coalesced(get_blog)
+
+    async def main():
+        rs = await asyncio.gather(*[handler._call_shared(None, dict(id='1')) for i in range(3)])
+        rs.append(await handler._call_shared(None, dict(id='1')))
+        return rs
+    rs = run(main())
+    assert len(calls) == 2
+    assert all(r.status == 503 and r.headers['Retry-After'] == '1' for r in rs)
+    # 每个请求一个 Response
+    assert len(set(map(id, rs))) == 4
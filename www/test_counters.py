@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''counters.py 的测试，数据库换成 fakedb.FakePool'''
+
+import time, asyncio
+
+import pytest
+
+pytest.importorskip('aiomysql')
+
+import orm, counters
+from fakedb import FakePool
+from models import Blog, Comment
+
+
+def run(coro):
+	return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def set_pool(monkeypatch, tables=None):
+	pool = FakePool(tables)
+	monkeypatch.setattr(orm, '__pool', pool, raising=False)
+	return pool
+
+
+def updates(pool):
+	# Blog.increment 的参数: delta, last_comment_at, updated_at, id
+	return sorted((args[-1], args[0], args[1]) for sql, args in pool.executed if sql.startswith('update `blogs`'))
+
+
+def test_comments_flushed_updates_each_blog_once(monkeypatch):
+	pool = set_pool(monkeypatch)
+	batch = [Comment(id=1, blog_id='a', created_at=1.0), Comment(id=2, blog_id='b', created_at=2.0),
+			 Comment(id=3, blog_id='a', created_at=3.0)]
+	run(counters.comments_flushed(batch))
+	assert updates(pool) == [('a', 2, 3.0), ('b', 1, 2.0)]
+
+
+def test_reconcile_skips_recently_changed_blogs(monkeypatch):
+	old = time.time() - 3600
+	now = time.time()
+	pool = set_pool(monkeypatch, {
+		# group by blog_id 的结果
+		'comments': [
+			dict(blog_id='drift', _num_=3, _last_=old),
+			dict(blog_id='counted', _num_=4, _last_=old),
+			# 评论已经写库，计数可能还没加上
+			dict(blog_id='inserted', _num_=2, _last_=now)
+		],
+		'blogs': [
+			dict(id='drift', comment_count=5, last_comment_at=old, updated_at=old),
+			dict(id='ok', comment_count=0, last_comment_at=0.0, updated_at=old),
+			# 读 comments 之后才写库并加上计数的评论
+			dict(id='counted', comment_count=5, last_comment_at=now, updated_at=now),
+			dict(id='inserted', comment_count=1, last_comment_at=old, updated_at=old)
+		]
+	})
+	assert run(counters.reconcile()) == 1
+	assert updates(pool) == [('drift', -2, old)]
+
+
+def test_comments_flushed_deletes_comments_of_deleted_blog(monkeypatch):
+	set_pool(monkeypatch)
+	increment = Blog.increment
+	enqueued = []
+
+	@asyncio.coroutine
+	def fake_increment(pk, field, delta=1, **kw):
+		if pk == 'gone':
+			yield from asyncio.sleep(0)
+			return 0
+		return (yield from increment(pk, field, delta, **kw))
+	monkeypatch.setattr(Blog, 'increment', fake_increment)
+	monkeypatch.setattr(counters.jobs, 'enqueue', lambda name, **kw: enqueued.append((name, kw)))
+	batch = [Comment(id=1, blog_id='a', created_at=1.0), Comment(id=2, blog_id='gone', created_at=2.0)]
+	run(counters.comments_flushed(batch))
+	assert enqueued == [('blog.delete_comments', dict(blog_id='gone'))]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''handlers.py 的测试，数据库换成 fakedb.FakePool'''
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiomysql')
+
+from aiohttp import web
+
+import orm, handlers
+from fakedb import FakePool
+from models import User
+from coroweb import RequestHandler
+from apis import APIResourceNotFoundError, APIPermissionError
+
+
+def run(coro):
+	return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+	pool = FakePool()
+	monkeypatch.setattr(orm, '__pool', pool, raising=False)
+	return pool
+
+
+class FakeRequest(object):
+	def __init__(self, user=None):
+		self.__user__ = user
+
+
+def test_api_errors():
+	e = APIResourceNotFoundError('Blog')
+	assert (e.error, e.data, e.message) == ('value:notfound', 'Blog', '')
+	e = APIPermissionError()
+	assert (e.error, e.data) == ('permission:forbidden', 'permission')
+	with pytest.raises(APIPermissionError):
+		handlers.check_admin(FakeRequest(User(id='1', admin=False)))
+
+
+def test_missing_blog_page_is_404(pool):
+	r = run(asyncio.coroutine(handlers.get_blog)('404'))
+	assert isinstance(r, web.HTTPNotFound)
+
+
+def test_comment_on_missing_blog_is_api_error(pool):
+	handler = RequestHandler(None, asyncio.coroutine(handlers.api_create_comment), '/api/blogs/{id}/comments')
+	kw = dict(id='404', request=FakeRequest(User(id='1', name='u', image='')), content='hi')
+	r = run(handler._call(kw))
+	assert r == dict(error='value:notfound', data='Blog', message='')
+
+
+@pytest.mark.parametrize('fn', [handlers.api_blogs, handlers.api_get_users, handlers.api_comments])
+def test_ndjson_export_needs_admin(pool, fn):
+	handler = RequestHandler(None, asyncio.coroutine(fn))
+	for user in (None, User(id='1', admin=False)):
+		r = run(handler._call(dict(request=FakeRequest(user), format='ndjson')))
+		assert r['error'] == 'permission:forbidden'
+	r = run(handler._call(dict(request=FakeRequest(User(id='1', admin=True)), format='ndjson')))
+	assert r.ndjson
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''idgen.py 的测试，不需要数据库'''
+
+import pytest
+
+from idgen import IdWorker, ClockSkewError
+
+
+def test_ids_are_unique_and_increasing():
+	worker = IdWorker(3)
+	ids = [worker.next_id() for i in range(5000)]
+	assert ids == sorted(ids)
+	assert len(set(ids)) == len(ids)
+	# 默认布局保持在53位以内，JavaScript可以精确表示
+	assert ids[-1] < 2 ** 53
+
+
+def test_parse_id_roundtrip():
+	worker = IdWorker(7)
+	id = worker.make_id(1467000000123, 7, 42)
+	assert worker.parse_id(id) == (1467000000123, 7, 42)
+
+
+def test_invalid_worker_id():
+	with pytest.raises(ValueError):
+		IdWorker(32)
+
+
+def test_clock_skew():
+	worker = IdWorker(1, max_backward_ms=5)
+	now = [1467000000000]
+	worker._now = lambda: now[0]
+	first = worker.next_id()
+	now[0] -= 1000
+	with pytest.raises(ClockSkewError):
+		worker.next_id()
+	now[0] += 1000
+	assert worker.next_id() > first
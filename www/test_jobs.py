@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''jobs.py 的测试'''
+
+import asyncio, sqlite3
+
+import jobs
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def rows(path):
+    return sqlite3.connect(path).execute('select name, state, attempts, last_error from jobs order by id').fetchall()
+
+
+def test_priority_and_completion(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    seen = []
+
+    @jobs.job('test.record')
+    async def record(x):
+        seen.append(x)
+
+    async def main():
+        queue = jobs.JobQueue(path, concurrency=1, poll_interval=0.01)
+        queue.enqueue('test.record', {'x': 'low'})
+        queue.enqueue('test.record', {'x': 'high'}, priority=5)
+        queue.start(asyncio.get_event_loop())
+        await asyncio.sleep(0.2)
+        await queue.stop()
+    run(main())
+    assert seen == ['high', 'low']
+    # 执行成功的任务被删除
+    assert rows(path) == []
+
+
+def test_retry_then_dead(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    calls = []
+
+    @jobs.job('test.flaky', max_attempts=3)
+    async def flaky():
+        calls.append(1)
+        raise ValueError('boom')
+
+    async def main():
+        queue = jobs.JobQueue(path, poll_interval=0.01, retry_delay=0.01)
+        queue.enqueue('test.flaky', {})
+        queue.start(asyncio.get_event_loop())
+        await asyncio.sleep(0.5)
+        await queue.stop()
+    run(main())
+    assert len(calls) == 3
+    assert rows(path) == [('test.flaky', 'dead', 3, 'ValueError: boom')]
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    crashed = jobs.JobQueue(path)
+    crashed.lease = -1
+    crashed.enqueue('test.any', {})
+    # 取出后进程"崩溃"，没有记录结果
+    assert len(crashed._claim(10)) == 1
+    other = jobs.JobQueue(path)
+    assert [r[1] for r in other._claim(10)] == ['test.any']
+    # 租期内不会再给第二个进程
+    assert jobs.JobQueue(path)._claim(10) == []
+
+
+
+def test_killed_job_stops_after_max_attempts(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    queue = jobs.JobQueue(path)
+    queue.lease = -1
+    queue.enqueue('test.any', {}, max_attempts=2)
+    # 每次执行时进程都被杀掉
+    assert len(queue._claim(10)) == 1
+    assert len(queue._claim(10)) == 1
+    assert queue._claim(10) == []
+    assert rows(path) == [('test.any', 'dead', 2, 'lease expired')]
+
+
+def test_resolve_path_ignores_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    data_dir = str(tmp_path / 'data')
+    assert jobs.resolve_path('jobs.sqlite3', data_dir) == str(tmp_path / 'data' / 'jobs.sqlite3')
+    assert (tmp_path / 'data').is_dir()
+    # 绝对路径原样使用
+    assert jobs.resolve_path('/srv/jobs.sqlite3', data_dir) == '/srv/jobs.sqlite3'
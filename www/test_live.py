@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''live.py 的测试'''
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from live import Hub, encode
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_publish_fans_out_one_encoded_frame():
+    async def main():
+        hub = Hub()
+        a, b = hub.subscribe('comments:1'), hub.subscribe('comments:1')
+        other = hub.subscribe('comments:2')
+        hub.publish_local('comments:1', 1.5, 'comment', {'id': 'c1'})
+        return a.get_nowait(), b.get_nowait(), other.empty()
+    fa, fb, empty = run(main())
+    assert fa is fb
+    assert fa == encode(1.5, 'comment', {'id': 'c1'})
+    assert fa.startswith(b'id: 1.5\nevent: comment\ndata: ')
+    assert empty
+
+
+def test_replay_after_last_id():
+    async def main():
+        hub = Hub(history=2)
+        for t in (1.0, 2.0, 3.0):
+            hub.publish_local('comments:1', t, 'comment', {'t': t})
+        return hub.replay('comments:1', '1.0'), hub.replay('comments:1', '2.0'), hub.replay('comments:1', None)
+    after1, after2, none = run(main())
+    # 只保留最近 2 个
+    assert after1 == [encode(2.0, 'comment', {'t': 2.0}), encode(3.0, 'comment', {'t': 3.0})]
+    assert after2 == [encode(3.0, 'comment', {'t': 3.0})]
+    assert none == []
+
+
+def test_slow_subscriber_is_dropped():
+    async def main():
+        hub = Hub(queue_size=2)
+        q = hub.subscribe('t')
+        for i in range(3):
+            hub.publish_local('t', i, 'e', i)
+        return hub, [q.get_nowait() for i in range(q.qsize())]
+    hub, frames = run(main())
+    assert frames[-1] is None
+    assert hub.subscribers == 0
+    assert hub.dropped == 1
+
+
+def test_limits_and_close():
+    async def main():
+        hub = Hub(max_subscribers=1)
+        q = hub.subscribe('t')
+        hub.publish_local('t', 1, 'e', 1)
+        full = hub.subscribe('t')
+        hub.close()
+        return q.get_nowait(), full, hub.subscribe('t'), hub.subscribers
+    last, full, closed, count = run(main())
+    # 关闭时丢掉没发出去的事件，只留结束标记
+    assert last is None
+    assert full is None and closed is None
+    assert count == 0
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''metrics.py 的测试'''
+
+import pytest
+
+pytest.importorskip('aiomysql')
+pytest.importorskip('aiohttp')
+
+import metrics
+
+
+def test_render_requests_and_runtime():
+    m = metrics.Metrics()
+    m.observe_request('GET', '/blog/{id}', 200, 0.003)
+    m.observe_request('GET', '/blog/{id}', 200, 0.2)
+    m.observe_request('GET', 'unmatched', 404, 0.001)
+    text = m.render()
+    assert '# TYPE awesome_http_requests_total counter' in text
+    assert 'awesome_http_requests_total{method="GET",route="/blog/{id}",status="200"} 2' in text
+    assert 'awesome_http_requests_total{method="GET",route="unmatched",status="404"} 1' in text
+    assert 'awesome_http_request_duration_seconds_bucket{le="0.005",method="GET",route="/blog/{id}"} 1' in text
+    assert 'awesome_http_request_duration_seconds_bucket{le="+Inf",method="GET",route="/blog/{id}"} 2' in text
+    assert 'awesome_http_request_duration_seconds_count{method="GET",route="/blog/{id}"} 2' in text
+    assert 'python_gc_collections_total{generation="0"}' in text
+    assert 'process_resident_memory_bytes ' in text
+    assert text.endswith('\n')
+
+
+def test_label_values_are_escaped():
+    assert metrics._escape('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''pagecache.py 的测试'''
+
+import time
+
+from pagecache import PageCache
+
+HEADERS = {'Content-Type': 'text/html;charset=utf-8', 'ETag': '"x"'}
+
+
+def test_tags():
+    cache = PageCache()
+    assert cache.tag_for('/') == 'index'
+    assert cache.tag_for('/blog/123') == 'blog:123'
+    assert cache.tag_for('/api/blogs') is None
+    assert cache.tag_for('/blog/123/edit') is None
+
+
+def test_put_get_and_invalidate():
+    cache = PageCache()
+    cache.put('/', 'index', cache.generation('index'), b'<html>index</html>' * 100, HEADERS)
+    cache.put('/blog/1', 'blog:1', cache.generation('blog:1'), b'<html>1</html>', HEADERS)
+    page = cache.get('/')
+    assert page.body.startswith(b'<html>index')
+    assert page.gz is not None and len(page.gz) < len(page.body)
+    cache.invalidate('blog:1')
+    assert cache.get('/blog/1') is None
+    assert cache.get('/') is not None
+
+
+def test_invalidated_while_rendering():
+    cache = PageCache()
+    generation = cache.generation('blog:1')
+    # 渲染期间博客被修改了，渲染出来的旧页面不能进缓存
+    cache.invalidate('blog:1')
+    assert cache.put('/blog/1', 'blog:1', generation, b'old', HEADERS) is None
+    assert cache.get('/blog/1') is None
+
+
+def test_lru_and_ttl():
+    cache = PageCache(max_entries=2, ttl=60)
+    for key in ('/?page=1', '/?page=2'):
+        cache.put(key, 'index', 0, b'page', HEADERS)
+    cache.get('/?page=1')
+    cache.put('/?page=3', 'index', 0, b'page', HEADERS)
+    assert cache.get('/?page=2') is None
+    assert len(cache) == 2
+    cache.get('/?page=1').expires = time.time() - 1
+    assert cache.get('/?page=1') is None
+
+
+def test_lookup_keys_on_known_params():
+    cache = PageCache()
+    assert cache.lookup('/', {}) == ('index', '/')
+    assert cache.lookup('/', {'page': '2'}) == ('index', '/?page=2')
+    assert cache.lookup('/blog/1', {}) == ('blog:1', '/blog/1')
+    # 页面用不到的参数不走缓存
+    assert cache.lookup('/', {'page': '2', 'utm': 'x'}) is None
+    assert cache.lookup('/blog/1', {'r': '123'}) is None
+    assert cache.lookup('/api/blogs', {}) is None
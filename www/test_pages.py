@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''orm.py 键集分页(Model.iterPages)的测试，查询换成内存里的实现'''
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiomysql')
+
+import orm
+from orm import Model, IntegerField, StringField, FloatField
+from fakedb import FakePool
+
+
+class Row(Model):
+	__table__ = 'rows'
+	__shard_key__ = 'owner'
+
+	id = IntegerField(primary_key=True)
+	owner = StringField()
+	created_at = FloatField()
+
+
+def run(coro):
+	return asyncio.new_event_loop().run_until_complete(coro)
+
+
+async def collect(it):
+	return [r async for r in it]
+
+
+@pytest.fixture
+def db(monkeypatch):
+	'''
+	每个 pool 一张按 (created_at, id) 降序排好的表，select 按键集条件和 limit 返回一页。
+	'''
+	tables = {}
+	calls = []
+
+	@asyncio.coroutine
+	def select(sql, args, size=None, pool=None):
+		yield from asyncio.sleep(0)
+		calls.append((pool, sql, list(args)))
+		rows = tables[pool or getattr(orm, '__pool')]
+		if 'or (' in sql:
+			last_at, last_id = args[-4], args[-2]
+			rows = [r for r in rows if (r['created_at'], r['id']) < (last_at, last_id)]
+		return [dict(r) for r in rows[:args[-1]]]
+	monkeypatch.setattr(orm, 'select', select)
+	monkeypatch.setattr(orm, '__shard_pools', {})
+	monkeypatch.setattr(orm, '__shard_ring', None)
+
+	def add_pool(rows):
+		pool = FakePool()
+		tables[pool] = sorted(rows, key=lambda r: (r['created_at'], r['id']), reverse=True)
+		return pool
+	return add_pool, calls
+
+
+def test_pages_follow_last_key(db, monkeypatch):
+	add_pool, calls = db
+	# created_at 有重复，靠主键区分
+	rows = [dict(id=i, owner='a', created_at=float(i // 2)) for i in range(7)]
+	monkeypatch.setattr(orm, '__pool', add_pool(rows), raising=False)
+	items = run(collect(Row.iterPages(orderBy='created_at desc', pageSize=3)))
+	assert [r.id for r in items] == [6, 5, 4, 3, 2, 1, 0]
+	# 每页一次查询: 3 + 3 + 1
+	assert len(calls) == 3
+	assert 'order by `created_at` desc, `id` desc limit ?' in calls[0][1]
+	assert calls[1][2] == [2.0, 2.0, 4, 3]
+
+
+def test_where_args_come_first(db, monkeypatch):
+	add_pool, calls = db
+	monkeypatch.setattr(orm, '__pool', add_pool([dict(id=1, owner='a', created_at=1.0)]), raising=False)
+	run(collect(Row.iterPages('owner=?', ['a'], orderBy='created_at desc', pageSize=1)))
+	assert calls[1][1].count('where') == 1
+	assert '(owner=?) and (`created_at` < ? or' in calls[1][1]
+	assert calls[1][2] == ['a', 1.0, 1.0, 1, 1]
+
+
+def test_pages_merge_across_shards(db, monkeypatch):
+	add_pool, calls = db
+	pools = {'s0': add_pool([dict(id=i, owner='x', created_at=float(i)) for i in range(0, 10, 2)]),
+			 's1': add_pool([dict(id=i, owner='y', created_at=float(i)) for i in range(1, 10, 2)])}
+	monkeypatch.setattr(orm, '__shard_pools', pools)
+	monkeypatch.setattr(orm, '__shard_ring', orm.HashRing(list(pools)))
+	items = run(collect(Row.iterPages(orderBy='created_at desc', pageSize=2)))
+	assert [r.id for r in items] == list(range(9, -1, -1))
+
+
+def test_needs_one_order_column(db):
+	with pytest.raises(ValueError):
+		run(collect(Row.iterPages(orderBy='created_at desc, id')))
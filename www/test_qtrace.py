@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''qtrace.py 的测试'''
+
+import asyncio
+
+import pytest
+
+import qtrace
+
+
+def test_shape_folds_multi_row_insert():
+	assert qtrace.shape('insert into `t` (`a`) values (?), (?), (?)') == 'insert into `t` (`a`) values (?), ...'
+
+
+def test_close_trace_on_cleanup_writes_buffered_events(tmp_path):
+	pytest.importorskip('aiomysql')
+	import orm, app as webapp
+	path = str(tmp_path / 'trace.ndjson')
+	recorder = qtrace.TraceRecorder(path)
+	orm.set_recorder(recorder)
+	# 不到一秒，还在缓冲里
+	recorder.record(recorder._last_flush, 'select 1', [], 0.001)
+	assert qtrace.load(path) == []
+	loop = asyncio.new_event_loop()
+	loop.run_until_complete(webapp.close_trace({'__trace__': recorder}))
+	loop.close()
+	assert [e['sql'] for e in qtrace.load(path)] == ['select 1']
+	assert orm._recorder is None
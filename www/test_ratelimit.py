@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''ratelimit.py 的测试'''
+
+from ratelimit import BucketStore, RateLimiter, retry_after
+
+
+class FakeRequest(object):
+
+    def __init__(self, method, path, ip='1.2.3.4'):
+        self.method = method
+        self.path = path
+        self.headers = {'X-Real-IP': ip}
+        self.transport = None
+
+
+def test_bucket_burst_and_refill():
+    store = BucketStore()
+    for i in range(3):
+        assert store.take('k', 1.0, 3, now=100.0) == 0
+    assert store.take('k', 1.0, 3, now=100.0) == 1.0
+    assert store.take('k', 1.0, 3, now=100.5) == 0.5
+    assert store.take('k', 1.0, 3, now=101.0) == 0
+
+
+def test_store_is_bounded():
+    store = BucketStore(max_keys=10)
+    for i in range(100):
+        store.take(i, 0.001, 5, now=100.0)
+    assert len(store) == 10
+    # 补满的桶会被丢掉
+    store.take('new', 0.001, 5, now=1e9)
+    assert len(store) == 1
+
+
+def test_limiter_routes():
+    limiter = RateLimiter({
+        'POST /api/blogs/{id}/comments': {'ip': {'rate': 1, 'burst': 2}, 'user': {'rate': 1, 'burst': 1}}
+    }, trust_proxy=True)
+    assert limiter.check(FakeRequest('GET', '/api/blogs/1/comments')) == 0
+    assert limiter.check(FakeRequest('POST', '/api/blogs/1/comments'), 'cookie-a') == 0
+    # 同一个会话的令牌用完了
+    assert limiter.check(FakeRequest('POST', '/api/blogs/2/comments'), 'cookie-a') > 0
+    # IP 的令牌也用完了
+    assert limiter.check(FakeRequest('POST', '/api/blogs/2/comments'), 'cookie-b') > 0
+    assert limiter.check(FakeRequest('POST', '/api/blogs/2/comments', ip='5.6.7.8'), 'cookie-b') == 0
+    assert retry_after(0.2) == '1'
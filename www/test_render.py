@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''render.py 的测试，进程池换成一个线程的线程池，转换函数换成可以控制什么时候完成的假函数'''
+
+import asyncio, threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('markdown2')
+if not hasattr(asyncio, 'coroutine'):
+    pytest.skip('render.py needs asyncio.coroutine', allow_module_level=True)
+
+import render
+
+
+class FakeMarkdown(object):
+    '''
+    代替 markdown2 模块: 'block' 开头的文本要等 release() 之后才转换完。
+    '''
+
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+
+    def markdown(self, text):
+        self.calls.append(text)
+        if text.startswith('block'):
+            self.gate.wait(5)
+        return '<p>%s</p>' % text
+
+    def release(self):
+        self.gate.set()
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    old = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    fake = FakeMarkdown()
+    executor = ThreadPoolExecutor(2)
+    monkeypatch.setattr(render, 'markdown2', fake)
+    monkeypatch.setattr(render, '_executor', executor)
+    monkeypatch.setattr(render, '_semaphore', asyncio.Semaphore(1))
+    monkeypatch.setattr(render, '_inline_limit', 10)
+    monkeypatch.setattr(render, '_max_waiting', 1)
+    monkeypatch.setattr(render, '_timeout', 5.0)
+    monkeypatch.setattr(render, '_waiting', 0)
+    loop.fake = fake
+    yield loop
+    fake.release()
+    executor.shutdown(wait=True)
+    loop.close()
+    asyncio.set_event_loop(old)
+
+
+def test_short_text_renders_inline(loop, monkeypatch):
+    monkeypatch.setattr(render, '_executor', None)
+    assert loop.run_until_complete(render.markdown('# hi')) == '<p># hi</p>'
+    monkeypatch.setattr(render, '_executor', object())
+    # 短文本不经过进程池
+    assert loop.run_until_complete(render.markdown('short')) == '<p>short</p>'
+
+
+def test_long_text_uses_pool(loop):
+    text = 'x' * 20
+    assert loop.run_until_complete(render.markdown(text)) == '<p>%s</p>' % text
+    assert not render._semaphore.locked()
+
+
+def test_busy_when_waiting_queue_full(loop):
+    async def main():
+        running = asyncio.ensure_future(render.markdown('block running'))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.ensure_future(render.markdown('waiting text'))
+        await asyncio.sleep(0.01)
+        with pytest.raises(render.RenderBusy):
+            await render.markdown('one too many')
+        loop.fake.release()
+        return await running, await waiting
+    assert loop.run_until_complete(main()) == ('<p>block running</p>', '<p>waiting text</p>')
+    assert loop.fake.calls == ['block running', 'waiting text']
+    assert render._waiting == 0
+
+
+def test_timeout_keeps_slot_until_render_finishes(loop, monkeypatch):
+    monkeypatch.setattr(render, '_timeout', 0.02)
+
+    async def main():
+        with pytest.raises(render.RenderBusy):
+            await render.markdown('block forever')
+        # 线程里的转换还在跑，名额不能还回去
+        held = render._semaphore.locked()
+        loop.fake.release()
+        await asyncio.sleep(0.05)
+        return held, render._semaphore.locked()
+    assert loop.run_until_complete(main()) == (True, False)
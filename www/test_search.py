@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''search.py 的测试，不需要数据库'''
+
+import zlib, asyncio
+
+import search
+from search import tokenize, SearchIndex
+
+
+def test_tokenize_cjk_bigrams():
+	assert tokenize('Python异步编程') == ['python', '异步', '步编', '编程']
+	assert tokenize('和') == ['和']
+
+
+def test_bm25_ranking():
+	index = SearchIndex()
+	index.add('1', '协程入门', 'asyncio', '协程是Python的异步编程方式')
+	index.add('2', '日常', '随笔', '今天天气不错，写了点异步代码')
+	index.add('3', 'ORM', '元类', '用元类实现一个简单的ORM')
+	hits = index.search('异步编程')
+	assert [doc_id for doc_id, score in hits] == ['1', '2']
+	assert index.search('orm')[0][0] == '3'
+
+
+def test_update_and_remove():
+	index = SearchIndex()
+	index.add('1', '旧标题', '', '')
+	index.add('1', '新文章', '', '')
+	assert index.search('旧标题') == []
+	assert index.search('新文章')[0][0] == '1'
+	index.remove('1')
+	assert len(index) == 0 and index.postings == {}
+
+
+def test_save_and_load(tmpdir):
+	path = str(tmpdir.join('search.index'))
+	index = SearchIndex()
+	index.add('1', '协程入门', '', '异步编程')
+	index.save(path)
+	loaded = SearchIndex.load(path)
+	assert len(loaded) == 1
+	assert loaded.search('编程') == index.search('编程')
+
+
+class _Blog(dict):
+	__getattr__ = dict.__getitem__
+
+
+class FakeBlogModel(object):
+	'''
+	只实现 search.init() 用到的 findNumber / findAll，校验和按 CHECKSUM_SQL 的规则在Python里算。
+	'''
+
+	def __init__(self, blogs):
+		self.blogs = blogs
+		self.built = 0
+
+	async def findNumber(self, selectField):
+		if selectField == search.CHECKSUM_SQL:
+			return sum(zlib.crc32('\n'.join((b.name, b.summary, b.content)).encode('utf-8')) for b in self.blogs)
+		return len(self.blogs)
+
+	async def findAll(self):
+		self.built += 1
+		return self.blogs
+
+
+def test_checksum_survives_save_and_load(tmpdir):
+	path = str(tmpdir.join('search.index'))
+	index = SearchIndex()
+	index.add('1', 'a', 'b', 'c')
+	index.add('2', '标题', '', '正文')
+	index.save(path)
+	assert SearchIndex.load(path).checksum() == index.checksum()
+	index.remove('2')
+	assert index.checksum() == search.doc_checksum('a', 'b', 'c')
+
+
+def test_init_rebuilds_when_content_changed(tmpdir, monkeypatch):
+	for name in ('_index', '_path', '_loop', '_model'):
+		monkeypatch.setattr(search, name, None)
+	path = str(tmpdir.join('search.index'))
+	model = FakeBlogModel([_Blog(id=1, name='协程', summary='', content='异步')])
+	loop = asyncio.new_event_loop()
+	loop.run_until_complete(search.init(loop, path, model))
+	assert model.built == 1
+	# 索引文件是最新的，不用重建
+	loop.run_until_complete(search.init(loop, path, model))
+	assert model.built == 1
+	# 改了内容但没来得及写盘就退出了: 篇数一样，校验和不一样
+	model.blogs[0]['content'] = '元类'
+	loop.run_until_complete(search.init(loop, path, model))
+	assert model.built == 2
+	assert search.query('元类')[0][0] == '1'
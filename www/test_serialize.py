@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''serialize.py 的测试，orjson 和标准库 json 两个后端都跑一遍'''
+
+import sys, json, importlib
+
+import pytest
+
+from apis import Page
+
+
+def load(backend, monkeypatch):
+	'''
+	按指定后端重新导入一份 serialize，不影响其他测试用的模块。
+	'''
+	if backend == 'orjson':
+		pytest.importorskip('orjson')
+	else:
+		# 让 import orjson 失败
+		monkeypatch.setitem(sys.modules, 'orjson', None)
+	monkeypatch.delitem(sys.modules, 'serialize', raising=False)
+	module = importlib.import_module('serialize')
+	monkeypatch.delitem(sys.modules, 'serialize')
+	assert module.BACKEND == backend
+	return module
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def serialize(request, monkeypatch):
+	return load(request.param, monkeypatch)
+
+
+def test_page(serialize):
+	data = json.loads(serialize.dumps(dict(page=Page(7, 2, 3))))
+	assert data['page'] == dict(item_count=7, page_count=3, page_index=2, page_size=3, offset=3, limit=3,
+								has_next=True, has_previous=True)
+
+
+def test_model_encoded_as_dict(serialize):
+	pytest.importorskip('aiomysql')
+	from models import Blog
+	blog = Blog(id='1', name='标题', comment_count=2, created_at=1.5)
+	out = serialize.dumps(dict(blogs=[blog]))
+	# 直接输出UTF-8，中文不转义
+	assert '标题'.encode('utf-8') in out
+	assert json.loads(out) == dict(blogs=[dict(id='1', name='标题', comment_count=2, created_at=1.5)])
+
+
+def test_registered_subclass_and_sets(serialize):
+	class Special(Page):
+		pass
+
+	class Plain(object):
+		def __init__(self):
+			self.x = 1
+	data = json.loads(serialize.dumps([Special(1), {3}, frozenset(), Plain()]))
+	assert data[0]['item_count'] == 1
+	assert data[1:] == [[3], [], {'x': 1}]
+
+
+def test_unserializable(serialize):
+	with pytest.raises(TypeError):
+		serialize.dumps(object())
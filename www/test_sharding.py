@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''orm.py 水平分片的测试，每个分片一个 fakedb.FakePool，不需要数据库'''
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiomysql')
+
+import orm
+from orm import Model, HashRing, IntegerField, StringField, FloatField
+from fakedb import FakePool
+
+
+class Item(Model):
+	__table__ = 'items'
+	__shard_key__ = 'owner'
+
+	id = IntegerField(primary_key=True)
+	owner = StringField()
+	created_at = FloatField()
+
+
+def run(coro):
+	return asyncio.new_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def shards(monkeypatch):
+	'''
+	三个分片，每个分片的行已经按 created_at desc 排好(和数据库执行 order by 之后一样)。
+	'''
+	tables = {
+		's0': [dict(id=1, owner='a', created_at=9.0), dict(id=2, owner='a', created_at=4.0), dict(id=3, owner='a', created_at=1.0)],
+		's1': [dict(id=4, owner='b', created_at=8.0), dict(id=5, owner='b', created_at=5.0)],
+		's2': [dict(id=6, owner='c', created_at=7.0), dict(id=7, owner='c', created_at=6.0), dict(id=8, owner='c', created_at=2.0)]
+	}
+
+	@asyncio.coroutine
+	def make_pool(loop, **kw):
+		yield from asyncio.sleep(0)
+		return FakePool({'items': tables[kw['db']]})
+	monkeypatch.setattr(orm, '_make_pool', make_pool)
+	monkeypatch.setattr(orm, '__shard_pools', {})
+	monkeypatch.setattr(orm, '__shard_ring', None)
+	run(orm.create_shard_pools(None, {name: {'db': name} for name in tables}, user='u', password='p'))
+	return tables
+
+
+def test_key_always_maps_to_same_shard():
+	ring = HashRing(['s0', 's1', 's2'])
+	for key in range(1000):
+		assert ring.get_node(key) == ring.get_node(key)
+		# 路由参数是字符串，库里读出来的是整数
+		assert ring.get_node(str(key)) == ring.get_node(key)
+	assert HashRing(['s0', 's1', 's2']).get_node('blog-1') == ring.get_node('blog-1')
+
+
+def test_adding_shard_moves_about_one_nth_of_keys():
+	before = HashRing(['s0', 's1', 's2', 's3'])
+	after = HashRing(['s0', 's1', 's2', 's3', 's4'])
+	keys = range(20000)
+	moved = [k for k in keys if before.get_node(k) != after.get_node(k)]
+	# 理想情况是 1/5
+	assert 0.1 < len(moved) / len(keys) < 0.3
+	# 移动的key都去了新分片
+	assert all(after.get_node(k) == 's4' for k in moved)
+
+
+def test_shard_key_routes_to_one_pool(shards):
+	pool = orm.shard_pool('a')
+	assert pool in orm.shard_pools()
+	assert len(orm.shard_pools()) == 3
+	before = [p.queries for p in orm.shard_pools()]
+	run(Item.findAll('owner=?', ['a'], shardKey='a'))
+	after = [p.queries for p in orm.shard_pools()]
+	assert sum(after) - sum(before) == 1
+	assert pool.queries == before[orm.shard_pools().index(pool)] + 1
+
+
+def test_find_all_merges_order_by_across_shards(shards):
+	items = run(Item.findAll(orderBy='created_at desc'))
+	assert [i.created_at for i in items] == [9.0, 8.0, 7.0, 6.0, 5.0, 4.0, 2.0, 1.0]
+	items = run(Item.findAll(orderBy='created_at'))
+	assert [i.id for i in items] == [3, 8, 2, 5, 7, 6, 4, 1]
+
+
+def test_find_all_offset_limit_across_shards(shards):
+	# 每个分片取前 offset+limit 行，归并后跳过 offset 行
+	items = run(Item.findAll(orderBy='created_at desc', limit=(2, 3)))
+	assert [i.created_at for i in items] == [7.0, 6.0, 5.0]
+	items = run(Item.findAll(orderBy='created_at desc', limit=4))
+	assert [i.created_at for i in items] == [9.0, 8.0, 7.0, 6.0]
+	items = run(Item.findAll(orderBy='created_at desc', limit=(6, 10)))
+	assert [i.created_at for i in items] == [2.0, 1.0]
+
+
+def test_find_number_sums_counts_across_shards(shards):
+	assert run(Item.findNumber('count(id)')) == 8
+	assert run(Item.findNumber('count(id)', 'owner=?', ['c'], shardKey='c')) == 3
+
+
+def test_merge_numbers():
+	assert orm._merge_numbers('count(id)', [3, 2, 0]) == 5
+	assert orm._merge_numbers('sum(comment_count)', [3, None, 4]) == 7
+	assert orm._merge_numbers('max(created_at)', [1.5, None, 9.0]) == 9.0
+	assert orm._merge_numbers('MIN(created_at)', [1.5, 0.5]) == 0.5
+	# 空分片上的 max() 是 NULL
+	assert orm._merge_numbers('max(created_at)', [None, None]) is None
+	with pytest.raises(ValueError):
+		orm._merge_numbers('avg(created_at)', [1.0, 2.0])
+
+
+def test_remove_where_limit_needs_shard_key(shards):
+	with pytest.raises(ValueError):
+		run(Item.removeWhere('owner=?', ['a'], limit=10))
+	assert run(Item.removeWhere('owner=?', ['a'], shardKey='a', limit=10)) == 1
+	assert orm.shard_pool('a').executed == [('delete from `items` where owner=%s limit %s', ['a', 10])]
+	# 不限行数时每个分片都删
+	assert run(Item.removeWhere('owner=?', ['b'])) == 3
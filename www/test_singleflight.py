@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''singleflight.py 的测试'''
+
+import asyncio
+
+from singleflight import Flight
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def counter():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'n': len(calls)}
+    return calls, fn
+
+
+def test_concurrent_calls_share_one_computation():
+    calls, fn = counter()
+    flight = Flight()
+
+    async def main():
+        return await asyncio.gather(*[flight.do('k', fn) for i in range(10)])
+    results = run(main())
+    assert len(calls) == 1
+    assert all(r == {'n': 1} for r in results)
+
+
+def test_stale_while_revalidate():
+    calls, fn = counter()
+    flight = Flight(ttl=0.05, stale=10)
+
+    async def main():
+        first = await flight.do('k', fn)
+        await asyncio.sleep(0.06)
+        # 过期了但还在 stale 时间内: 立即返回旧结果，后台重新计算
+        stale = await flight.do('k', fn)
+        await asyncio.sleep(0.02)
+        fresh = await flight.do('k', fn)
+        return first, stale, fresh
+    first, stale, fresh = run(main())
+    assert first == stale == {'n': 1}
+    assert fresh == {'n': 2}
+
+
+def test_invalidate_during_computation():
+    calls, fn = counter()
+    flight = Flight(ttl=10)
+
+    async def main():
+        task = asyncio.ensure_future(flight.do('k', fn, tags=('blog:1',)))
+        await asyncio.sleep(0)
+        flight.invalidate('blog:1')
+        await task
+        # 失效前开始的计算结果没有进缓存
+        return await flight.do('k', fn, tags=('blog:1',))
+    assert run(main()) == {'n': 2}
+
+
+def test_unshareable_result_is_recomputed():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return object()
+    flight = Flight(shareable=lambda r: isinstance(r, dict))
+
+    async def main():
+        return await asyncio.gather(*[flight.do('k', fn) for i in range(3)])
+    results = run(main())
+    assert len(calls) == 3
+    assert len(set(map(id, results))) == 3
+
+
+def test_shared_with_waiters_but_not_cached():
+    calls = []
+
+    async def busy():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'busy'
+    flight = Flight(ttl=10, cacheable=lambda value: value != 'busy')
+
+    async def main():
+        first = await asyncio.gather(*[flight.do('k', busy) for i in range(5)])
+        # 没有缓存，下一个请求重新计算
+        second = await flight.do('k', busy)
+        return first, second
+    first, second = run(main())
+    assert first == ['busy'] * 5
+    assert second == 'busy'
+    assert len(calls) == 2
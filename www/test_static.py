@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''static.py 的测试'''
+
+import os, gzip, asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from static import StaticHandler
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def root(tmp_path):
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'app.css').write_bytes(b'body {}')
+    (static / 'css' / 'app.css.gz').write_bytes(gzip.compress(b'body {}'))
+    (static / 'plain.txt').write_bytes(b'plain')
+    # 静态目录外面的文件
+    (tmp_path / 'secret.txt').write_bytes(b'secret')
+    return static
+
+
+def get(handler, filename, headers=None):
+    req = make_mocked_request('GET', '/static/' + filename, headers=headers or {},
+                              match_info={'filename': filename})
+    return run(handler(req))
+
+
+@pytest.mark.parametrize('filename', ['../secret.txt', 'css/../../secret.txt', 'css', 'missing.txt'])
+def test_outside_root_or_missing_is_404(root, filename):
+    with pytest.raises(web.HTTPNotFound):
+        get(StaticHandler(str(root)), filename)
+
+
+def test_absolute_path_is_404(root):
+    secret = os.path.join(os.path.dirname(str(root)), 'secret.txt')
+    with pytest.raises(web.HTTPNotFound):
+        get(StaticHandler(str(root)), secret)
+
+
+def test_gzip_sibling_only_when_accepted(root):
+    handler = StaticHandler(str(root), cache_control='public, max-age=60')
+    resp = get(handler, 'css/app.css', {'Accept-Encoding': 'gzip, deflate'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(resp.body) == b'body {}'
+    assert resp.headers['ETag'].startswith('W/')
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert resp.headers['Cache-Control'] == 'public, max-age=60'
+    assert resp.content_type == 'text/css'
+    for accept in (None, 'deflate', 'gzip;q=0'):
+        resp = get(handler, 'css/app.css', {'Accept-Encoding': accept} if accept else None)
+        assert 'Content-Encoding' not in resp.headers
+        assert resp.body == b'body {}'
+    # 没有 .gz 文件的照常发送原文件
+    resp = get(handler, 'plain.txt', {'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+    assert 'Vary' not in resp.headers
+
+
+def test_stale_gz_is_ignored(root):
+    css = root / 'css' / 'app.css'
+    gz = root / 'css' / 'app.css.gz'
+    mtime = os.path.getmtime(str(gz))
+    os.utime(str(css), (mtime + 10, mtime + 10))
+    resp = get(StaticHandler(str(root)), 'css/app.css', {'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+
+
+def test_not_modified_and_reload(root):
+    handler = StaticHandler(str(root))
+    etag = get(handler, 'plain.txt').headers['ETag']
+    assert get(handler, 'plain.txt', {'If-None-Match': etag}).status == 304
+    path = root / 'plain.txt'
+    mtime = os.path.getmtime(str(path))
+    path.write_bytes(b'changed')
+    os.utime(str(path), (mtime + 10, mtime + 10))
+    resp = get(handler, 'plain.txt', {'If-None-Match': etag})
+    assert resp.status == 200
+    assert resp.body == b'changed'
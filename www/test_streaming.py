@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''streaming.py 的测试'''
+
+import json, asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from apis import APIPermissionError
+from streaming import JsonStream, write_json_stream
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class Rows(object):
+    '''
+    异步迭代器，第 fail_at 行抛出 error，记录有没有被关闭。
+    '''
+
+    def __init__(self, rows, fail_at=None, error=None):
+        self.rows = list(rows)
+        self.fail_at = fail_at
+        self.error = error
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.fail_at == 0:
+            raise self.error
+        if self.fail_at is not None:
+            self.fail_at -= 1
+        if not self.rows:
+            raise StopAsyncIteration
+        return self.rows.pop(0)
+
+    async def aclose(self):
+        self.closed = True
+
+
+def request():
+    req = make_mocked_request('GET', '/api/blogs')
+    written = bytearray()
+
+    async def write(data):
+        written.extend(data)
+    req._payload_writer.write = write
+    return req, written
+
+
+def test_rows_streamed_as_json():
+    req, written = request()
+    rows = Rows([{'id': 1}, {'id': 2}])
+    resp = run(write_json_stream(req, JsonStream(rows, key='blogs', head={'page': 1})))
+    assert resp.status == 200
+    assert json.loads(bytes(written).decode('utf-8')) == {'page': 1, 'blogs': [{'id': 1}, {'id': 2}]}
+    assert rows.closed
+
+
+def test_error_before_first_row_is_normal_response():
+    req, written = request()
+    rows = Rows([], fail_at=0, error=APIPermissionError())
+    resp = run(write_json_stream(req, JsonStream(rows, ndjson=True)))
+    assert type(resp) is web.Response
+    assert json.loads(resp.body.decode('utf-8'))['error'] == 'permission:forbidden'
+    assert rows.closed
+    # 响应头还没发
+    assert not written
+
+    # 其他错误交给 aiohttp 返回 500
+    rows = Rows([], fail_at=0, error=OSError('db down'))
+    with pytest.raises(OSError):
+        run(write_json_stream(req, JsonStream(rows, ndjson=True)))
+    assert rows.closed
+    assert not written
+
+
+def test_error_mid_stream_aborts():
+    req, written = request()
+    rows = Rows([{'id': 1}, {'id': 2}], fail_at=1, error=OSError('connection lost'))
+    with pytest.raises(OSError):
+        run(write_json_stream(req, JsonStream(rows, ndjson=True)))
+    assert rows.closed
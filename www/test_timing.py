@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''timing.py 的测试'''
+
+import timing
+
+
+def test_histogram_cumulative_and_quantile():
+    h = timing.Histogram(buckets=(0.01, 0.1, 1.0))
+    for v in (0.005, 0.005, 0.05, 0.5, 5.0):
+        h.observe(v)
+    assert h.count == 5
+    assert h.cumulative() == [(0.01, 2), (0.1, 3), (1.0, 4), (float('inf'), 5)]
+    # 第2.5个落在 (0.01, 0.1] 桶里的一半
+    assert abs(h.quantile(0.5) - 0.055) < 1e-9
+    # 落在 +Inf 桶里，返回最大的有限上界
+    assert h.quantile(0.99) == 1.0
+
+
+def test_recorder_summary_in_stage_order():
+    r = timing.StageRecorder()
+    r.observe('render', 0.002)
+    r.observe('total', 0.004)
+    r.observe('auth', 0.001)
+    assert [row[0] for row in r.summary()] == ['total', 'auth', 'render']
+    stage, count, mean, p50, p90, p99 = r.summary()[0]
+    assert (count, mean) == (1, 0.004)
+
+
+def test_request_timer_collects_from_context():
+    assert timing.current() is None
+    timing.add('db', 1.0)  # 不在请求里，忽略
+    timer, token = timing.start_request()
+    try:
+        timing.add('db', 0.002)
+        timing.add('db', 0.003)
+        with timing.measure('markdown'):
+            pass
+    finally:
+        timing.end_request(token)
+    assert timing.current() is None
+    assert list(timer.durations) == ['db', 'markdown']
+    header = timer.server_timing(0.01)
+    assert header.startswith('db;dur=5.0;desc="2 calls", markdown;dur=')
+    assert header.endswith('total;dur=10.0')
+    assert timer.as_dict()['db'] == dict(ms=5.0, count=2)
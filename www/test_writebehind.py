@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''writebehind.py 的测试，数据库换成 fakedb.FakePool'''
+
+import json, asyncio
+
+import pytest
+
+pytest.importorskip('aiomysql')
+
+import orm
+from orm import Model, StringField, FloatField
+from fakedb import FakePool
+from writebehind import WriteBehindQueue
+
+
+class Note(Model):
+	__table__ = 'notes'
+
+	id = StringField(primary_key=True, ddl='varchar(50)')
+	body = StringField()
+	created_at = FloatField()
+
+
+def run(coro):
+	return asyncio.new_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+	pool = FakePool()
+	monkeypatch.setattr(orm, '__pool', pool, raising=False)
+	return pool
+
+
+def journal_ids(path):
+	# 和重放一样: 去掉有完成标记的记录
+	ids = []
+	with open(path, encoding='utf-8') as f:
+		for line in f:
+			d = json.loads(line)
+			if '__done__' in d:
+				ids = [id for id in ids if id not in d['__done__']]
+			else:
+				ids.append(d['id'])
+	return ids
+
+
+def inserted_ids(pool):
+	# 每行三个参数: body, created_at, id
+	return [args[i] for sql, args in pool.executed if sql.startswith('insert') for i in range(2, len(args), 3)]
+
+
+def note(id):
+	return Note(id=id, body='note %s' % id, created_at=1.0)
+
+
+def test_replay_journal_with_truncated_last_line(pool, tmp_path):
+	path = str(tmp_path / 'notes.journal')
+	with open(path, 'w', encoding='utf-8') as f:
+		f.write(json.dumps(note('1')) + '\n')
+		f.write(json.dumps(note('2')) + '\n')
+		# 写最后一行时进程崩溃
+		f.write(json.dumps(note('3'))[:10])
+
+	async def main():
+		queue = WriteBehindQueue(Note, path, flush_interval=100)
+		await queue.start(asyncio.get_event_loop())
+		await queue.close()
+	run(main())
+	assert inserted_ids(pool) == ['1', '2']
+	assert journal_ids(path) == []
+
+
+def test_compact_journal_after_partial_flush(pool, tmp_path, monkeypatch):
+	path = str(tmp_path / 'notes.journal')
+	calls = []
+	save_all = Note.saveAll
+
+	@asyncio.coroutine
+	def flaky(instances, ignore=False):
+		calls.append(len(instances))
+		if len(calls) > 1:
+			raise OSError('connection lost')
+		return (yield from save_all(instances, ignore))
+	monkeypatch.setattr(Note, 'saveAll', flaky)
+
+	async def main():
+		queue = WriteBehindQueue(Note, path, max_batch=2, flush_interval=100)
+		await queue.start(asyncio.get_event_loop())
+		for id in ('1', '2', '3'):
+			queue.add(note(id))
+		await asyncio.sleep(0.01)
+		pending = [n.id for n in queue.pending()]
+		await queue.close()
+		return pending
+	pending = run(main())
+	assert calls[:2] == [2, 1]
+	# 第一批写进去了，日志里只剩没写库的
+	assert inserted_ids(pool) == ['1', '2']
+	assert pending == ['3']
+	assert journal_ids(path) == ['3']
+
+
+def test_flush_on_max_batch(pool, tmp_path):
+	async def main():
+		queue = WriteBehindQueue(Note, str(tmp_path / 'notes.journal'), max_batch=3, flush_interval=100)
+		await queue.start(asyncio.get_event_loop())
+		queue.add(note('1'))
+		queue.add(note('2'))
+		await asyncio.sleep(0.01)
+		before = inserted_ids(pool)
+		queue.add(note('3'))
+		await asyncio.sleep(0.01)
+		after = inserted_ids(pool)
+		await queue.close()
+		return before, after
+	before, after = run(main())
+	assert before == []
+	assert after == ['1', '2', '3']
+	# 一批只用一条 insert
+	assert len(pool.executed) == 1
+
+
+def test_flush_on_interval(pool, tmp_path):
+	async def main():
+		queue = WriteBehindQueue(Note, str(tmp_path / 'notes.journal'), max_batch=100, flush_interval=0.02)
+		await queue.start(asyncio.get_event_loop())
+		queue.add(note('1'))
+		await asyncio.sleep(0.06)
+		flushed = inserted_ids(pool)
+		await queue.close()
+		return flushed
+	assert run(main()) == ['1']
+
+
+def test_discard_pending(pool, tmp_path):
+	path = str(tmp_path / 'notes.journal')
+
+	async def main():
+		queue = WriteBehindQueue(Note, path, flush_interval=100)
+		await queue.start(asyncio.get_event_loop())
+		queue.add(note('1'))
+		queue.add(note('2'))
+		discarded = queue.discard('1')
+		missing = queue.discard('404')
+		journal = journal_ids(path)
+		await queue.close()
+		return discarded, missing, journal
+	discarded, missing, journal = run(main())
+	assert discarded.id == '1'
+	assert missing is None
+	assert journal == ['2']
+	assert inserted_ids(pool) == ['2']
+
+
+def test_discard_in_flight_deletes_after_insert(pool, tmp_path, monkeypatch):
+	path = str(tmp_path / 'notes.journal')
+	save_all = Note.saveAll
+
+	@asyncio.coroutine
+	def slow(instances, ignore=False):
+		yield from asyncio.sleep(0.02)
+		return (yield from save_all(instances, ignore))
+	monkeypatch.setattr(Note, 'saveAll', slow)
+
+	async def main():
+		queue = WriteBehindQueue(Note, path, flush_interval=100)
+		await queue.start(asyncio.get_event_loop())
+		queue.add(note('1'))
+		flush = asyncio.ensure_future(queue.flush())
+		await asyncio.sleep(0.005)
+		# 这一行正在写库
+		discarded = queue.discard('1')
+		journal = journal_ids(path)
+		await flush
+		await queue.close()
+		return discarded, journal
+	discarded, journal = run(main())
+	assert discarded.id == '1'
+	assert journal == []
+	# 先插入，写完后马上删除
+	assert [sql.split()[0] for sql, args in pool.executed] == ['insert', 'delete']
+	assert pool.executed[1][1] == ['1']
+
+
+def test_on_flush_gets_written_rows(pool, tmp_path, monkeypatch):
+	flushed = []
+	save_all = Note.saveAll
+
+	@asyncio.coroutine
+	def slow(instances, ignore=False):
+		yield from asyncio.sleep(0.02)
+		return (yield from save_all(instances, ignore))
+	monkeypatch.setattr(Note, 'saveAll', slow)
+
+	@asyncio.coroutine
+	def on_flush(rows):
+		flushed.append([n.id for n in rows])
+
+	async def main():
+		queue = WriteBehindQueue(Note, str(tmp_path / 'notes.journal'), flush_interval=100, on_flush=on_flush)
+		await queue.start(asyncio.get_event_loop())
+		queue.add(note('1'))
+		queue.add(note('2'))
+		flush = asyncio.ensure_future(queue.flush())
+		await asyncio.sleep(0.005)
+		queue.discard('2')
+		await flush
+		await queue.close()
+	run(main())
+	# 写库期间被删除的不算
+	assert flushed == [['1']]
+
+
+def test_on_flush_skips_replayed_rows_already_in_db(tmp_path, monkeypatch):
+	# 进程在 '1' 写库之后、压缩日志之前崩溃
+	pool = FakePool({'notes': [dict(id='1')]})
+	monkeypatch.setattr(orm, '__pool', pool, raising=False)
+	path = str(tmp_path / 'notes.journal')
+	with open(path, 'w', encoding='utf-8') as f:
+		f.write(json.dumps(note('1')) + '\n')
+		f.write(json.dumps(note('2')) + '\n')
+	flushed = []
+
+	@asyncio.coroutine
+	def on_flush(rows):
+		flushed.append([n.id for n in rows])
+
+	async def main():
+		queue = WriteBehindQueue(Note, path, flush_interval=100, on_flush=on_flush)
+		await queue.start(asyncio.get_event_loop())
+		queue.add(note('3'))
+		await queue.flush()
+		await queue.close()
+	run(main())
+	assert inserted_ids(pool) == ['1', '2', '3']
+	assert flushed == [['2'], ['3']]
+
+
+def test_journal_is_append_only_until_threshold(pool, tmp_path, monkeypatch):
+	path = str(tmp_path / 'notes.journal')
+	save_all = Note.saveAll
+
+	@asyncio.coroutine
+	def fail_last(instances, ignore=False):
+		if instances[0].id == '9':
+			raise OSError('connection lost')
+		return (yield from save_all(instances, ignore))
+	monkeypatch.setattr(Note, 'saveAll', fail_last)
+
+	def lines():
+		with open(path, encoding='utf-8') as f:
+			return [json.loads(line) for line in f]
+
+	async def main(compact_bytes):
+		queue = WriteBehindQueue(Note, path, max_batch=2, flush_interval=100, compact_bytes=compact_bytes)
+		await queue.start(asyncio.get_event_loop())
+		for i in range(1, 6):
+			queue.add(note(str(i)))
+		queue.add(note('9'))
+		queue.discard('5')
+		await asyncio.sleep(0.01)
+		result = lines()
+		queue._journal.close()
+		queue._lock.close()
+		return result
+
+	journal = run(main(10 ** 6))
+	# 记录后面只追加了完成标记，没有重写
+	assert [d['id'] for d in journal if 'id' in d] == ['1', '2', '3', '4', '5', '9']
+	assert [d['__done__'] for d in journal if '__done__' in d] == [['5'], ['1', '2'], ['3', '4']]
+	assert journal_ids(path) == ['9']
+
+	# 日志超过阈值时重写，只留下没写库的记录
+	path = str(tmp_path / 'small.journal')
+	journal = run(main(1))
+	assert journal == [json.loads(json.dumps(note('9')))]
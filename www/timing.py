@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+请求各阶段的耗时统计: 中间件按阶段(auth、handler、render、serialize、total)记录耗时，
+汇总成和Prometheus一样的累积直方图(桶的上界 le、总数 count、总和 sum)，可以估算分位数.
+
+    recorder = StageRecorder()
+    recorder.observe('render', 0.0042)
+    for stage, count, mean, p50, p90, p99 in recorder.summary(): ...
+
+单个请求的耗时分解: logger_middleware 为每个请求开一个 RequestTimer，放在 contextvar 里，
+orm、markdown转换、模板渲染不用传参数就能把耗时记到当前请求上，最后写成 Server-Timing 响应头:
+
+    with timing.measure('markdown'):
+        blog.html_content = markdown2.markdown(blog.content)
+'''
+
+import time, bisect, logging, contextlib, contextvars
+
+# 桶的上界(秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 按请求处理的先后排列
+STAGES = ('total', 'auth', 'handler', 'render', 'serialize')
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # 每个桶(不累积)的次数，最后一个是 +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        '''
+        返回 [(上界, 小于等于上界的次数)]，最后一项的上界为 float('inf')。
+        '''
+        result, total = [], 0
+        for le, n in zip(self.buckets + (float('inf'),), self._counts):
+            total += n
+            result.append((le, total))
+        return result
+
+    def quantile(self, q):
+        '''
+        和 Prometheus 的 histogram_quantile 一样，在所在的桶里线性插值估算分位数。
+        '''
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        lower, seen = 0.0, 0
+        for le, n in zip(self.buckets, self._counts):
+            if seen + n >= rank and n:
+                return lower + (le - lower) * (rank - seen) / n
+            seen += n
+            lower = le
+        # 落在 +Inf 桶里，只能返回最大的有限上界
+        return self.buckets[-1]
+
+    def merge(self, other):
+        for i, n in enumerate(other._counts):
+            self._counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+
+class StageRecorder(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self.histograms = {}
+
+    def observe(self, stage, seconds):
+        h = self.histograms.get(stage)
+        if h is None:
+            h = self.histograms[stage] = Histogram(self._buckets)
+        h.observe(seconds)
+
+    def summary(self):
+        '''
+        返回 [(阶段, 次数, 平均值, p50, p90, p99)]，时间单位为秒。
+        '''
+        order = {s: i for i, s in enumerate(STAGES)}
+        rows = []
+        for stage in sorted(self.histograms, key=lambda s: (order.get(s, len(order)), s)):
+            h = self.histograms[stage]
+            rows.append((stage, h.count, h.sum / h.count if h.count else 0.0,
+                         h.quantile(0.5), h.quantile(0.9), h.quantile(0.99)))
+        return rows
+
+    def log_summary(self):
+        for stage, count, mean, p50, p90, p99 in self.summary():
+            logging.info('stage %-10s count=%d mean=%.2fms p50=%.2fms p90=%.2fms p99=%.2fms' % (
+                stage, count, mean * 1e3, p50 * 1e3, p90 * 1e3, p99 * 1e3))
+
+
+def schedule_report(loop, recorder, interval):
+    '''
+    每隔 interval 秒把统计结果写进日志。
+    '''
+    def tick():
+        recorder.log_summary()
+        loop.call_later(interval, tick)
+
+    if interval:
+        loop.call_later(interval, tick)
+
+
+# 当前请求的 RequestTimer；asyncio 的任务创建时会复制 context，处理函数里再开的任务也记在这个请求上
+_current = contextvars.ContextVar('request_timer', default=None)
+
+
+class RequestTimer(object):
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # 名字 -> (累计秒数, 次数)，按第一次出现的先后排列
+        self.durations = {}
+
+    def add(self, name, seconds):
+        total, count = self.durations.get(name, (0.0, 0))
+        self.durations[name] = (total + seconds, count + 1)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total=None):
+        '''
+        生成 Server-Timing 响应头，例如 db;dur=3.2;desc="4 queries", render;dur=1.1, total;dur=5.0
+        '''
+        metrics = []
+        for name, (seconds, count) in self.durations.items():
+            metric = '%s;dur=%.1f' % (name, seconds * 1e3)
+            if count > 1:
+                metric += ';desc="%d calls"' % count
+            metrics.append(metric)
+        metrics.append('total;dur=%.1f' % ((self.elapsed() if total is None else total) * 1e3))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        # 毫秒，写结构化日志用
+        return {name: dict(ms=round(seconds * 1e3, 2), count=count) for name, (seconds, count) in self.durations.items()}
+
+
+def start_request():
+    '''
+    开始记录一个请求，返回 (timer, token)，结束时把 token 交给 end_request()。
+    '''
+    timer = RequestTimer()
+    return timer, _current.set(timer)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def add(name, seconds):
+    '''
+    把一段耗时记到当前请求上；不在请求里(启动、后台任务)时什么都不做。
+    '''
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+@contextlib.contextmanager
+def measure(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
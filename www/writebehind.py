@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+写缓冲(write-behind): 先接收写入并记到本地追加日志里，再按条数或时间批量写库.
+
+评论刷屏时，每条评论一次单行insert会压垮数据库；放进缓冲后，一批评论只需要一条多行insert。
+日志文件保证进程重启后还没写库的记录不会丢，启动时会先重放日志。
+
+日志只追加: 每行是一条记录，或者一个 {"__done__": [主键, ...]} 标记，表示这些记录已经写库或被删除，重放时跳过。
+缓冲清空时直接截断日志；积压时日志超过 compact_bytes 才重写一次，只留下还没写库的记录，
+不会每写一批就重写整个日志。
+
+每个日志文件旁边有一个 .lock 文件，用 flock 锁住，同一时间只有一个进程写它。热重载(server.py)时
+新进程启动时旧进程还在，拿不到锁就改用 <日志>~1、<日志>~2...；启动时再把没人持有的日志(旧进程退出或崩溃留下的)
+读进来，写进自己的日志后删掉。
+'''
+
+import os, glob, json, fcntl, asyncio, logging
+
+# 表名 -> WriteBehindQueue
+_queues = {}
+
+
+def register(queue):
+	_queues[queue.model.__table__] = queue
+
+
+def get(model):
+	'''
+	返回 model 的写缓冲，没有启用时返回None，调用方直接 save() 即可。
+	'''
+	return _queues.get(model.__table__)
+
+
+@asyncio.coroutine
+def close_all():
+	for queue in list(_queues.values()):
+		yield from queue.close()
+
+
+class WriteBehindQueue(object):
+
+	def __init__(self, model, journal_path, max_batch=100, flush_interval=1.0, fsync=False, on_flush=None,
+				 compact_bytes=1024 * 1024):
+		self.model = model
+		# 配置的日志路径；实际写的可能是 <journal_path>~N，见 start()
+		self.base_path = journal_path
+		self.journal_path = journal_path
+		self._lock = None
+		self.max_batch = max_batch
+		self.flush_interval = flush_interval
+		# fsync=True 时每条记录都落盘，机器掉电也不丢，但每次写入要多花一次磁盘同步
+		self.fsync = fsync
+		# 每写库一批后调用的协程函数，参数是这一批写进去的记录(比如按批更新博客的评论计数)
+		self.on_flush = on_flush
+		self.compact_bytes = compact_bytes
+		self._pending = []
+		self._journal = None
+		self._flushing = False
+		self._inflight = ()
+		# 正在写库时被删除的记录: 等这一批写完再从库里删掉
+		self._tombstones = []
+		# 可能已经写过库的记录的主键: 重放日志读进来的、写库失败(可能其实已经提交了)的。
+		# insert ignore 会跳过已有的行，on_flush 也不能再算它们一次
+		self._uncertain = set()
+		self._timer = None
+		self._loop = None
+
+	@asyncio.coroutine
+	def start(self, loop):
+		self._loop = loop
+		n = 0
+		while True:
+			path = self.base_path if n == 0 else '%s~%d' % (self.base_path, n)
+			self._lock = _try_lock(path)
+			if self._lock is not None:
+				break
+			n += 1
+		self.journal_path = path
+		self._replay(path)
+		# 其他没人持有的日志: 旧进程退出或崩溃前没写库的记录
+		adopted = []
+		for other in [self.base_path] + sorted(glob.glob(glob.escape(self.base_path) + '~*[0-9]')):
+			if other == path or not os.path.exists(other):
+				continue
+			lock = _try_lock(other)
+			if lock is not None:
+				self._replay(other)
+				adopted.append((other, lock))
+		self._journal = open(self.journal_path, 'a', encoding='utf-8')
+		# 去掉已完成的记录和崩溃时留下的半行；接管的日志先写进自己的日志再删掉原来的，中途崩溃最多重复(insert ignore)，不会丢
+		self._compact_journal()
+		if adopted:
+			for other, lock in adopted:
+				logging.info('write-behind %s: adopted journal %s' % (self.model.__table__, other))
+				_remove_journal(other, lock)
+		logging.info('write-behind %s: journal %s, %s pending' % (self.model.__table__, self.journal_path, len(self._pending)))
+		if self._pending:
+			yield from self.flush()
+		self._schedule()
+
+	def _replay(self, path):
+		if not os.path.exists(path):
+			return
+		key = self.model.__primary_key__
+		# 主键 -> 记录，按写入顺序
+		records = {}
+		with open(path, 'r', encoding='utf-8') as f:
+			for line in f:
+				try:
+					d = json.loads(line)
+				except ValueError:
+					# 进程在写最后一行时崩溃，留下半行，丢弃即可
+					logging.warning('skip broken journal line in %s' % path)
+					continue
+				if '__done__' in d:
+					for pk in d['__done__']:
+						records.pop(str(pk), None)
+				else:
+					records[str(d.get(key))] = d
+		for pk, d in records.items():
+			self._pending.append(self.model(**d))
+			self._uncertain.add(pk)
+
+	def _write_journal(self, obj):
+		self._journal.write(json.dumps(obj, ensure_ascii=False) + '\n')
+		self._journal.flush()
+		if self.fsync:
+			os.fsync(self._journal.fileno())
+
+	# 记下这些记录已经写库或被删除
+	def _mark_done(self, objs):
+		key = self.model.__primary_key__
+		if not self._pending:
+			# 没有积压，清空日志即可。截断没落盘也没关系，重放时有完成标记
+			self._journal.seek(0)
+			self._journal.truncate()
+			return
+		self._write_journal({'__done__': [obj.getValue(key) for obj in objs]})
+		if self._journal.tell() >= self.compact_bytes:
+			self._compact_journal()
+
+	# 只留下还没写库的记录，先写临时文件再替换，中途崩溃也不会损坏日志
+	def _compact_journal(self):
+		tmp = self.journal_path + '.tmp'
+		with open(tmp, 'w', encoding='utf-8') as f:
+			for obj in self._pending:
+				f.write(json.dumps(obj, ensure_ascii=False) + '\n')
+			f.flush()
+			os.fsync(f.fileno())
+		self._journal.close()
+		os.replace(tmp, self.journal_path)
+		self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+	def add(self, obj):
+		'''
+		接收一条记录并立即返回，主键和默认值在这里就生成好，调用方可以马上把它返回给客户端。
+		'''
+		for key in self.model.__fields__ + [self.model.__primary_key__]:
+			obj.getValueOrDefault(key)
+		self._write_journal(obj)
+		self._pending.append(obj)
+		if len(self._pending) >= self.max_batch:
+			asyncio.ensure_future(self.flush(), loop=self._loop)
+		return obj
+
+	def pending(self, field=None, value=None):
+		'''
+		读路径使用: 返回还没写库的记录，给出 field 和 value 时只返回 field 等于 value 的。
+		'''
+		if field is None:
+			return list(self._pending)
+		return [obj for obj in self._pending if str(obj.getValue(field)) == str(value)]
+
+	def discard(self, pk):
+		'''
+		删除一条还没写库的记录，返回被删除的记录，没找到返回None。
+		'''
+		key = self.model.__primary_key__
+		for obj in self._pending:
+			if str(obj.getValue(key)) == str(pk):
+				self._pending.remove(obj)
+				self._mark_done([obj])
+				# 正在写库的那一批撤不回来了，flush() 写完后再删掉这一行
+				if any(obj is b for b in self._inflight):
+					self._tombstones.append(obj)
+				return obj
+		return None
+
+	def _schedule(self):
+		self._timer = self._loop.call_later(self.flush_interval, self._tick)
+
+	def _tick(self):
+		asyncio.ensure_future(self.flush(), loop=self._loop)
+		self._schedule()
+
+	@asyncio.coroutine
+	def flush(self):
+		if self._flushing or not (self._pending or self._tombstones):
+			return
+		self._flushing = True
+		try:
+			yield from self._remove_tombstones()
+			while self._pending:
+				batch = self._inflight = self._pending[:self.max_batch]
+				try:
+					existing = yield from self._existing(batch)
+					# insert ignore: 重放日志时已经写过库的记录会被跳过
+					yield from self.model.saveAll(batch, ignore=True)
+				except Exception as e:
+					logging.exception('write-behind %s: flush failed, will retry: %s' % (self.model.__table__, e))
+					# 这一批没写进去，写库期间被删除的记录也就不用再删了
+					self._tombstones = [obj for obj in self._tombstones if not any(obj is b for b in batch)]
+					# 也可能已经提交了只是没收到结果
+					self._uncertain.update(str(obj.getValue(self.model.__primary_key__)) for obj in batch)
+					return
+				done = set(map(id, batch))
+				self._pending = [obj for obj in self._pending if id(obj) not in done]
+				self._mark_done(batch)
+				self._inflight = ()
+				logging.info('write-behind %s: flushed %s rows' % (self.model.__table__, len(batch)))
+				key = self.model.__primary_key__
+				self._uncertain.difference_update(str(obj.getValue(key)) for obj in batch)
+				# 只把这次真正插入的行交给 on_flush
+				yield from self._after_flush([obj for obj in batch if str(obj.getValue(key)) not in existing
+											  and not any(obj is t for t in self._tombstones)])
+				yield from self._remove_tombstones()
+		finally:
+			self._inflight = ()
+			self._flushing = False
+
+	# 这一批里可能已经写过库的记录，返回库里已经有的主键(字符串)
+	@asyncio.coroutine
+	def _existing(self, batch):
+		key = self.model.__primary_key__
+		pks = [obj.getValue(key) for obj in batch if str(obj.getValue(key)) in self._uncertain]
+		if not pks or self.on_flush is None:
+			return set()
+		sql = 'select `%s` from `%s` where `%s` in (%s)' % (key, self.model.__table__, key, ', '.join(['?'] * len(pks)))
+		rows = yield from self.model.selectRows(sql, pks)
+		return set(str(r[key]) for r in rows)
+
+	@asyncio.coroutine
+	def _after_flush(self, rows):
+		if self.on_flush is None or not rows:
+			return
+		try:
+			yield from self.on_flush(rows)
+		except Exception as e:
+			# 记录已经写进去了，不能重试整批；计数之类的偏差由定期修正(counters.reconcile)补上
+			logging.exception('write-behind %s: on_flush failed: %s' % (self.model.__table__, e))
+
+	@asyncio.coroutine
+	def _remove_tombstones(self):
+		# 删除失败的留到下次 flush() 再试
+		while self._tombstones:
+			obj = self._tombstones[0]
+			try:
+				yield from obj.remove()
+			except Exception as e:
+				logging.exception('write-behind %s: remove discarded row failed, will retry: %s' % (self.model.__table__, e))
+				return
+			self._tombstones.pop(0)
+
+	@asyncio.coroutine
+	def close(self):
+		if self._timer is not None:
+			self._timer.cancel()
+		yield from self.flush()
+		if self._journal is not None:
+			self._journal.close()
+			self._journal = None
+		if self._lock is not None:
+			# 热重载时临时用的 ~N 日志写完了就删掉
+			if self.journal_path != self.base_path and not self._pending:
+				_remove_journal(self.journal_path, self._lock)
+			else:
+				self._lock.close()
+			self._lock = None
+
+
+def _try_lock(path):
+	'''
+	锁住 path 对应的 .lock 文件，别的进程持有时返回 None。进程退出时锁自动释放。
+	'''
+	f = open(path + '.lock', 'a')
+	try:
+		fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+	except OSError:
+		f.close()
+		return None
+	return f
+
+
+def _remove_journal(path, lock):
+	for p in (path, path + '.lock'):
+		if os.path.exists(p):
+			os.unlink(p)
+	lock.close()